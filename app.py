@@ -7,9 +7,14 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, login_user, logout_user, login_required, current_user
 from flask_wtf.csrf import CSRFProtect
 from flask_caching import Cache
+from collections import Counter
 from datetime import datetime
+import atexit
 import os
+import threading
+import time
 from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 
 # Initialize Flask app
 app = Flask(__name__)
@@ -18,6 +23,8 @@ app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:/
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['CACHE_TYPE'] = 'simple'  # Use Redis in production
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max upload
+app.config['REACTION_FLUSH_MS'] = int(os.environ.get('REACTION_FLUSH_MS', 0))  # 0 = write every click through
+app.config['REACTION_FLUSH_RETRIES'] = 5  # failed flushes in a row before buffered clicks are dropped
 
 # Initialize extensions
 db = SQLAlchemy(app)
@@ -63,13 +70,23 @@ class Note(db.Model):
     message = db.Column(db.Text, nullable=False)
     is_anonymous = db.Column(db.Boolean, default=False)
     status = db.Column(db.String(20), default='pending', index=True)  # pending, approved, archived, deleted
-    reactions = db.Column(db.JSON, default={'heart': 0, 'laugh': 0, 'wow': 0})
+    reactions = db.Column(db.JSON(none_as_null=True), nullable=True)  # legacy, superseded by NoteReaction; see migrate_reactions
     is_private = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
+    reaction_counts = db.relationship('NoteReaction', lazy='dynamic', cascade='all, delete-orphan')
+    
     def __repr__(self):
         return f'<Note {self.id} for User {self.user_id}>'
 
+class NoteReaction(db.Model):
+    """One counter row per (note, reaction), bumped with UPDATE ... SET count = count + n"""
+    __tablename__ = 'note_reactions'
+    
+    note_id = db.Column(db.Integer, db.ForeignKey('notes.id'), primary_key=True)
+    reaction = db.Column(db.String(20), primary_key=True)
+    count = db.Column(db.Integer, nullable=False, default=0)
+
 # ============================================
 # Login Manager
 # ============================================
@@ -92,6 +109,16 @@ def check_profanity(text):
     bad_words = ['spam', 'scam']  # Add comprehensive list
     return any(word in text.lower() for word in bad_words)
 
+def diary_cache_key():
+    """Cache key for diary_page, versioned per diary so a write can invalidate every page of it"""
+    username = request.view_args['username']
+    version = cache.get(f'diary_version/{username}') or 0
+    page = request.args.get('page', 1, type=int)
+    return f'diary/{username}/v{version}/p{page}/owner{session.get("diary_owner")}'
+
+def invalidate_diary(username):
+    cache.set(f'diary_version/{username}', (cache.get(f'diary_version/{username}') or 0) + 1, timeout=0)
+
 def get_time_ago(dt):
     """Convert datetime to relative time"""
     now = datetime.utcnow()
@@ -110,6 +137,103 @@ def get_time_ago(dt):
     else:
         return "Just now"
 
+# ============================================
+# Reactions
+# ============================================
+
+REACTION_TYPES = ('heart', 'laugh', 'wow')
+
+def increment_reactions(increments):
+    """Apply {(note_id, reaction): n} as atomic counter updates in one transaction"""
+    table = NoteReaction.__table__
+    
+    def bump(note_id, reaction, n):
+        return db.session.execute(
+            table.update()
+            .where(table.c.note_id == note_id, table.c.reaction == reaction)
+            .values(count=table.c.count + n)
+        ).rowcount
+    
+    for (note_id, reaction), n in increments.items():
+        if bump(note_id, reaction, n):
+            continue
+        try:
+            with db.session.begin_nested():
+                db.session.execute(table.insert().values(note_id=note_id, reaction=reaction, count=n))
+        except IntegrityError:
+            # Another request created the row first
+            bump(note_id, reaction, n)
+    
+    db.session.commit()
+
+def get_reactions(note_id):
+    counts = dict.fromkeys(REACTION_TYPES, 0)
+    counts.update(db.session.query(NoteReaction.reaction, NoteReaction.count).filter_by(note_id=note_id).all())
+    for reaction, n in reaction_buffer.pending_for(note_id).items():
+        counts[reaction] += n
+    return counts
+
+class ReactionBuffer:
+    """Coalesces reaction clicks in memory and flushes the summed increments every interval_ms
+
+    A batch that fails to write goes back into the buffer for the next flush,
+    until max_retries flushes in a row have failed.
+    """
+    
+    def __init__(self, interval_ms, max_retries):
+        self.interval = interval_ms / 1000
+        self.max_retries = max_retries
+        self.pending = Counter()
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.thread = None
+    
+    def add(self, note_id, reaction):
+        with self.lock:
+            self.pending[(note_id, reaction)] += 1
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, daemon=True)
+                self.thread.start()
+                atexit.register(self.flush)
+    
+    def pending_for(self, note_id):
+        with self.lock:
+            return {reaction: n for (nid, reaction), n in self.pending.items() if nid == note_id}
+    
+    def flush(self):
+        with self.lock:
+            batch, self.pending = self.pending, Counter()
+        if not batch:
+            return
+        try:
+            with app.app_context():
+                try:
+                    increment_reactions(batch)
+                except Exception:
+                    db.session.rollback()
+                    raise
+        except Exception:
+            with self.lock:
+                self.failures += 1
+                if self.failures <= self.max_retries:
+                    self.pending.update(batch)
+                    raise
+                self.failures = 0
+            app.logger.error('Dropped %d reactions after %d failed flushes', sum(batch.values()), self.max_retries + 1)
+            raise
+        with self.lock:
+            self.failures = 0
+    
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                app.logger.exception('Failed to flush reactions')
+
+reaction_buffer = ReactionBuffer(app.config['REACTION_FLUSH_MS'], app.config['REACTION_FLUSH_RETRIES'])
+
 # ============================================
 # Routes - Main Pages
 # ============================================
@@ -146,7 +270,7 @@ def create_diary():
     return redirect(url_for('diary_page', username=username))
 
 @app.route('/<username>')
-@cache.cached(timeout=300, query_string=True)  # Cache for 5 minutes
+@cache.cached(timeout=300, key_prefix=diary_cache_key)  # Cache for 5 minutes
 def diary_page(username):
     """Public diary page"""
     user = User.query.filter_by(username=username).first_or_404()
@@ -210,7 +334,7 @@ def leave_note(username):
     db.session.commit()
     
     # Clear cache
-    cache.delete_memoized(diary_page, username)
+    invalidate_diary(username)
     
     return jsonify({
         'success': True,
@@ -241,10 +365,12 @@ def dashboard(username):
         'total_notes': Note.query.filter_by(user_id=user.id).count(),
         'approved_count': len(approved),
         'pending_count': len(pending),
-        'total_reactions': sum(
-            sum(note.reactions.values()) 
-            for note in Note.query.filter_by(user_id=user.id, status='approved').all()
-        )
+        'total_reactions': db.session.query(
+            db.func.coalesce(db.func.sum(NoteReaction.count), 0)
+        ).join(Note).filter(
+            Note.user_id == user.id,
+            Note.status == 'approved'
+        ).scalar()
     }
     
     return render_template('dashboard.html',
@@ -267,7 +393,7 @@ def approve_note(note_id):
     
     # Clear cache
     user = User.query.get(note.user_id)
-    cache.delete_memoized(diary_page, user.username)
+    invalidate_diary(user.username)
     
     return jsonify({'success': True})
 
@@ -281,6 +407,7 @@ def archive_note(note_id):
     
     note.status = 'archived'
     db.session.commit()
+    invalidate_diary(note.owner.username)
     
     return jsonify({'success': True})
 
@@ -292,28 +419,31 @@ def delete_note(note_id):
     if session.get('diary_owner') != note.user_id:
         return jsonify({'error': 'Unauthorized'}), 403
     
+    username = note.owner.username
     db.session.delete(note)
     db.session.commit()
+    invalidate_diary(username)
     
     return jsonify({'success': True})
 
 @app.route('/note/<int:note_id>/react', methods=['POST'])
 def react_to_note(note_id):
     """Add reaction to note"""
-    note = Note.query.get_or_404(note_id)
     reaction_type = request.json.get('type')
     
-    if reaction_type not in ['heart', 'laugh', 'wow']:
+    if reaction_type not in REACTION_TYPES:
         return jsonify({'error': 'Invalid reaction'}), 400
     
-    # Increment reaction
-    reactions = note.reactions or {'heart': 0, 'laugh': 0, 'wow': 0}
-    reactions[reaction_type] = reactions.get(reaction_type, 0) + 1
-    note.reactions = reactions
+    if db.session.query(Note.id).filter_by(id=note_id).first() is None:
+        return jsonify({'error': 'Note not found'}), 404
     
-    db.session.commit()
+    # Increment reaction without touching the note row
+    if reaction_buffer.interval:
+        reaction_buffer.add(note_id, reaction_type)
+    else:
+        increment_reactions({(note_id, reaction_type): 1})
     
-    return jsonify({'success': True, 'reactions': reactions})
+    return jsonify({'success': True, 'reactions': get_reactions(note_id)})
 
 @app.route('/discover')
 @cache.cached(timeout=300)
@@ -340,7 +470,7 @@ def search():
         return jsonify([])
     
     users = User.query.filter(
-        User.username.like(f'%{query}%')
+        User.username.contains(query, autoescape=True)
     ).limit(10).all()
     
     return jsonify([{
@@ -378,6 +508,25 @@ def init_db():
     db.create_all()
     print('Database initialized!')
 
+@app.cli.command()
+def migrate_reactions():
+    """Copy reaction counts from the legacy notes.reactions JSON into note_reactions"""
+    db.create_all()
+    migrated = 0
+    while True:
+        notes = Note.query.filter(Note.reactions.isnot(None)).limit(500).all()
+        if not notes:
+            break
+        increments = Counter()
+        for note in notes:
+            for reaction, count in (note.reactions or {}).items():
+                if count:
+                    increments[(note.id, reaction)] += count
+            note.reactions = None
+        increment_reactions(increments)  # commits the cleared JSON along with the counters
+        migrated += len(notes)
+    print(f'Migrated reactions for {migrated} notes')
+
 @app.cli.command()
 def seed_db():
     """Seed database with sample data"""
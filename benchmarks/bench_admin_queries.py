@@ -0,0 +1,107 @@
+"""Query budgets for the admin pages: fails when a page issues more statements than it is allowed.
+
+    python benchmarks/bench_admin_queries.py --users 500 --flagged 400
+
+Seeds users and flagged messages spread over many recipients, requests each
+admin page as the admin and counts its statements with perf.count_queries.
+The budgets do not grow with the data, so a lazy load per row (an N+1), or
+a deferred column the template touches after all, fails the run. Exits 1
+if any page is over budget.
+"""
+import argparse
+import atexit
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message, Job
+from mydiary.perf import count_queries
+
+# Statements per page, including the one that loads the signed-in admin
+BUDGETS = {
+    '/admin/': 3,  # admin, totals from user_stats, newest users
+    '/admin/flagged': 2,  # admin, one page of messages with their recipients joined
+    '/admin/flagged?cursor': 2,
+    '/admin/jobs': 5,  # admin, three aggregate queries, recent failures
+    '/admin/perf': 1,
+}
+
+def make_app(workdir):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'admin.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'WTF_CSRF_ENABLED': False,
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+    return app
+
+def seed(users, flagged, rng):
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [
+        {'username': f'user{i}', 'email': f'user{i}@bench.io', 'created_at': now - timedelta(minutes=i)}
+        for i in range(users)
+    ])
+    user_ids = db.session.execute(db.select(User.id)).scalars().all()
+    db.session.execute(db.insert(Message), [
+        {'recipient_id': rng.choice(user_ids), 'content': f'flagged message {i}', 'sender_ip': f'10.0.0.{i % 250}',
+         'is_flagged': True, 'spam_score': rng.random(), 'created_at': now - timedelta(seconds=i)}
+        for i in range(flagged)
+    ])
+    db.session.add_all(Job(task='rebuild-stats', status='failed', attempts=3, max_attempts=3,
+                           last_error='Traceback ...', run_at=now) for _ in range(30))
+    db.session.commit()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--flagged', type=int, default=400)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    app = make_app(workdir)
+    client = app.test_client()
+    with app.app_context():
+        seed(args.users, args.flagged, random.Random(42))
+        engine = db.engine
+    # Outside the app context, so each request loads the admin afresh as it would in production
+    client.post('/auth/login', data={'email': app.config['ADMIN_EMAIL'], 'password': app.config['ADMIN_PASSWORD']})
+    first_page = client.get('/admin/flagged').get_data(as_text=True)
+    urls = {name: name for name in BUDGETS}
+    cursor = re.search(r'cursor=([^"&]+)', first_page)
+    if cursor:
+        urls['/admin/flagged?cursor'] = f'/admin/flagged?cursor={cursor.group(1)}'
+    else:
+        del urls['/admin/flagged?cursor']  # everything fit on one page
+
+    failed = False
+    for name, url in urls.items():
+        with count_queries(engine) as queries:
+            start = time.perf_counter()
+            response = client.get(url)
+            elapsed = (time.perf_counter() - start) * 1000
+        over = queries.count > BUDGETS[name]
+        failed |= over or response.status_code != 200
+        print(f'{name:<24} {response.status_code}  {queries.count:3d} queries (budget {BUDGETS[name]})  '
+              f'{elapsed:7.1f} ms{"  OVER BUDGET" if over else ""}')
+        if over:
+            for statement in queries.statements:
+                print('    ' + ' '.join(statement.split())[:160])
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
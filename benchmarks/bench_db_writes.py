@@ -0,0 +1,99 @@
+"""Concurrent write throughput on SQLite: stock settings vs the tuned PRAGMA profile.
+
+Forks `--workers` processes, like gunicorn workers sharing one database file.
+Writers commit one message per transaction while readers page through an inbox.
+
+    python benchmarks/bench_db_writes.py --workers 8 --seconds 5
+"""
+import argparse
+import atexit
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.exc import OperationalError
+from config import config, DevelopmentConfig
+
+PROFILES = {
+    'stock': {},
+    'tuned': DevelopmentConfig.SQLITE_PRAGMAS,
+}
+
+def register_config(profile, workdir):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{profile}.db'),
+        'SQLITE_PRAGMAS': PROFILES[profile],
+        'TEMPLATE_BYTECODE_CACHE_DIR': None,
+        'DEBUG': False,
+    })
+
+def worker(profile, workdir, role, seconds, start_at, results):
+    register_config(profile, workdir)
+    from mydiary import create_app
+    from mydiary.extensions import db
+    from mydiary.models import Message
+    app = create_app('bench')
+    done = errors = 0
+    with app.app_context():
+        while time.time() < start_at:
+            time.sleep(0.001)
+        deadline = start_at + seconds
+        while time.time() < deadline:
+            try:
+                if role == 'writer':
+                    db.session.add(Message(recipient_id=1, content='x' * 200, sender_ip='10.0.0.1'))
+                    db.session.commit()
+                else:
+                    Message.query.filter_by(recipient_id=1).order_by(Message.id.desc()).limit(20).all()
+                    db.session.rollback()
+                done += 1
+            except OperationalError:  # "database is locked"
+                db.session.rollback()
+                errors += 1
+    results.put((role, done, errors))
+
+def run(profile, workers, readers, seconds, workdir):
+    register_config(profile, workdir)
+    from mydiary import create_app
+    from mydiary.commands import bootstrap_database
+    with create_app('bench').app_context():
+        bootstrap_database()  # the schema, and the admin user the messages go to
+
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    roles = ['reader'] * readers + ['writer'] * (workers - readers)
+    processes = [multiprocessing.Process(target=worker, args=(profile, workdir, role, seconds, start_at, results))
+                 for role in roles]
+    for p in processes:
+        p.start()
+    totals = {'writer': [0, 0], 'reader': [0, 0]}
+    for _ in processes:
+        role, done, errors = results.get()
+        totals[role][0] += done
+        totals[role][1] += errors
+    for p in processes:
+        p.join()
+
+    (writes, write_errors), (reads, read_errors) = totals['writer'], totals['reader']
+    print(f'{profile:>6}: {writes / seconds:8.0f} writes/s  {reads / seconds:8.0f} reads/s  '
+          f'{write_errors + read_errors} locked errors')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--readers', type=int, default=2, help='How many of the workers only read.')
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    for profile in PROFILES:
+        run(profile, args.workers, args.readers, args.seconds, workdir)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""Duplicate sends: rows written, database lookups and send throughput per DEDUPE_MODE.
+
+    python benchmarks/bench_dedupe.py --sends 5000 --bot-share 0.5
+
+Replays a mix of ordinary messages and a bot resending a handful of texts
+to the same recipients through POST /send/<username>.
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message
+
+USERS = 20
+
+def make_app(mode, workdir):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{mode}.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'DEDUPE_MODE': mode,
+        'RATELIMIT_ENABLED': False,
+        'WTF_CSRF_ENABLED': False,
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+        db.session.add_all(User(username=f'user{i}', email=f'user{i}@bench.io') for i in range(USERS))
+        db.session.commit()
+    return app
+
+def make_sends(count, bot_share, rng):
+    bot_texts = [f'follow @spambot{i} for free stuff' for i in range(5)]
+    sends = []
+    for i in range(count):
+        if rng.random() < bot_share:
+            sends.append((f'user{rng.randrange(3)}', rng.choice(bot_texts), '203.0.113.7'))
+        else:
+            sends.append((f'user{rng.randrange(USERS)}', f'honest message number {i}', f'10.0.{i % 250}.{i % 7}'))
+    return sends
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sends', type=int, default=5000)
+    parser.add_argument('--bot-share', type=float, default=0.5, help='Fraction of sends that are bot repeats.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    sends = make_sends(args.sends, args.bot_share, random.Random(42))
+
+    for mode in ('off', 'drop', 'collapse'):
+        app = make_app(mode, workdir)
+        client = app.test_client()
+        start = time.perf_counter()
+        for username, content, ip in sends:
+            client.post(f'/send/{username}', data={'content': content}, environ_base={'REMOTE_ADDR': ip})
+        elapsed = time.perf_counter() - start
+        with app.app_context():
+            rows = Message.query.count()
+            state = app.extensions['dedupe']
+        print(f'{mode:>8}: {len(sends) / elapsed:7.0f} sends/s  {rows:6d} rows written  '
+              f'{state["lookups"]:6d} lookups ({state["lookups"] / len(sends):.0%} of sends)  '
+              f'{state["duplicates"]:6d} duplicates')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+"""Messages/sec through /send/<username> for each ingestion mode.
+
+    python benchmarks/bench_ingest.py --messages 2000 --concurrency 8
+"""
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db, ingest
+from mydiary.models import User, Message
+
+def make_app(mode, workdir):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{mode}.db'),
+        'INGEST_MODE': mode,
+        'INGEST_SPOOL_DIR': os.path.join(workdir, f'{mode}-spool'),
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+        db.session.add(User(username='viral', email='viral@mydiary.page'))
+        db.session.commit()
+    return app
+
+def run(mode, messages, concurrency, workdir):
+    app = make_app(mode, workdir)
+    client = app.test_client()
+
+    def send(i):
+        return client.post('/send/viral', data={'content': f'message {i}', 'category': 'text'}).status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        statuses = list(pool.map(send, range(messages)))
+    accepted = time.perf_counter() - start
+
+    with app.app_context():
+        if mode == 'worker':
+            ingest.drain()
+        while Message.query.count() < statuses.count(200):
+            time.sleep(0.05)
+    durable = time.perf_counter() - start
+
+    return {
+        'mode': mode,
+        'accepted_per_sec': round(messages / accepted),
+        'written_per_sec': round(messages / durable),
+        'rejected': messages - statuses.count(200),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--messages', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--modes', default='sync,thread,worker')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    # Registered first so it runs after the ingest writers' own exit hooks.
+    atexit.register(shutil.rmtree, workdir, True)
+    for mode in args.modes.split(','):
+        result = run(mode, args.messages, args.concurrency, workdir)
+        print(f"{result['mode']:>7}: {result['accepted_per_sec']:>6} accepted/s  "
+              f"{result['written_per_sec']:>6} written/s  {result['rejected']} rejected")
+
+if __name__ == '__main__':
+    main()
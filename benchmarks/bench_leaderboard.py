@@ -0,0 +1,111 @@
+"""Discover leaderboard: /discover latency against table size, and what keeping scores costs a send.
+
+    python benchmarks/bench_leaderboard.py --messages 100000 1000000 --users 20000
+
+For each table size, compares GET /discover (read from the leaderboard
+table) with the GROUP BY over a week of messages it replaces, then times
+sends with and without the leaderboard hooks.
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message
+from mydiary.leaderboard import rebuild
+
+def make_app(path, boards):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + path,
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(os.path.dirname(path), 'jinja_cache'),
+        'LEADERBOARD_BOARDS': boards,
+        'RATELIMIT_ENABLED': False,
+        'WTF_CSRF_ENABLED': False,
+        'DEDUPE_MODE': 'off',
+        'SPAM_SCORING': 'off',
+        'DEBUG': False,
+    })
+    return create_app('bench')
+
+def seed(users, messages, rng):
+    now = datetime.utcnow()
+    db.session.execute(db.insert(User), [{'username': f'user{i}', 'email': f'user{i}@bench.io'} for i in range(users)])
+    for start in range(0, messages, 20000):
+        db.session.execute(db.insert(Message), [
+            # Skewed, like real traffic: a few users get most of the messages
+            {'recipient_id': 2 + min(int(rng.paretovariate(1.2)) - 1, users - 1), 'content': 'hey',
+             'created_at': now - timedelta(seconds=rng.uniform(0, 30 * 86400))}
+            for _ in range(min(20000, messages - start))
+        ])
+    db.session.commit()
+
+def group_by_week(limit):
+    since = datetime.utcnow() - timedelta(days=7)
+    return (db.session.query(User.username, db.func.count(Message.id).label('received'))
+            .join(Message, Message.recipient_id == User.id)
+            .filter(Message.created_at >= since)
+            .group_by(User.id)
+            .order_by(db.text('received DESC'))
+            .limit(limit).all())
+
+def timed(fn, repeat):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, nargs='+', default=[100000, 1000000])
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--sends', type=int, default=2000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    boards = DevelopmentConfig.LEADERBOARD_BOARDS
+    for count in args.messages:
+        app = make_app(os.path.join(workdir, f'discover-{count}.db'), boards)
+        client = app.test_client()
+        with app.app_context():
+            bootstrap_database()
+            seed(args.users, count, random.Random(42))
+            start = time.perf_counter()
+            for name in boards:
+                rebuild(name)
+            rebuilt = time.perf_counter() - start
+            naive = timed(lambda: group_by_week(app.config['LEADERBOARD_SIZE']), 5)
+        page = timed(lambda: client.get('/discover?board=week'), 50)
+        print(f'{count:8d} messages: /discover {page:6.2f} ms   GROUP BY over the week {naive:8.1f} ms   '
+              f'rebuild {rebuilt:5.1f} s')
+
+    for label, enabled in (('without leaderboard', {}), ('with leaderboard', boards)):
+        app = make_app(os.path.join(workdir, f'sends-{bool(enabled)}.db'), enabled)
+        with app.app_context():
+            bootstrap_database()
+            db.session.add_all(User(username=f'user{i}', email=f'user{i}@bench.io') for i in range(100))
+            db.session.commit()
+        client = app.test_client()
+        rng = random.Random(7)
+        start = time.perf_counter()
+        for i in range(args.sends):
+            client.post(f'/send/user{rng.randrange(100)}', data={'content': f'message {i}'})
+        elapsed = time.perf_counter() - start
+        print(f'{label:>20}: {args.sends / elapsed:6.0f} sends/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,94 @@
+"""Logins/sec per core for each hashing policy, and the cost of a throttled attempt.
+
+    python benchmarks/bench_login.py --seconds 3 --concurrency 8
+"""
+import argparse
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User
+
+METHODS = ['scrypt:32768:8:1', 'scrypt:16384:8:1', 'pbkdf2:sha256:600000']
+USERS = 50
+
+def make_app(name, workdir, **overrides):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{name}.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'WTF_CSRF_ENABLED': False,
+        'DEBUG': False,
+        **overrides,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+        for i in range(USERS):
+            user = User(username=f'user{i}', email=f'user{i}@bench.io')
+            user.set_password('benchpass')
+            db.session.add(user)
+        db.session.commit()
+    return app
+
+def hammer(app, seconds, concurrency, password, same_ip=False):
+    """Log in as random users from `concurrency` threads; returns (attempts/sec, status counts)."""
+    deadline = time.monotonic() + seconds
+    counts = {}
+    lock = threading.Lock()
+
+    def loop(n):
+        i = n
+        while time.monotonic() < deadline:
+            client = app.test_client()
+            ip = '10.0.0.1' if same_ip else f'10.0.{n}.{i % 250}'
+            status = client.post('/auth/login', data={'email': f'user{i % USERS}@bench.io', 'password': password},
+                                 environ_base={'REMOTE_ADDR': ip}).status_code
+            with lock:
+                counts[status] = counts.get(status, 0) + 1
+            i += concurrency
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(concurrency) as pool:
+        list(pool.map(loop, range(concurrency)))
+    return sum(counts.values()) / (time.monotonic() - start), counts
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--seconds', type=float, default=3)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Hashing processes.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    cores = min(args.workers, os.cpu_count() or 1)
+    print(f'{cores} core(s), {args.concurrency} concurrent clients')
+
+    for method in METHODS:
+        for workers in (0, args.workers):
+            app = make_app(f'{method.replace(":", "_")}-{workers}', workdir, PASSWORD_HASH_METHOD=method,
+                           PASSWORD_HASH_WORKERS=workers, RATELIMIT_ENABLED=False)
+            rate, counts = hammer(app, args.seconds, args.concurrency, 'benchpass')
+            mode = f'pool x{workers}' if workers else 'inline'
+            print(f'{method:>22} {mode:>8}: {rate:7.1f} logins/s  {rate / cores:7.1f} per core  {counts}')
+
+    # A credential-stuffing burst from one IP: after the first failures every
+    # attempt is rejected before the user lookup and the hash.
+    app = make_app('throttled', workdir, PASSWORD_HASH_WORKERS=args.workers,
+                   RATELIMIT_LOGIN_FAILURES_PER_IP=(5, 300))
+    rate, counts = hammer(app, args.seconds, args.concurrency, 'wrong', same_ip=True)
+    print(f'{"throttled stuffing":>31}: {rate:7.1f} attempts/s  {counts}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,95 @@
+"""Fragment render latency: the old hand-built f-string vs template include vs macro partial.
+
+    python benchmarks/bench_partials.py --iterations 20000
+"""
+import argparse
+import atexit
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import render_template
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.extensions import partials
+
+def fstring_entry(entry):
+    # The card as create_diary_entry used to build it (unescaped)
+    return f'''
+    <div class="bg-white/5 border border-white/10 p-6 rounded-3xl mb-4" id="entry-{entry.id}">
+        <div class="flex justify-between items-start mb-3">
+            <span class="text-gray-400 text-sm">{entry.created_at.strftime('%b %d, %Y at %H:%M')}</span>
+            <span class="px-3 py-1 rounded-full text-xs font-bold {'bg-green-500/20 text-green-400' if entry.is_public else 'bg-gray-500/20 text-gray-400'}">
+                {'Public' if entry.is_public else 'Private'}
+            </span>
+        </div>
+        <p class="text-white text-lg mb-4">{entry.content}</p>
+        <div class="flex gap-2">
+            <button hx-post="/diary/{entry.id}/toggle-public" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
+                class="px-4 py-2 bg-white/10 hover:bg-white/20 rounded-xl text-sm transition-colors">
+                {'Make Private' if entry.is_public else 'Make Public'}
+            </button>
+            <button hx-delete="/diary/{entry.id}" hx-confirm="Delete this entry?" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
+                class="px-4 py-2 bg-red-500/20 hover:bg-red-500/30 text-red-400 rounded-xl text-sm transition-colors">
+                Delete
+            </button>
+        </div>
+    </div>
+    '''
+
+def template_entry(entry):
+    # A full render_template call per fragment: template lookup, context setup, signals
+    return render_template('components/entries_page.html', entries=[entry], entries_cursor=None)
+
+def partial_entry(entry):
+    return partials.render('diary_entry', entry)
+
+def timed(fn, entry, iterations):
+    samples = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn(entry)
+        samples.append((time.perf_counter() - start) * 1e6)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.99) - 1]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--iterations', type=int, default=20000)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'partials.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    entry = SimpleNamespace(id=42, content='Dear diary, today was a <b>good</b> day & I ate cake.',
+                            is_public=True, created_at=datetime(2024, 5, 1, 12, 30))
+
+    with app.test_request_context():
+        for label, fn in (('f-string', fstring_entry), ('template', template_entry), ('partial', partial_entry)):
+            fn(entry)  # warm up: compile and load the macro module
+            p50, p99 = timed(fn, entry, args.iterations)
+            print(f'{label:>9}: p50 {p50:7.1f} us  p99 {p99:7.1f} us')
+
+    # Cold start: how long a fresh worker takes to compile the macros, with and without bytecode
+    for label, cache_dir in (('cold compile', None), ('bytecode', app.config['TEMPLATE_BYTECODE_CACHE_DIR'])):
+        config['bench'].TEMPLATE_BYTECODE_CACHE_DIR = cache_dir
+        fresh = create_app('bench')
+        with fresh.test_request_context():
+            start = time.perf_counter()
+            partials.macros()
+            print(f'{label:>12}: {(time.perf_counter() - start) * 1000:.2f} ms to load macros/cards.html')
+
+if __name__ == '__main__':
+    main()
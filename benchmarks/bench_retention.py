@@ -0,0 +1,120 @@
+"""Archiving old messages: how long it takes, how long it blocks writers, and what it frees.
+
+    python benchmarks/bench_retention.py --messages 300000 --old-share 0.8
+
+Seeds a message table where `--old-share` of the rows are read and past the
+retention period, then runs the archiver while another thread keeps
+inserting messages, and reports the slowest of those inserts.
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message
+from mydiary.retention import archive_old_data
+from mydiary.stats import rebuild
+
+USERS = 200
+
+def make_app(workdir, batch_size):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'retention.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'RETENTION_BATCH_SIZE': batch_size,
+        'SPAM_SCORING': 'off',
+        'DEBUG': False,
+    })
+    return create_app('bench')
+
+def seed(count, old_share, rng):
+    bootstrap_database()
+    db.session.add_all(User(username=f'user{i}', email=f'user{i}@bench.io') for i in range(USERS))
+    db.session.commit()
+    now = datetime.utcnow()
+    rows = []
+    for i in range(count):
+        old = rng.random() < old_share
+        rows.append({
+            'recipient_id': 2 + i % USERS,
+            'content': 'lorem ipsum ' * rng.randint(5, 40),
+            'is_read': old or rng.random() < 0.5,
+            'is_flagged': False,
+            'created_at': now - timedelta(days=rng.uniform(91, 400) if old else rng.uniform(0, 89)),
+        })
+        if len(rows) == 10000:
+            db.session.execute(db.insert(Message), rows)
+            rows = []
+    if rows:
+        db.session.execute(db.insert(Message), rows)
+    db.session.commit()
+    rebuild()
+
+def inbox_page_ms(repeat=200):
+    start = time.perf_counter()
+    for i in range(repeat):
+        (Message.query.filter_by(recipient_id=2 + i % USERS)
+         .order_by(Message.created_at.desc(), Message.id.desc()).limit(21).all())
+        db.session.rollback()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+def writer(app, stop, latencies):
+    with app.app_context():
+        while not stop.is_set():
+            start = time.perf_counter()
+            db.session.add(Message(recipient_id=2, content='still writing', sender_ip='10.0.0.1'))
+            db.session.commit()
+            latencies.append((time.perf_counter() - start) * 1000)
+            time.sleep(0.005)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=300000)
+    parser.add_argument('--old-share', type=float, default=0.8)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    app = make_app(workdir, args.batch_size)
+    with app.app_context():
+        seed(args.messages, args.old_share, random.Random(42))
+        before_ms = inbox_page_ms()
+
+        stop, latencies = threading.Event(), []
+        thread = threading.Thread(target=writer, args=(app, stop, latencies))
+        thread.start()
+        start = time.perf_counter()
+        report = archive_old_data(vacuum=False)
+        elapsed = time.perf_counter() - start
+        stop.set()
+        thread.join()
+
+        after_ms = inbox_page_ms()
+        vacuumed = archive_old_data(vacuum=True)['after']
+
+    mb = 1024 * 1024
+    print(f'archived {report["messages"]} of {args.messages} messages in {elapsed:.1f}s '
+          f'({report["messages"] / elapsed:.0f} rows/s, {report["content_bytes"] / mb:.1f} MB of text)')
+    print(f'concurrent inserts: {len(latencies)}, median {statistics.median(latencies):.1f} ms, '
+          f'max {max(latencies):.1f} ms')
+    print(f'inbox page query: {before_ms:.2f} ms -> {after_ms:.2f} ms')
+    print(f'main database: {report["before"]["bytes"] / mb:.1f} MB, '
+          f'{report["after"]["free_bytes"] / mb:.1f} MB free after archiving, '
+          f'{vacuumed["bytes"] / mb:.1f} MB after VACUUM')
+
+if __name__ == '__main__':
+    main()
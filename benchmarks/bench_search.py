@@ -0,0 +1,90 @@
+"""Typeahead latency: FTS5 index vs the old LIKE '%q%' scan.
+
+    python benchmarks/bench_search.py --users 1000000
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User
+from mydiary import search
+
+SYLLABLES = ['ka', 'mi', 'lo', 'ra', 'zen', 'vi', 'bee', 'sun', 'star', 'moon', 'xo', 'lil', 'cool', 'kid']
+BIO_WORDS = ['coffee', 'music', 'travel', 'anime', 'gym', 'cats', 'art', 'vibes', 'books', 'memes']
+
+def fake_user(i, rng):
+    name = ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3)))
+    return {
+        'username': f'{name}_{i}',
+        'email': f'user{i}@example.com',
+        'bio': ' '.join(rng.sample(BIO_WORDS, 3)),
+    }
+
+def seed(count, rng, chunk=50000):
+    table = User.__table__
+    for start in range(0, count, chunk):
+        db.session.execute(table.insert(), [fake_user(i, rng) for i in range(start, min(count, start + chunk))])
+    db.session.commit()
+
+def timed(fn, queries):
+    samples = []
+    for q in queries:
+        start = time.perf_counter()
+        fn(q)
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1]
+
+def like_scan(q):
+    return db.session.query(User.username, User.bio).filter(User.username.like(f'%{q}%')).limit(10).all()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=1000000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'search.db'),
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    rng = random.Random(42)
+
+    with app.app_context():
+        bootstrap_database()
+        start = time.perf_counter()
+        seed(args.users, rng)
+        search.rebuild()
+        print(f'seeded and indexed {args.users} users in {time.perf_counter() - start:.1f}s')
+
+        # Typeahead: short prefixes match huge sets, exact-ish names match few rows,
+        # and misses force the LIKE scan to read the whole table.
+        workloads = {
+            'short prefix': [rng.choice(SYLLABLES)[:2] for _ in range(args.queries)],
+            'username': [fake_user(rng.randrange(args.users), random.Random(0))['username'][:6]
+                         for _ in range(args.queries)],
+            'miss': [''.join(rng.choice('qxjz') for _ in range(4)) for _ in range(args.queries)],
+        }
+
+        for workload, queries in workloads.items():
+            for label, fn in (('fts5', search.search_users), ('like', like_scan)):
+                p50, p95 = timed(fn, queries)
+                print(f'{workload:>12} {label:>5}: p50 {p50:7.2f} ms  p95 {p95:7.2f} ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+"""Profile share images: what a render costs against a cache hit and a 304, and a crawler burst.
+
+    python benchmarks/bench_share_images.py --users 200 --workers 0 2 4
+
+For each IMAGE_RENDER_WORKERS setting, requests /u/<username>/card.png for
+every user from several threads with an empty cache (every request
+renders), again with the cache full (every request reads a file), and with
+the ETag from the first response (every request is a 304). Then a burst of
+concurrent requests for one new card, as crawlers do when a link is
+shared, reporting how many renders it took.
+"""
+import argparse
+import atexit
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User
+
+def make_app(workdir, workers):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'images-{workers}.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'IMAGE_CACHE_DIR': os.path.join(workdir, f'images-{workers}'),
+        'IMAGE_RENDER_WORKERS': workers,
+        'IMAGE_RENDER_MAX_PENDING': 64,
+        'DEBUG': False,
+    })
+    return create_app('bench')
+
+def run(client_factory, urls, threads, headers=None):
+    """Requests/sec and median latency in ms for `urls` spread over `threads` clients."""
+    def fetch(url):
+        start = time.perf_counter()
+        response = client_factory().get(url, headers=headers(url) if headers else None)
+        assert response.status_code in (200, 304), response.status_code
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        samples = list(pool.map(fetch, urls))
+    return len(urls) / (time.perf_counter() - start), statistics.median(samples)
+
+def count_files(directory):
+    return sum(len(files) for _, _, files in os.walk(directory))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--workers', type=int, nargs='+', default=[0, 2, 4])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--burst', type=int, default=50)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    for workers in args.workers:
+        app = make_app(workdir, workers)
+        with app.app_context():
+            bootstrap_database()
+            db.session.execute(db.insert(User), [
+                {'username': f'user{i}', 'email': f'user{i}@bench.io', 'bio': f'bio number {i}, say hi!'}
+                for i in range(args.users + 1)
+            ])
+            db.session.commit()
+        urls = [f'/u/user{i}/card.png' for i in range(args.users)]
+        app.test_client().get(urls[0])  # imports Pillow and starts the pool outside the timings
+        shutil.rmtree(app.config['IMAGE_CACHE_DIR'], ignore_errors=True)
+        app.extensions['share_images']['size'] = None
+        cold = run(app.test_client, urls, args.threads)
+        warm = run(app.test_client, urls, args.threads)
+        etags = {url: app.test_client().get(url).headers['ETag'] for url in urls}
+        revalidated = run(app.test_client, urls, args.threads, lambda url: {'If-None-Match': etags[url]})
+
+        before = count_files(app.config['IMAGE_CACHE_DIR'])
+        burst = run(app.test_client, [f'/u/user{args.users}/card.png'] * args.burst, args.burst)
+        renders = count_files(app.config['IMAGE_CACHE_DIR']) - before
+
+        print(f'workers={workers}:')
+        for label, (rate, p50) in (('render', cold), ('cache hit', warm), ('304', revalidated)):
+            print(f'  {label:>10}: {rate:7.0f} req/s  p50 {p50:7.2f} ms')
+        print(f'  {"burst":>10}: {args.burst} concurrent requests for a new card, {renders} render(s), '
+              f'p50 {burst[1]:.1f} ms')
+
+if __name__ == '__main__':
+    main()
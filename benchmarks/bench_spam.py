@@ -0,0 +1,128 @@
+"""Spam scoring throughput: messages/sec scored, and the cost it adds to ingestion.
+
+    python benchmarks/bench_spam.py --messages 20000 --blocklist 5000
+
+Scores a synthetic stream (ordinary messages, blocklisted ones with a link and a
+flood of near-identical messages from a few IPs) against a generated blocklist, and
+compares the Aho-Corasick matcher with a linear scan over the same list.
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db, spam
+from mydiary.ingest import write_messages
+from mydiary.models import Message
+from mydiary.spam import AhoCorasick, DEFAULT_BLOCKLIST
+
+WORDS = ('hey love your diary today was great see you at lunch honestly the best '
+         'vibes ever thanks for the advice miss you call me later what a day').split()
+
+def make_app(workdir, blocklist_path, scoring):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, f'{scoring}.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'SPAM_BLOCKLIST_FILE': blocklist_path,
+        'SPAM_SCORING': scoring,
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+    return app
+
+def make_blocklist(size, rng):
+    phrases = list(DEFAULT_BLOCKLIST)
+    while len(phrases) < size:
+        phrases.append(' '.join(''.join(rng.choices(string.ascii_lowercase, k=rng.randint(4, 9)))
+                                for _ in range(rng.randint(1, 3))))
+    return phrases
+
+def make_messages(count, blocklist, rng):
+    """(row, is_spam) pairs: 80% ordinary, 10% blocklisted with a link, 10% a copy-paste flood."""
+    now = datetime.utcnow().isoformat()
+    flood = 'omg go follow my page for a free giveaway ' + ' '.join(rng.choices(WORDS, k=8))
+    messages = []
+    for i in range(count):
+        kind = rng.random()
+        if kind < 0.8:
+            content, ip, is_spam = ' '.join(rng.choices(WORDS, k=rng.randint(5, 30))), f'10.{i % 250}.{i % 7}.1', False
+        elif kind < 0.9:
+            content = ' '.join(rng.choices(WORDS, k=6) + [rng.choice(blocklist), f'promo{i % 50}.xyz'] + rng.choices(WORDS, k=6))
+            ip, is_spam = f'10.{i % 250}.{i % 7}.1', True
+        else:
+            content, ip, is_spam = flood + rng.choice(['', '!', '!!', ' :)']), f'172.16.0.{i % 4}', True
+        messages.append(({'recipient_id': 1, 'content': content, 'sender_ip': ip, 'category': 'text',
+                          'created_at': now}, is_spam))
+    return messages
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--messages', type=int, default=20000)
+    parser.add_argument('--blocklist', type=int, default=5000, help='Blocklist phrases.')
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    blocklist = make_blocklist(args.blocklist, rng)
+    blocklist_path = os.path.join(workdir, 'blocklist.txt')
+    with open(blocklist_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(blocklist))
+    messages = make_messages(args.messages, blocklist, rng)
+    texts = [row['content'] for row, _ in messages]
+
+    start = time.perf_counter()
+    matcher = AhoCorasick(blocklist)
+    built = time.perf_counter() - start
+    start = time.perf_counter()
+    for text in texts:
+        matcher.find(text)
+    aho = time.perf_counter() - start
+    sample = texts[:max(1, len(texts) // 20)]
+    start = time.perf_counter()
+    for text in sample:
+        lowered = text.lower()
+        [phrase for phrase in blocklist if phrase in lowered]
+    linear = (time.perf_counter() - start) * len(texts) / len(sample)
+    print(f'blocklist of {len(blocklist)}: Aho-Corasick {len(texts) / aho:8.0f} msg/s '
+          f'(built in {built * 1000:.0f} ms), linear scan {len(texts) / linear:8.0f} msg/s')
+
+    for scoring in ('off', 'ingest'):
+        app = make_app(workdir, blocklist_path, scoring)
+        with app.app_context():
+            rows = [dict(row) for row, _ in messages]
+            start = time.perf_counter()
+            write_messages(rows, args.batch_size)
+            elapsed = time.perf_counter() - start
+            print(f'write_messages, scoring {scoring:>6}: {len(rows) / elapsed:8.0f} msg/s')
+            if scoring == 'off':
+                continue
+            flagged = {content for (content,) in db.session.query(Message.content).filter(Message.is_flagged.is_(True))}
+            caught = sum(1 for row, is_spam in messages if is_spam and row['content'] in flagged)
+            false_flags = sum(1 for row, is_spam in messages if not is_spam and row['content'] in flagged)
+            total_spam = sum(1 for _, is_spam in messages if is_spam)
+            print(f'  flagged {caught}/{total_spam} spam, {false_flags} ordinary messages')
+
+            rows = [dict(row, created_at=datetime.utcnow()) for row, _ in messages[:args.batch_size * 4]]
+            start = time.perf_counter()
+            for i in range(0, len(rows), args.batch_size):
+                spam.score_batch(rows[i:i + args.batch_size])
+            elapsed = time.perf_counter() - start
+            print(f'score_batch alone: {len(rows) / elapsed:8.0f} msg/s')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""Cold start: import cost and time from process start to the first served request.
+
+    python benchmarks/bench_startup.py --runs 5 --budget 1.0
+
+Prints the slowest imports from `python -X importtime`, then starts fresh
+interpreters that import the app, build it and serve one request. Exits with
+status 1 if the median time-to-first-request is over `--budget` seconds.
+"""
+import argparse
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs in the child interpreter: build the app the way a gunicorn worker does
+# and serve a request that touches the database.
+FIRST_REQUEST = '''
+import os, sys
+sys.path.insert(0, {root!r})
+from mydiary import create_app
+app = create_app('default')
+response = app.test_client().get('/search?q=ad')
+assert response.status_code == 200, response.status_code
+'''
+
+def child_env(workdir):
+    env = dict(os.environ)
+    env['DATABASE_URL'] = 'sqlite:///' + os.path.join(workdir, 'startup.db')
+    env['TEMPLATE_BYTECODE_CACHE_DIR'] = os.path.join(workdir, 'jinja_cache')
+    return env
+
+def importtime(env, top):
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import sys; sys.path.insert(0, {ROOT!r}); import mydiary'],
+        env=env, cwd=ROOT, capture_output=True, text=True, check=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        rows.append((int(cumulative), name.rstrip()))
+    total = max(rows)[0] if rows else 0
+    print(f'import mydiary: {total / 1000:.0f} ms; slowest imports one or two levels down:')
+    # importtime indents each nesting level by two spaces
+    nested = [(cumulative, name) for cumulative, name in rows
+              if 2 <= len(name) - len(name.lstrip()) - 1 <= 4]
+    for cumulative, name in sorted(nested, reverse=True)[:top]:
+        print(f'  {cumulative / 1000:7.1f} ms  {name.strip()}')
+
+def first_request(env):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', FIRST_REQUEST.format(root=ROOT)], env=env, cwd=ROOT, check=True)
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--budget', type=float, default=1.0, help='Seconds allowed to the first request.')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    try:
+        env = child_env(workdir)
+        subprocess.run([sys.executable, '-m', 'flask', '--app', 'run', 'bootstrap'], env=env, cwd=ROOT,
+                       check=True, capture_output=True)
+        importtime(env, args.top)
+
+        samples = sorted(first_request(env) for _ in range(args.runs))
+        median = statistics.median(samples)
+        print(f'time to first request: median {median * 1000:.0f} ms, '
+              f'min {samples[0] * 1000:.0f} ms, max {samples[-1] * 1000:.0f} ms ({args.runs} runs)')
+    finally:
+        shutil.rmtree(workdir, True)
+
+    if median > args.budget:
+        print(f'FAIL: over the {args.budget:.2f}s budget', file=sys.stderr)
+        sys.exit(1)
+    print(f'OK: within the {args.budget:.2f}s budget')
+
+if __name__ == '__main__':
+    main()
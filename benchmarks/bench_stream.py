@@ -0,0 +1,113 @@
+"""Live inbox delivery: time from send to the message arriving on open /inbox/stream connections.
+
+    python benchmarks/bench_stream.py --streams 50 --sends 200
+
+Opens `--streams` streams spread over as many users, sends messages to them
+through POST /send/<username> (delivered on this process's notify) and by
+writing rows from a separate connection (picked up by the poll, as for
+other workers), and reports delivery latency for both.
+"""
+import argparse
+import atexit
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine, insert
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message
+
+def make_app(workdir, poll_interval):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'stream.db'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'INBOX_STREAM_POLL_INTERVAL': poll_interval,
+        'INBOX_STREAM_MAX_AGE': 3600,
+        'RATELIMIT_ENABLED': False,
+        'WTF_CSRF_ENABLED': False,
+        'DEDUPE_MODE': 'off',
+        'DEBUG': False,
+    })
+    app = create_app('bench')
+    with app.app_context():
+        bootstrap_database()
+    return app
+
+def listen(app, username, sent_at, latencies, ready):
+    client = app.test_client()
+    client.post('/auth/login', data={'email': f'{username}@bench.io', 'password': 'bench'})
+    response = client.get('/inbox/stream', buffered=False)
+    ready.release()
+    for chunk in response.response:
+        for line in chunk.decode().splitlines():
+            if 'message-text-' in line:
+                token = line.split('token-', 1)[1].split('"', 1)[0]
+                latencies.append((time.perf_counter() - sent_at[token]) * 1000)
+
+def report(label, latencies):
+    latencies = sorted(latencies)
+    print(f'{label:>14}: {len(latencies):5d} delivered  p50 {statistics.median(latencies):7.1f} ms  '
+          f'p95 {latencies[int(len(latencies) * 0.95) - 1]:7.1f} ms  max {latencies[-1]:7.1f} ms')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--streams', type=int, default=50)
+    parser.add_argument('--sends', type=int, default=200)
+    parser.add_argument('--poll-interval', type=float, default=1.0)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    app = make_app(workdir, args.poll_interval)
+    usernames = [f'user{i}' for i in range(args.streams)]
+    with app.app_context():
+        users = [User(username=name, email=f'{name}@bench.io') for name in usernames]
+        for user in users:
+            user.set_password('bench')
+        db.session.add_all(users)
+        db.session.commit()
+        ids = {user.username: user.id for user in users}
+
+    sent_at, latencies, ready = {}, [], threading.Semaphore(0)
+    for name in usernames:
+        threading.Thread(target=listen, args=(app, name, sent_at, latencies, ready), daemon=True).start()
+    for _ in usernames:
+        ready.acquire()
+
+    rng = random.Random(42)
+    sender = app.test_client()
+    for i in range(args.sends):
+        token = f'a{i}'
+        sent_at[token] = time.perf_counter()
+        sender.post(f'/send/{rng.choice(usernames)}', data={'content': f'token-{token}'})
+        time.sleep(0.01)
+    time.sleep(0.5)
+    report('same process', latencies)
+
+    latencies.clear()
+    engine = create_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+    for i in range(args.sends):
+        token = f'b{i}'
+        with engine.begin() as connection:
+            sent_at[token] = time.perf_counter()
+            connection.execute(insert(Message.__table__), {
+                'recipient_id': ids[rng.choice(usernames)], 'content': f'token-{token}',
+                'created_at': datetime.utcnow(),
+            })
+        time.sleep(0.01)
+    time.sleep(args.poll_interval + 0.5)
+    report('other process', latencies)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,315 @@
+"""Latency, queries per request and RSS for each blueprint's hot path, as JSON.
+
+    python benchmarks/bench_suite.py --users 2000 --messages 50 --output before.json
+    python benchmarks/bench_suite.py --baseline before.json --threshold 0.2
+    python benchmarks/bench_suite.py --gunicorn --workers 4
+
+Exits with status 1 when a scenario's p95 grows by more than `--threshold`
+or it runs more queries per request than the baseline did.
+"""
+import argparse
+import atexit
+import http.cookiejar
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from itertools import accumulate
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from sqlalchemy import event
+from werkzeug.security import generate_password_hash
+from config import config, DevelopmentConfig
+from mydiary import create_app
+from mydiary.commands import bootstrap_database
+from mydiary.extensions import db
+from mydiary.models import User, Message, DiaryEntry
+
+PASSWORD = 'benchpass'
+
+def register_config(workdir):
+    config['bench'] = type('BenchConfig', (DevelopmentConfig,), {
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///' + os.path.join(workdir, 'suite.db'),
+        'INGEST_SPOOL_DIR': os.path.join(workdir, 'spool'),
+        'TEMPLATE_BYTECODE_CACHE_DIR': os.path.join(workdir, 'jinja_cache'),
+        'WTF_CSRF_ENABLED': False,
+        'RATELIMIT_ENABLED': False,
+        'DEBUG': False,
+    })
+
+def gunicorn_app():
+    """Entry point for the gunicorn workers started by --gunicorn."""
+    register_config(os.environ['MYDIARY_BENCH_DIR'])
+    return create_app('bench')
+
+# Seeding
+
+def zipf_weights(count, skew):
+    return list(accumulate(1 / (rank + 1) ** skew for rank in range(count)))
+
+def seed(users, messages, skew, rng, chunk=50000):
+    """N users, about `messages` per user on average, skewed so a few celebrities get most of them."""
+    password_hash = generate_password_hash(PASSWORD)  # one hash for everyone keeps seeding fast
+    offset = db.session.query(db.func.count(User.id)).scalar()
+    db.session.execute(User.__table__.insert(), [
+        {'username': f'user{i}', 'email': f'user{i}@bench.io', 'password_hash': password_hash,
+         'bio': f'bench user {i}'}
+        for i in range(users)
+    ])
+    user_ids = [offset + i + 1 for i in range(users)]
+    weights = zipf_weights(users, skew)
+
+    total = users * messages
+    for start in range(0, total, chunk):
+        recipients = rng.choices(user_ids, cum_weights=weights, k=min(chunk, total - start))
+        db.session.execute(Message.__table__.insert(), [
+            {'recipient_id': r, 'content': f'anonymous message {start + i}', 'category': 'text',
+             'sender_ip': f'10.0.{i % 256}.{r % 256}', 'is_read': rng.random() < 0.5}
+            for i, r in enumerate(recipients)
+        ])
+    db.session.execute(DiaryEntry.__table__.insert(), [
+        {'user_id': user_id, 'content': f'entry {n} of {user_id}', 'is_public': n % 2 == 0}
+        for user_id in user_ids for n in range(3)
+    ])
+    db.session.commit()
+
+    from mydiary import stats, search
+    stats.rebuild()
+    search.rebuild()
+    return weights
+
+# Drivers: the same scenarios run against the Flask test client or a live server
+
+class TestClientSession:
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, data=None):
+        return self.client.open(path, method=method, data=data).status_code
+
+class HTTPSession:
+    class _NoRedirect(urllib.request.HTTPRedirectHandler):
+        def redirect_request(self, *args, **kwargs):
+            return None
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.opener = urllib.request.build_opener(
+            urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()), self._NoRedirect)
+
+    def request(self, method, path, data=None):
+        body = urllib.parse.urlencode(data).encode() if data is not None else None
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        try:
+            with self.opener.open(req) as response:
+                response.read()
+                return response.status
+        except urllib.error.HTTPError as e:
+            e.read()
+            return e.code
+
+def login(session, email, password=PASSWORD):
+    status = session.request('POST', '/auth/login', {'email': email, 'password': password})
+    assert status == 302, f'login as {email} failed with {status}'
+    return session
+
+def scenarios(new_session, users, weights, rng):
+    """name -> (session factory, request factory). Targets follow the same skew as the data."""
+    def popular():
+        return rng.choices(range(users), cum_weights=weights)[0]
+
+    celebrity = login(new_session(), 'user0@bench.io')
+    admin = login(new_session(), 'admin@mydiary.page', 'admin123')
+    anonymous = new_session()
+    return {
+        'public_profile': (lambda: anonymous, lambda: ('GET', f'/user{popular()}', None)),
+        'send_message': (lambda: anonymous,
+                         lambda: ('POST', f'/send/user{popular()}', {'content': 'hi from the suite', 'category': 'text'})),
+        'dashboard': (lambda: celebrity, lambda: ('GET', '/dashboard', None)),
+        'admin_index': (lambda: admin, lambda: ('GET', '/admin/', None)),
+        'login': (new_session, lambda: ('POST', '/auth/login',
+                                        {'email': f'user{rng.randrange(users)}@bench.io', 'password': PASSWORD})),
+    }
+
+class QueryCounter:
+    def __init__(self, engine):
+        self.count = 0
+        event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def _on_execute(self, *args):
+        self.count += 1
+
+def percentile(sorted_samples, pct):
+    index = min(len(sorted_samples) - 1, max(0, round(pct / 100 * len(sorted_samples)) - 1))
+    return sorted_samples[index]
+
+def run_scenario(session_factory, make_request, requests, warmup, counter=None):
+    for _ in range(warmup):
+        session_factory().request(*make_request())
+    samples, errors = [], 0
+    queries_before = counter.count if counter else 0
+    started = time.perf_counter()
+    for _ in range(requests):
+        session = session_factory()
+        method, path, data = make_request()
+        start = time.perf_counter()
+        status = session.request(method, path, data)
+        samples.append((time.perf_counter() - start) * 1000)
+        errors += status >= 400
+    elapsed = time.perf_counter() - started
+    samples.sort()
+    return {
+        'requests': requests,
+        'errors': errors,
+        'p50_ms': round(percentile(samples, 50), 3),
+        'p95_ms': round(percentile(samples, 95), 3),
+        'p99_ms': round(percentile(samples, 99), 3),
+        'rps': round(requests / elapsed, 1),
+        'queries_per_request': round((counter.count - queries_before) / requests, 2) if counter else None,
+    }
+
+# RSS
+
+def rss_mb(pid):
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    return pids
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def start_gunicorn(workdir, workers):
+    port = free_port()
+    env = dict(os.environ, MYDIARY_BENCH_DIR=workdir)
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}',
+         '--chdir', ROOT, '--pythonpath', os.path.join(ROOT, 'benchmarks'), '--log-level', 'warning',
+         'bench_suite:gunicorn_app()'],
+        env=env,
+    )
+    atexit.register(lambda: server.poll() is None and server.send_signal(signal.SIGTERM))
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.2).close()
+            return server, f'http://127.0.0.1:{port}'
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError('gunicorn did not start')
+
+# Baseline comparison
+
+def compare(results, baseline, threshold):
+    regressions = []
+    for name, current in results['scenarios'].items():
+        previous = baseline.get('scenarios', {}).get(name)
+        if not previous:
+            continue
+        if current['p95_ms'] > previous['p95_ms'] * (1 + threshold):
+            regressions.append(f"{name}: p95 {previous['p95_ms']} -> {current['p95_ms']} ms")
+        if (current['queries_per_request'] is not None and previous.get('queries_per_request') is not None
+                and current['queries_per_request'] > previous['queries_per_request']):
+            regressions.append(f"{name}: queries/request {previous['queries_per_request']} -> "
+                               f"{current['queries_per_request']}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--messages', type=int, default=50, help='Average messages per user.')
+    parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent for message recipients.')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per scenario.')
+    parser.add_argument('--warmup', type=int, default=10)
+    parser.add_argument('--only', action='append', help='Run just this scenario (repeatable).')
+    parser.add_argument('--gunicorn', action='store_true', help='Drive a local gunicorn over HTTP.')
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--output', help='Write the JSON report here as well as to stdout.')
+    parser.add_argument('--baseline', help='JSON report to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2, help='Allowed p95 growth, e.g. 0.2 = 20%%.')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='mydiary-bench-')
+    atexit.register(shutil.rmtree, workdir, True)
+    register_config(workdir)
+    app = create_app('bench')
+    rng = random.Random(42)
+
+    with app.app_context():
+        bootstrap_database()
+        start = time.perf_counter()
+        weights = seed(args.users, args.messages, args.skew, rng)
+        seed_seconds = time.perf_counter() - start
+        counter = None if args.gunicorn else QueryCounter(db.engine)
+
+    if args.gunicorn:
+        server, base_url = start_gunicorn(workdir, args.workers)
+        new_session = lambda: HTTPSession(base_url)
+    else:
+        new_session = lambda: TestClientSession(app)
+
+    results = {
+        'meta': {
+            'driver': 'gunicorn' if args.gunicorn else 'test_client',
+            'workers': args.workers if args.gunicorn else 1,
+            'users': args.users,
+            'messages': args.users * args.messages,
+            'skew': args.skew,
+            'requests': args.requests,
+            'python': platform.python_version(),
+            'seed_seconds': round(seed_seconds, 2),
+        },
+        'scenarios': {},
+    }
+    for name, (session_factory, make_request) in scenarios(new_session, args.users, weights, rng).items():
+        if args.only and name not in args.only:
+            continue
+        results['scenarios'][name] = run_scenario(session_factory, make_request, args.requests, args.warmup, counter)
+
+    if args.gunicorn:
+        results['rss_mb'] = round(sum(rss_mb(pid) for pid in process_tree(server.pid)), 1)
+    else:
+        results['rss_mb'] = round(rss_mb(os.getpid()), 1)
+        results['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+    report = json.dumps(results, indent=2)
+    print(report)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report + '\n')
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for line in regressions:
+            print(f'REGRESSION {line}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
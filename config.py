@@ -3,15 +3,188 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+basedir = os.path.abspath(os.path.dirname(__file__))
+
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'dev-secret-key-change-this-in-prod'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     UPLOAD_FOLDER = os.path.join(os.getcwd(), 'mydiary', 'static', 'uploads')
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max upload
+    INBOX_PAGE_SIZE = 20
+    ADMIN_PAGE_SIZE = 50  # flagged messages per page of /admin/flagged
+
+    # Account created by `flask bootstrap`
+    ADMIN_USERNAME = os.environ.get('ADMIN_USERNAME', 'admin')
+    ADMIN_EMAIL = os.environ.get('ADMIN_EMAIL', 'admin@mydiary.page')
+    ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD', 'admin123')
+
+    # Password hashing. Existing hashes with other parameters are upgraded on
+    # the next successful login. Verification runs in a pool of
+    # PASSWORD_HASH_WORKERS processes (0 = in the request thread).
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+    PASSWORD_HASH_MAX_PENDING = 32  # verifications queued per process before logins get a 503
+    PASSWORD_HASH_TIMEOUT = 5  # seconds
+    INBOX_BULK_BATCH_SIZE = 1000  # rows per UPDATE/DELETE transaction
+    INBOX_BULK_MAX_ROWS = 10000  # rows per bulk request; clients repeat while `more` is true
+    # Hand the rows past INBOX_BULK_MAX_ROWS to `flask worker` instead of asking the client to repeat
+    INBOX_BULK_IN_BACKGROUND = os.environ.get('INBOX_BULK_IN_BACKGROUND', '').lower() in ('1', 'true', 'yes')
+    INBOX_UNREAD_POLL_INTERVAL = 60  # seconds between refreshes of the unread badge in the nav bar
+
+    # Live inbox over server-sent events. Each open stream holds a thread, so
+    # run gunicorn with `--worker-class gthread --threads N`; the caps are per
+    # process. Messages written by other processes arrive within
+    # INBOX_STREAM_POLL_INTERVAL seconds.
+    INBOX_STREAM_ENABLED = os.environ.get('INBOX_STREAM_ENABLED', '1').lower() in ('1', 'true', 'yes')
+    INBOX_STREAM_POLL_INTERVAL = 1.0
+    INBOX_STREAM_HEARTBEAT = 15  # seconds between keep-alive comments
+    INBOX_STREAM_MAX_AGE = 600  # seconds before a stream is closed and the browser reconnects
+    INBOX_STREAM_RETRY_MS = 3000
+    INBOX_STREAM_MAX_CONNECTIONS = 200
+    INBOX_STREAM_MAX_PER_USER = 3  # a further tab replaces the user's oldest stream
+    INBOX_STREAM_QUEUE_SIZE = 100  # undelivered messages before a slow client is dropped
+
+    # Message ingestion: 'sync' writes in the request, 'thread' drains a
+    # durable spool from a background thread, 'worker' leaves draining to
+    # `flask ingest-worker`.
+    INGEST_MODE = os.environ.get('INGEST_MODE', 'sync')
+    INGEST_SPOOL_DIR = os.path.join(basedir, 'instance', 'spool')
+    INGEST_BATCH_SIZE = 500
+    INGEST_FLUSH_INTERVAL = 0.5  # seconds
+    INGEST_QUEUE_MAX = 10000  # rows buffered per process in 'thread' mode
+    INGEST_SPOOL_MAX_BYTES = 64 * 1024 * 1024  # spool size cap in 'worker' mode
+    INGEST_FSYNC = False
+
+    # Background jobs, run by `flask worker`. JOB_SCHEDULES maps task names
+    # to cron expressions in UTC; e.g. add 'purge-read-messages': '15 3 * * *'
+    # to delete read messages older than PURGE_READ_MESSAGES_AFTER_DAYS nightly.
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 2))
+    JOB_POLL_INTERVAL = 1  # seconds between polls of an empty queue
+    JOB_TIMEOUT = 600  # seconds a job may run before its worker is assumed dead
+    JOB_RETRY_BACKOFF = 10  # seconds before the first retry, doubling after that
+    JOB_RETRY_MAX_DELAY = 3600
+    JOB_KEEP_FINISHED_DAYS = 7
+    JOB_SCHEDULES = {
+        'score-messages': '* * * * *',
+        'archive-old-data': '0 3 * * *',
+        'prune-jobs': '45 3 * * *',
+        'reconcile-unread': '20 * * * *',
+        'refresh-leaderboard': '*/10 * * * *',
+        'rebuild-leaderboard': '40 4 * * 0',
+        'rebuild-stats': '30 4 * * 0',
+    }
+    PURGE_READ_MESSAGES_AFTER_DAYS = 90
+
+    # Trending users on /discover: messages received, each counting
+    # exp(-age / period) for the board's period in seconds. Entries worth less
+    # than LEADERBOARD_MIN_SCORE are pruned by the refresh-leaderboard job.
+    LEADERBOARD_BOARDS = {'today': 24 * 3600, 'week': 7 * 24 * 3600}
+    LEADERBOARD_SIZE = 12
+    LEADERBOARD_MIN_SCORE = 0.05
+    LEADERBOARD_REBASE_PERIODS = 30  # periods before the stored scores are scaled back down
+
+    # Repeated anonymous sends: the same normalized text to the same recipient
+    # within DEDUPE_WINDOW seconds is dropped ('drop'), counted on the first
+    # copy ('collapse') or stored again ('off'). The Bloom filter in front of
+    # the lookup is per process and sized for DEDUPE_BLOOM_CAPACITY sends per
+    # window (two generations of about 1.2 MB per million at 1%).
+    DEDUPE_MODE = os.environ.get('DEDUPE_MODE', 'collapse')
+    DEDUPE_WINDOW = 3600
+    DEDUPE_BLOOM_CAPACITY = 1000000
+    DEDUPE_BLOOM_ERROR_RATE = 0.01
+
+    # Spam scoring: 'ingest' scores messages as they are written, 'async'
+    # leaves it to the score-messages job, 'off' disables it. Messages at or
+    # over SPAM_FLAG_THRESHOLD are flagged for /admin/flagged.
+    SPAM_SCORING = os.environ.get('SPAM_SCORING', 'ingest')
+    SPAM_BLOCKLIST_FILE = os.environ.get('SPAM_BLOCKLIST_FILE')  # one phrase per line; built-in list if unset
+    SPAM_VELOCITY_WINDOW = 600  # seconds of per-IP history
+    SPAM_DUPLICATE_WINDOW = 10000  # recent messages kept to find near-duplicates from the same IP, per process
+    SPAM_FLAG_THRESHOLD = 0.8
+    SPAM_MODEL = {
+        'bias': -4.0,
+        # One blocklist hit alone stays under the threshold; with a link, a burst or a second hit it does not
+        'weights': {'blocklist': 4.5, 'links': 1.5, 'ip_velocity': 0.8, 'near_duplicates': 1.2, 'caps': 1.5},
+    }
+
+    # Sliding-window limits for anonymous sends, as (requests, seconds).
+    # 'sqlite' shares counters between gunicorn workers on one host.
+    RATELIMIT_ENABLED = True
+    RATELIMIT_BACKEND = os.environ.get('RATELIMIT_BACKEND', 'memory')
+    RATELIMIT_STORAGE_PATH = os.path.join(basedir, 'instance', 'ratelimit.db')
+    RATELIMIT_SEND_PER_IP = (5, 60)
+    RATELIMIT_SEND_PER_RECIPIENT = (120, 60)
+    RATELIMIT_EXPORT = (5, 3600)
+    RATELIMIT_LOGIN_FAILURES_PER_IP = (20, 300)
+    RATELIMIT_LOGIN_FAILURES_PER_ACCOUNT = (5, 300)
+
+    # Share images for profiles (/u/<username>/card.png and qr.png), drawn in
+    # IMAGE_RENDER_WORKERS processes (0 = in the request thread) and kept on
+    # disk by content hash; the least recently served files go first once the
+    # directory outgrows IMAGE_CACHE_MAX_BYTES.
+    IMAGE_CACHE_DIR = os.environ.get('IMAGE_CACHE_DIR') or os.path.join(basedir, 'instance', 'image_cache')
+    IMAGE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+    IMAGE_CACHE_MAX_AGE = 86400  # seconds browsers, CDNs and crawlers may reuse an image
+    IMAGE_RENDER_WORKERS = int(os.environ.get('IMAGE_RENDER_WORKERS', 2))
+    IMAGE_RENDER_MAX_PENDING = 16  # renders queued per process before requests get a 503
+    IMAGE_RENDER_TIMEOUT = 10  # seconds
+    IMAGE_FONT = os.environ.get('IMAGE_FONT')  # TrueType file; Pillow's built-in font if unset
+    IMAGE_QR_SIZE = 512  # pixels
+
+    # In-process cache of rendered public profile fragments
+    FRAGMENT_CACHE_SIZE = 2048
+    FRAGMENT_CACHE_TTL = 60  # seconds; also bounds staleness across workers
+
+    # Compiled Jinja templates shared between workers; None disables it
+    TEMPLATE_BYTECODE_CACHE_DIR = os.environ.get('TEMPLATE_BYTECODE_CACHE_DIR') or \
+        os.path.join(basedir, 'instance', 'jinja_cache')
+
+    # Per-request query counts and timings, shown in Server-Timing and /admin/perf
+    PERF_INSTRUMENTATION = os.environ.get('PERF_INSTRUMENTATION', '').lower() in ('1', 'true', 'yes')
+    PERF_SLOT_SECONDS = 60
+    PERF_SLOTS = 60  # histogram window: the last hour
+    PERF_SLOW_QUERY_MS = 50
+    PERF_SLOW_QUERY_LOG = 50  # slow statements kept for /admin/perf
+    PERF_QUERY_WARN = 20  # log requests issuing more queries than this
+
+    # Engine profiles. SQLite gets these PRAGMAs on every connection: WAL lets
+    # readers run alongside the single writer, and busy_timeout makes writers
+    # queue instead of failing with "database is locked". Postgres gets a
+    # bounded pool that drops dead and stale connections.
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'busy_timeout': 5000,  # ms
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64000,  # KiB, i.e. 64 MB per connection
+        'temp_store': 'MEMORY',
+    }
+    POSTGRES_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_timeout': 10,
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+    }
+
+    # Retention: read, unflagged messages older than RETENTION_MESSAGE_DAYS
+    # (users can choose their own) and private diary entries older than
+    # RETENTION_ENTRY_DAYS move to the archive database in small batches.
+    # None turns a tier off. The archive defaults to a sibling SQLite file
+    # (mydiary-archive.db) or, on Postgres, to tables in the same database.
+    ARCHIVE_DATABASE_URL = os.environ.get('ARCHIVE_DATABASE_URL')
+    RETENTION_MESSAGE_DAYS = 90
+    RETENTION_ENTRY_DAYS = None
+    RETENTION_BATCH_SIZE = 500
+    RETENTION_PAUSE = 0.05  # seconds between batches, so other writers get the lock
+
+    # Read replicas for @read_only views, e.g. DATABASE_REPLICA_URLS=postgresql://r1/db,postgresql://r2/db
+    SQLALCHEMY_REPLICAS = [url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+    REPLICA_HEALTH_INTERVAL = 10  # seconds between pings of each replica
+    REPLICA_STICKY_SECONDS = 5  # read from the primary this long after a visitor's own write
 
 class DevelopmentConfig(Config):
     DEBUG = True
-    basedir = os.path.abspath(os.path.dirname(__file__))
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'sqlite:///' + os.path.join(basedir, 'instance', 'mydiary.db')
 
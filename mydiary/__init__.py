@@ -1,7 +1,10 @@
 import os
+import click
 from flask import Flask
 from config import config
-from mydiary.extensions import db, migrate, login_manager, csrf
+from mydiary.extensions import db, login_manager, csrf, ingest, limiter, fragment_cache, partials, perf, replicas, passwords, jobs, spam, dedupe, inbox_events, share_images
+from mydiary.commands import register_commands
+from mydiary.database import configure_engines, install_pragmas
 
 def create_app(config_name='default'):
     app = Flask(__name__)
@@ -12,10 +15,24 @@ def create_app(config_name='default'):
     os.makedirs(instance_path, exist_ok=True)
 
     # Initialize extensions
+    configure_engines(app)
     db.init_app(app)
-    migrate.init_app(app, db)
+    install_pragmas(app, db)
+    replicas.init_app(app)
+    _init_migrate(app)
     login_manager.init_app(app)
     csrf.init_app(app)
+    ingest.init_app(app)
+    limiter.init_app(app)
+    fragment_cache.init_app(app)
+    partials.init_app(app)
+    perf.init_app(app)
+    passwords.init_app(app)
+    jobs.init_app(app)
+    spam.init_app(app)
+    dedupe.init_app(app)
+    inbox_events.init_app(app)
+    share_images.init_app(app)
 
     # Register blueprints
     from mydiary.auth import bp as auth_bp
@@ -33,14 +50,16 @@ def create_app(config_name='default'):
     from mydiary.adminbp import bp as admin_bp
     app.register_blueprint(admin_bp, url_prefix='/admin')
 
-    with app.app_context():
-        db.create_all()
-        # Create admin if not exists
-        from mydiary.models import User
-        if not User.query.filter_by(username='admin').first():
-            admin = User(username='admin', email='admin@mydiary.page', bio='Official Admin Account')
-            admin.set_password('admin123')
-            db.session.add(admin)
-            db.session.commit()
+    register_commands(app)
+
+    # Registers the counter, search index and leaderboard hooks on the models, and the background tasks
+    from mydiary import stats, search, leaderboard, tasks
 
     return app
+
+def _init_migrate(app):
+    # Flask-Migrate drags in Alembic, which only the `flask db` commands need
+    if click.get_current_context(silent=True) is None:
+        return
+    from flask_migrate import Migrate
+    Migrate(app, db)
@@ -1,8 +1,17 @@
-from flask import render_template, abort, request, redirect, url_for
+from flask import render_template, abort, request, redirect, url_for, flash, current_app
 from flask_login import login_required, current_user
+from sqlalchemy.orm import load_only, joinedload
 from mydiary.adminbp import bp
-from mydiary.models import User, Message
-from mydiary.extensions import db
+from mydiary.models import User, Message, Job
+from mydiary.extensions import db, perf, jobs
+from mydiary.stats import site_totals
+from mydiary.perf import BUCKETS_MS
+from mydiary.database import pool_stats
+from mydiary.pagination import keyset_page, decode_cursor
+
+# Admin pages load only the columns their templates show, and relationships
+# they use are joined into the same query. benchmarks/bench_admin_queries.py
+# holds each page to a fixed query budget.
 
 @bp.route('/')
 @login_required
@@ -11,14 +20,18 @@ def index():
     if current_user.id != 1: # Assuming first user is admin for now
         abort(403)
         
-    users = User.query.order_by(User.created_at.desc()).limit(50).all()
-    messages_count = Message.query.count()
-    flagged_count = Message.query.filter_by(is_flagged=True).count()
+    users = (User.query
+             .options(load_only(User.id, User.username, User.email, User.created_at))
+             .order_by(User.created_at.desc())
+             .limit(50)
+             .all())
+    totals = site_totals()
     
     return render_template('admin/admin_index.html', 
                          users=users, 
-                         messages_count=messages_count,
-                         flagged_count=flagged_count)
+                         user_count=totals['user_count'],
+                         messages_count=totals['message_count'],
+                         flagged_count=totals['flagged_count'])
 
 @bp.route('/flagged')
 @login_required
@@ -26,8 +39,20 @@ def flagged_messages():
     if current_user.id != 1:
         abort(403)
     
-    flagged = Message.query.filter_by(is_flagged=True).order_by(Message.created_at.desc()).all()
-    return render_template('admin/flagged.html', messages=flagged)
+    cursor = request.args.get('cursor')
+    if cursor is not None:
+        cursor = decode_cursor(cursor)
+        if cursor is None:
+            abort(400)
+
+    query = (Message.query
+             .filter_by(is_flagged=True)
+             .options(load_only(Message.id, Message.recipient_id, Message.content, Message.category,
+                                Message.sender_ip, Message.spam_score, Message.created_at),
+                      joinedload(Message.recipient).load_only(User.id, User.username)))
+    flagged, next_cursor = keyset_page(query, Message, cursor, current_app.config['ADMIN_PAGE_SIZE'])
+    return render_template('admin/flagged.html', messages=flagged, next_cursor=next_cursor,
+                         cursor=request.args.get('cursor'))
 
 @bp.route('/message/<int:message_id>/delete', methods=['POST'])
 @login_required
@@ -39,4 +64,51 @@ def delete_message_admin(message_id):
     db.session.delete(message)
     db.session.commit()
     
-    return redirect(url_for('adminbp.flagged_messages'))
+    return redirect(url_for('adminbp.flagged_messages', cursor=request.args.get('cursor')))
+
+@bp.route('/perf')
+@login_required
+def perf_dashboard():
+    if current_user.id != 1:
+        abort(403)
+
+    pools = pool_stats(db)
+    if not perf.enabled:
+        return render_template('admin/perf.html', enabled=False, pools=pools)
+    endpoints, slow_queries = perf.stats.snapshot()
+    return render_template('admin/perf.html',
+                         enabled=True,
+                         pools=pools,
+                         endpoints=endpoints,
+                         slow_queries=slow_queries,
+                         buckets=BUCKETS_MS,
+                         window_minutes=perf.stats.slot_seconds * perf.stats.slots.maxlen // 60)
+
+# Site-wide maintenance an admin can start from /admin/jobs
+MAINTENANCE_TASKS = ('rebuild-stats', 'rebuild-search', 'rebuild-leaderboard', 'purge-read-messages', 'prune-jobs')
+
+@bp.route('/jobs')
+@login_required
+def jobs_dashboard():
+    if current_user.id != 1:
+        abort(403)
+
+    failures = (Job.query.filter(Job.last_error.isnot(None))
+                .options(load_only(Job.id, Job.task, Job.status, Job.attempts, Job.max_attempts, Job.last_error))
+                .order_by(Job.id.desc()).limit(20).all())
+    return render_template('admin/jobs.html',
+                         tasks=jobs.stats(),
+                         failures=failures,
+                         maintenance=MAINTENANCE_TASKS)
+
+@bp.route('/jobs/<task>', methods=['POST'])
+@login_required
+def enqueue_job(task):
+    if current_user.id != 1:
+        abort(403)
+    if task not in MAINTENANCE_TASKS:
+        abort(404)
+
+    job_id = jobs.enqueue(task)
+    flash(f'Queued {task} as job {job_id}', 'success')
+    return redirect(url_for('adminbp.jobs_dashboard'))
@@ -1,6 +1,7 @@
-from flask import render_template, redirect, url_for, flash, request
+from flask import render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_user, logout_user, current_user
-from mydiary.extensions import db
+from mydiary.extensions import db, limiter
+from mydiary.passwords import PasswordHasherBusy
 from mydiary.auth import bp
 from mydiary.auth.forms import RegistrationForm, LoginForm
 from mydiary.models import User
@@ -25,15 +26,39 @@ def login():
         return redirect(url_for('diary.dashboard'))
     form = LoginForm()
     if form.validate_on_submit():
+        throttles = _login_throttles(form.email.data)
+        # Checked before the lookup and the hash, so a stuffing burst costs no CPU
+        if any(limiter.count(key, period) >= limit for key, limit, period in throttles):
+            flash('Too many failed logins. Try again in a few minutes.', 'error')
+            return render_template('login.html', title='Login', form=form), 429
+
         user = User.query.filter_by(email=form.email.data).first()
-        if user and user.check_password(form.password.data):
+        try:
+            valid = user is not None and user.check_password(form.password.data)
+        except PasswordHasherBusy:
+            flash('We are busy right now, please try again in a moment.', 'error')
+            return render_template('login.html', title='Login', form=form), 503
+
+        if valid:
+            if user.password_needs_rehash():
+                user.set_password(form.password.data)
+                db.session.commit()
             login_user(user, remember=form.remember_me.data)
             next_page = request.args.get('next')
             return redirect(next_page) if next_page else redirect(url_for('diary.dashboard'))
         else:
+            for key, limit, period in throttles:
+                limiter.hit(key, limit, period)
             flash('Login Unsuccessful. Please check email and password', 'error')
     return render_template('login.html', title='Login', form=form)
 
+def _login_throttles(email):
+    config = current_app.config
+    return [
+        (f'login:ip:{request.remote_addr}', *config['RATELIMIT_LOGIN_FAILURES_PER_IP']),
+        (f'login:account:{email.strip().lower()}', *config['RATELIMIT_LOGIN_FAILURES_PER_ACCOUNT']),
+    ]
+
 @bp.route('/logout')
 def logout():
     logout_user()
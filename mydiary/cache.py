@@ -0,0 +1,85 @@
+import itertools
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app
+
+class LRUCache:
+    """Thread-safe LRU mapping whose entries also expire after `ttl` seconds."""
+
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return default
+            value, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+class FragmentCache:
+    """Rendered-fragment cache with per-owner versioned keys.
+
+    Invalidating an owner gives them a new version, so every fragment cached
+    under the old one simply stops being looked up and ages out of the LRU.
+    Versions live in the same LRU, so they are bounded with the fragments;
+    they are drawn from a counter that never repeats, so a version that gets
+    evicted cannot bring an old fragment back. Versions are per process:
+    other workers see a change once the TTL lapses.
+    """
+
+    def init_app(self, app):
+        app.extensions['fragment_cache'] = LRUCache(
+            app.config['FRAGMENT_CACHE_SIZE'], app.config['FRAGMENT_CACHE_TTL']
+        )
+        app.extensions['fragment_cache_versions'] = itertools.count()
+
+    @property
+    def _store(self):
+        return current_app.extensions['fragment_cache']
+
+    def _new_version(self, owner):
+        version = next(current_app.extensions['fragment_cache_versions'])
+        self._store.set(('version', owner), version)
+        return version
+
+    def _key(self, name, owner):
+        version = self._store.get(('version', owner))
+        if version is None:
+            version = self._new_version(owner)
+        return (name, owner, version)
+
+    def get(self, name, owner):
+        return self._store.get(self._key(name, owner))
+
+    def set(self, name, owner, value):
+        self._store.set(self._key(name, owner), value)
+
+    def invalidate(self, owner):
+        self._new_version(owner)
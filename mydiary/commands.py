@@ -0,0 +1,137 @@
+import time
+import click
+from flask.cli import with_appcontext
+from mydiary.extensions import db, ingest, jobs
+from mydiary.database import upgrade_schema
+
+def bootstrap_database():
+    """Create missing tables, bring existing ones up to date, and create the admin account.
+
+    Safe to run repeatedly.
+
+    Returns True if the admin account was created.
+    """
+    from flask import current_app
+    from mydiary.models import User
+    from mydiary.leaderboard import refresh
+    from mydiary.search import backfill as backfill_search
+    from mydiary.stats import backfill
+    # Primary and archive only: read replicas get their schema through replication
+    db.create_all(bind_key=[None, 'archive'])
+    for bind_key in (None, 'archive'):
+        upgrade_schema(db, bind_key)
+    backfill()
+    backfill_search()
+    refresh()
+    config = current_app.config
+    if User.query.filter_by(username=config['ADMIN_USERNAME']).first():
+        return False
+    admin = User(username=config['ADMIN_USERNAME'], email=config['ADMIN_EMAIL'], bio='Official Admin Account')
+    admin.set_password(config['ADMIN_PASSWORD'])
+    db.session.add(admin)
+    db.session.commit()
+    return True
+
+@click.command('bootstrap')
+@with_appcontext
+def bootstrap():
+    """Create the database schema and the admin account."""
+    created = bootstrap_database()
+    click.echo('Database ready' + (', admin account created' if created else ''))
+
+@click.command('ingest-worker')
+@click.option('--once', is_flag=True, help='Drain the spool once and exit.')
+@click.option('--interval', default=None, type=float, help='Seconds between drains.')
+@with_appcontext
+def ingest_worker(once, interval):
+    """Drain the message spool into the database."""
+    from flask import current_app
+    interval = interval or current_app.config['INGEST_FLUSH_INTERVAL']
+    while True:
+        written = ingest.drain()
+        if written:
+            click.echo(f'Wrote {written} messages')
+        if once:
+            break
+        time.sleep(interval)
+
+@click.command('worker')
+@click.option('--threads', default=None, type=int, help='Jobs to run at once (default JOB_WORKER_THREADS).')
+@click.option('--once', is_flag=True, help='Run the jobs that are due and exit.')
+@with_appcontext
+def worker(threads, once):
+    """Run background jobs and the JOB_SCHEDULES until stopped."""
+    from flask import current_app
+    threads = threads or current_app.config['JOB_WORKER_THREADS']
+    click.echo(f'Worker running {threads} thread(s): {", ".join(sorted(jobs.tasks))}')
+    jobs.run_worker(threads, once=once)
+
+@click.command('enqueue')
+@click.argument('task')
+@click.option('--payload', default='{}', help='Task arguments as a JSON object.')
+@click.option('--delay', default=0, type=float, help='Seconds to wait before running.')
+@with_appcontext
+def enqueue(task, payload, delay):
+    """Queue a background job for `flask worker`."""
+    import json
+    if task not in jobs.tasks:
+        raise click.ClickException(f'Unknown task {task!r}; one of {", ".join(sorted(jobs.tasks))}')
+    click.echo(f'Queued job {jobs.enqueue(task, json.loads(payload), delay=delay)}')
+
+@click.command('rebuild-stats')
+@with_appcontext
+def rebuild_stats():
+    """Recompute the per-user counters from the source tables."""
+    from mydiary.stats import rebuild
+    click.echo(f'Rebuilt stats for {rebuild()} users')
+
+@click.command('rebuild-search')
+@with_appcontext
+def rebuild_search():
+    """Repopulate the username/bio/diary search index."""
+    from mydiary.search import rebuild
+    rebuild()
+    click.echo('Search index rebuilt')
+
+@click.command('archive')
+@click.option('--vacuum', is_flag=True, help='Return the freed space to the filesystem (locks the database while it runs).')
+@with_appcontext
+def archive(vacuum):
+    """Move rows past their retention period to the archive database."""
+    from mydiary.retention import archive_old_data
+    report = archive_old_data(vacuum=vacuum)
+    before, after = report['before'], report['after']
+    click.echo(f"Archived {report['messages']} messages and {report['entries']} entries "
+               f"({_megabytes(report['content_bytes'])} of text)")
+    click.echo(f"Main database: {_megabytes(before['bytes'])} -> {_megabytes(after['bytes'])}")
+    if after['free_bytes']:
+        click.echo(f"{_megabytes(after['free_bytes'])} of it is free pages; rerun with --vacuum to reclaim them")
+
+def _megabytes(size):
+    return 'unknown' if size is None else f'{size / 1024 / 1024:.1f} MB'
+
+@click.command('export-user')
+@click.argument('username')
+@click.option('--format', 'fmt', type=click.Choice(['ndjson', 'csv']), default='ndjson')
+@click.option('--gzip', 'compress', is_flag=True, help='Gzip the output.')
+@click.option('--output', '-o', type=click.File('wb'), default='-', help='File to write (default stdout).')
+@with_appcontext
+def export_user(username, fmt, compress, output):
+    """Stream a user's diary entries and messages."""
+    from mydiary.models import User
+    from mydiary.export import export_stream
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f'No user named {username!r}')
+    for chunk in export_stream(user.id, fmt, compress):
+        output.write(chunk)
+
+def register_commands(app):
+    app.cli.add_command(bootstrap)
+    app.cli.add_command(ingest_worker)
+    app.cli.add_command(worker)
+    app.cli.add_command(enqueue)
+    app.cli.add_command(rebuild_stats)
+    app.cli.add_command(rebuild_search)
+    app.cli.add_command(archive)
+    app.cli.add_command(export_user)
@@ -0,0 +1,118 @@
+import os
+from sqlalchemy import event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.schema import CreateColumn
+from mydiary.replicas import replica_keys
+
+def engine_options(config, uri, overrides=None):
+    """Engine options for `uri`: the dialect's profile from the config, then `overrides`."""
+    options = {}
+    if make_url(uri).get_backend_name() == 'postgresql':
+        options.update(config['POSTGRES_ENGINE_OPTIONS'])
+    options.update(overrides or {})
+    return options
+
+def archive_url(uri):
+    """Where the archive tables live when ARCHIVE_DATABASE_URL is unset.
+
+    A SQLite file gets a sibling ``-archive`` file, so moving rows out
+    actually shrinks the hot database; anything else keeps them alongside.
+    """
+    url = make_url(uri)
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        root, ext = os.path.splitext(url.database)
+        return url.set(database=f'{root}-archive{ext}').render_as_string(hide_password=False)
+    return uri
+
+def configure_engines(app):
+    """Fill in per-dialect engine options for the main database, binds and read replicas.
+
+    Must run before ``db.init_app``, which creates the engines.
+    """
+    config = app.config
+    overrides = config.get('SQLALCHEMY_ENGINE_OPTIONS') or {}
+    uri = config.get('SQLALCHEMY_DATABASE_URI')
+    binds = {}
+    sources = dict(config.get('SQLALCHEMY_BINDS') or {})
+    if uri:
+        sources.setdefault('archive', config.get('ARCHIVE_DATABASE_URL') or archive_url(uri))
+    for key, bind in sources.items():
+        if isinstance(bind, str):
+            bind = {'url': bind, **engine_options(config, bind, overrides)}
+        binds[key] = bind
+    for key, uri in zip(replica_keys(config), config.get('SQLALCHEMY_REPLICAS') or []):
+        binds[key] = {'url': uri, **engine_options(config, uri, overrides)}
+    config['SQLALCHEMY_BINDS'] = binds
+    if uri:
+        config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(config, uri, overrides)
+
+# Columns added to tables that older databases already have, by table. create_all()
+# only creates missing tables, so upgrade_schema adds these with ALTER TABLE.
+ADDED_COLUMNS = {
+    'message': ['spam_score', 'content_hash', 'duplicate_count'],
+    'user': ['message_retention_days'],
+}
+
+def upgrade_schema(db, bind_key=None):
+    """Add ADDED_COLUMNS and any missing indexes to the tables that already exist.
+
+    Safe to run repeatedly. Returns what it created, as 'table.column' and
+    index names.
+    """
+    engine = db.engines[bind_key]
+    quote = engine.dialect.identifier_preparer.format_table
+    created = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        existing = set(inspector.get_table_names())
+        for table in db.metadatas[bind_key].sorted_tables:
+            if table.name not in existing:
+                continue
+            columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for name in ADDED_COLUMNS.get(table.name, ()):
+                if name not in columns:
+                    column = CreateColumn(table.c[name]).compile(dialect=engine.dialect)
+                    connection.execute(text(f'ALTER TABLE {quote(table)} ADD COLUMN {column}'))
+                    columns.add(name)
+                    created.append(f'{table.name}.{name}')
+            indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                # An index on a column missing from ADDED_COLUMNS would fail; leave it
+                if index.name not in indexes and {column.name for column in index.columns} <= columns:
+                    index.create(connection)
+                    created.append(index.name)
+    return created
+
+def install_pragmas(app, db):
+    """Run SQLITE_PRAGMAS on every new connection to a SQLite engine."""
+    pragmas = app.config['SQLITE_PRAGMAS']
+    if not pragmas:
+        return
+    with app.app_context():
+        engines = list(db.engines.values())
+    for engine in engines:
+        if engine.dialect.name == 'sqlite' and engine.url.database not in (None, '', ':memory:'):
+            event.listen(engine, 'connect', _pragma_setter(pragmas))
+
+def _pragma_setter(pragmas):
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for name, value in pragmas.items():
+                cursor.execute(f'PRAGMA {name}={value}')
+        finally:
+            cursor.close()
+    return set_pragmas
+
+def pool_stats(db):
+    """Checkout counters for each engine's connection pool, keyed by bind (None is the default)."""
+    stats = {}
+    for key, engine in db.engines.items():
+        pool = engine.pool
+        entry = {'url': engine.url.render_as_string(hide_password=True), 'pool': type(pool).__name__}
+        for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+            method = getattr(pool, name, None)
+            if method is not None:
+                entry[name] = method()
+        stats[key] = entry
+    return stats
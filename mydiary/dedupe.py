@@ -0,0 +1,112 @@
+import hashlib
+import math
+import re
+import threading
+import time
+from datetime import datetime, timedelta
+from flask import current_app
+
+def fingerprint(content):
+    """Hash of the message text with case, punctuation and spacing normalized away."""
+    normalized = ' '.join(re.findall(r'\w+', content.lower()))
+    return hashlib.blake2b(normalized.encode(), digest_size=8).hexdigest()
+
+class BloomFilter:
+    """Fixed-size set membership with false positives but no false negatives."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+class RotatingBloomFilter:
+    """Two Bloom filter generations, so keys are forgotten between one and two `period`s after they were added."""
+
+    def __init__(self, capacity, error_rate, period):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.period = period
+        self.current = BloomFilter(capacity, error_rate)
+        self.previous = BloomFilter(capacity, error_rate)
+        self.rotated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def check_and_add(self, key):
+        """Add `key`; return True if it may have been added before."""
+        with self.lock:
+            if time.monotonic() - self.rotated_at >= self.period:
+                self.previous, self.current = self.current, BloomFilter(self.capacity, self.error_rate)
+                self.rotated_at = time.monotonic()
+            in_current = key in self.current
+            if not in_current:
+                self.current.add(key)
+            return in_current or key in self.previous
+
+class Deduplicator:
+    """Catches the same text sent to the same recipient again within DEDUPE_WINDOW.
+
+    A per-process Bloom filter of recipient/fingerprint pairs answers "never
+    seen" without touching the database, which is the common case; only
+    possible repeats are looked up in the message table. DEDUPE_MODE 'drop'
+    discards repeats and 'collapse' counts them on the first copy.
+    """
+
+    def init_app(self, app):
+        mode = app.config['DEDUPE_MODE']
+        if mode not in ('off', 'drop', 'collapse'):
+            raise ValueError(f'Unknown DEDUPE_MODE {mode!r}')
+        app.extensions['dedupe'] = {
+            'seen': RotatingBloomFilter(app.config['DEDUPE_BLOOM_CAPACITY'], app.config['DEDUPE_BLOOM_ERROR_RATE'],
+                                        app.config['DEDUPE_WINDOW']),
+            'lookups': 0,
+            'duplicates': 0,
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['dedupe']
+
+    def check(self, recipient_id, content):
+        """Return (duplicate, content_hash) for a message about to be sent.
+
+        When `duplicate` is true the caller should not store the message; in
+        'collapse' mode it has already been counted on the original.
+        """
+        from mydiary.extensions import db
+        from mydiary.models import Message
+        content_hash = fingerprint(content)
+        config = current_app.config
+        state = self._state
+        if config['DEDUPE_MODE'] == 'off' or not state['seen'].check_and_add(f'{recipient_id}:{content_hash}'):
+            return False, content_hash
+
+        state['lookups'] += 1
+        messages = Message.__table__
+        original = db.session.execute(
+            db.select(messages.c.id)
+            .where(messages.c.recipient_id == recipient_id,
+                   messages.c.content_hash == content_hash,
+                   messages.c.created_at >= datetime.utcnow() - timedelta(seconds=config['DEDUPE_WINDOW']))
+            .order_by(messages.c.created_at)
+            .limit(1)
+        ).scalar()
+        if original is None:
+            return False, content_hash
+        state['duplicates'] += 1
+        if config['DEDUPE_MODE'] == 'collapse':
+            db.session.execute(messages.update().where(messages.c.id == original)
+                               .values(duplicate_count=messages.c.duplicate_count + 1))
+            db.session.commit()
+        return True, content_hash
@@ -1,27 +1,149 @@
-from flask import render_template, redirect, url_for, flash, request, abort, jsonify
+import hashlib
+from datetime import date
+from flask import render_template, redirect, url_for, flash, request, abort, jsonify, current_app, session, Response, stream_with_context, send_file
 from flask_login import login_required, current_user
-from mydiary.extensions import db
+from markupsafe import Markup
+from sqlalchemy.orm import load_only
+from mydiary.extensions import db, fragment_cache, partials, limiter, share_images
 from mydiary.diary import bp
 from mydiary.models import User, DiaryEntry, Message
+from mydiary.pagination import keyset_page, decode_cursor
+from mydiary.stats import get_stats
+from mydiary.export import FORMATS, export_stream
+from mydiary.moderation import parse_bool
+from mydiary.replicas import read_only
+from mydiary.retention import archived_messages_page
+from mydiary.images import ImageRendererBusy
+
+def _page_cursor():
+    cursor = request.args.get('cursor')
+    if cursor is None:
+        return None
+    decoded = decode_cursor(cursor)
+    if decoded is None:
+        abort(400)
+    return decoded
+
+def _messages_page(cursor=None):
+    query = Message.query.filter_by(recipient_id=current_user.id)
+    return keyset_page(query, Message, cursor, current_app.config['INBOX_PAGE_SIZE'])
+
+def _entries_page(cursor=None):
+    query = DiaryEntry.query.filter_by(user_id=current_user.id)
+    return keyset_page(query, DiaryEntry, cursor, current_app.config['INBOX_PAGE_SIZE'])
 
 @bp.route('/dashboard')
 @login_required
 def dashboard():
-    messages = Message.query.filter_by(recipient_id=current_user.id).order_by(Message.created_at.desc()).all()
-    entries = DiaryEntry.query.filter_by(user_id=current_user.id).order_by(DiaryEntry.created_at.desc()).all()
-    return render_template('dashboard.html', messages=messages, entries=entries)
+    messages, messages_cursor = _messages_page()
+    entries, entries_cursor = _entries_page()
+    return render_template('dashboard.html',
+                         messages=messages,
+                         messages_cursor=messages_cursor,
+                         entries=entries,
+                         entries_cursor=entries_cursor,
+                         stats=get_stats(current_user.id))
+
+@bp.route('/dashboard/messages')
+@login_required
+def dashboard_messages():
+    messages, messages_cursor = _messages_page(_page_cursor())
+    return render_template('components/inbox_page.html', messages=messages, messages_cursor=messages_cursor)
+
+@bp.route('/dashboard/entries')
+@login_required
+def dashboard_entries():
+    entries, entries_cursor = _entries_page(_page_cursor())
+    return render_template('components/entries_page.html', entries=entries, entries_cursor=entries_cursor)
+
+@bp.route('/dashboard/archive')
+@login_required
+def dashboard_archive():
+    messages, archive_cursor = archived_messages_page(current_user.id, _page_cursor(),
+                                                      current_app.config['INBOX_PAGE_SIZE'])
+    return render_template('components/archive_page.html', messages=messages, archive_cursor=archive_cursor)
+
+def _profile_fragment(username):
+    fragment = fragment_cache.get('profile', username)
+    if fragment is not None:
+        return fragment
+
+    user = User.query.filter_by(username=username).first()
+    if not user:
+        return None
+
+    entries = user.entries.filter_by(is_public=True).order_by(DiaryEntry.created_at.desc()).all()
+    header = render_template('components/profile_header.html', user=user)
+    entries = render_template('components/public_entries.html', entries=entries)
+    fragment = {
+        'header': Markup(header),
+        'entries': Markup(entries),
+        'digest': hashlib.sha1((header + entries).encode()).hexdigest(),
+    }
+    fragment_cache.set('profile', username, fragment)
+    return fragment
+
+def _profile_etag(fragment):
+    # The page around the fragment varies with the viewer and their CSRF token
+    viewer = f'{current_user.id}:{current_user.theme_preference}' if current_user.is_authenticated else 'anon'
+    return hashlib.sha1(f"{fragment['digest']}:{viewer}:{session.get('csrf_token')}".encode()).hexdigest()
 
 @bp.route('/<username>')
+@read_only
 def public_profile(username):
-    user = User.query.filter_by(username=username).first()
+    fragment = _profile_fragment(username)
     
     # Redirect to homepage if user not found
-    if not user:
+    if fragment is None:
         flash('User not found. Create your own page!', 'info')
         return redirect(url_for('main.index'))
     
-    entries = user.entries.filter_by(is_public=True).order_by(DiaryEntry.created_at.desc()).all()
-    return render_template('profile.html', user=user, entries=entries)
+    etag = _profile_etag(fragment)
+    if request.if_none_match.contains(etag):
+        response = current_app.make_response(('', 304))
+    else:
+        response = current_app.make_response(
+            render_template('profile.html', username=username, fragment=fragment)
+        )
+        # Rendering may have issued this visitor's CSRF token
+        etag = _profile_etag(fragment)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _share_spec(username, kind):
+    user = User.query.options(load_only(User.username, User.bio, User.theme_preference)) \
+        .filter_by(username=username).first_or_404()
+    url = url_for('diary.public_profile', username=user.username, _external=True)
+    if kind == 'qr':
+        return {'kind': 'qr', 'url': url, 'size': current_app.config['IMAGE_QR_SIZE']}
+    return {'kind': 'card', 'url': url, 'username': user.username, 'bio': user.bio or '',
+            'theme': user.theme_preference or 'default', 'font': current_app.config['IMAGE_FONT']}
+
+def _share_image(spec):
+    # The digest names the file, so a matching ETag never needs the disk
+    digest = share_images.digest(spec)
+    if request.if_none_match.contains(digest):
+        response = current_app.make_response(('', 304))
+    else:
+        try:
+            image = share_images.open(spec, digest)
+        except ImageRendererBusy:
+            return Response('Image renderer busy', 503, {'Retry-After': '5'})
+        response = send_file(image, mimetype='image/png', etag=False, conditional=False)
+    response.set_etag(digest)
+    response.headers['Cache-Control'] = f"public, max-age={current_app.config['IMAGE_CACHE_MAX_AGE']}"
+    return response
+
+@bp.route('/u/<username>/card.png')
+@read_only
+def share_card(username):
+    return _share_image(_share_spec(username, 'card'))
+
+@bp.route('/u/<username>/qr.png')
+@read_only
+def share_qr(username):
+    return _share_image(_share_spec(username, 'qr'))
 
 @bp.route('/diary/new', methods=['POST'])
 @login_required
@@ -30,7 +152,7 @@ def create_diary_entry():
     is_public = request.form.get('is_public') == 'true'
     
     if not content:
-        return '<div class="text-red-500">Content cannot be empty!</div>', 400
+        return partials.render('status', 'Content cannot be empty!', 'error'), 400
     
     entry = DiaryEntry(
         user_id=current_user.id,
@@ -39,29 +161,9 @@ def create_diary_entry():
     )
     db.session.add(entry)
     db.session.commit()
+    fragment_cache.invalidate(current_user.username)
     
-    # Return the new entry HTML
-    return f'''
-    <div class="bg-white/5 border border-white/10 p-6 rounded-3xl mb-4" id="entry-{entry.id}">
-        <div class="flex justify-between items-start mb-3">
-            <span class="text-gray-400 text-sm">{entry.created_at.strftime('%b %d, %Y at %H:%M')}</span>
-            <span class="px-3 py-1 rounded-full text-xs font-bold {'bg-green-500/20 text-green-400' if entry.is_public else 'bg-gray-500/20 text-gray-400'}">
-                {'Public' if entry.is_public else 'Private'}
-            </span>
-        </div>
-        <p class="text-white text-lg mb-4">{entry.content}</p>
-        <div class="flex gap-2">
-            <button hx-post="/diary/{entry.id}/toggle-public" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
-                class="px-4 py-2 bg-white/10 hover:bg-white/20 rounded-xl text-sm transition-colors">
-                {'Make Private' if entry.is_public else 'Make Public'}
-            </button>
-            <button hx-delete="/diary/{entry.id}" hx-confirm="Delete this entry?" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
-                class="px-4 py-2 bg-red-500/20 hover:bg-red-500/30 text-red-400 rounded-xl text-sm transition-colors">
-                Delete
-            </button>
-        </div>
-    </div>
-    '''
+    return partials.render('diary_entry', entry)
 
 @bp.route('/diary/<int:entry_id>/toggle-public', methods=['POST'])
 @login_required
@@ -73,29 +175,9 @@ def toggle_diary_public(entry_id):
     
     entry.is_public = not entry.is_public
     db.session.commit()
+    fragment_cache.invalidate(current_user.username)
     
-    # Return updated entry HTML
-    return f'''
-    <div class="bg-white/5 border border-white/10 p-6 rounded-3xl mb-4" id="entry-{entry.id}">
-        <div class="flex justify-between items-start mb-3">
-            <span class="text-gray-400 text-sm">{entry.created_at.strftime('%b %d, %Y at %H:%M')}</span>
-            <span class="px-3 py-1 rounded-full text-xs font-bold {'bg-green-500/20 text-green-400' if entry.is_public else 'bg-gray-500/20 text-gray-400'}">
-                {'Public' if entry.is_public else 'Private'}
-            </span>
-        </div>
-        <p class="text-white text-lg mb-4">{entry.content}</p>
-        <div class="flex gap-2">
-            <button hx-post="/diary/{entry.id}/toggle-public" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
-                class="px-4 py-2 bg-white/10 hover:bg-white/20 rounded-xl text-sm transition-colors">
-                {'Make Private' if entry.is_public else 'Make Public'}
-            </button>
-            <button hx-delete="/diary/{entry.id}" hx-confirm="Delete this entry?" hx-swap="outerHTML" hx-target="#entry-{entry.id}"
-                class="px-4 py-2 bg-red-500/20 hover:bg-red-500/30 text-red-400 rounded-xl text-sm transition-colors">
-                Delete
-            </button>
-        </div>
-    </div>
-    '''
+    return partials.render('diary_entry', entry)
 
 @bp.route('/diary/<int:entry_id>', methods=['DELETE'])
 @login_required
@@ -107,21 +189,58 @@ def delete_diary_entry(entry_id):
     
     db.session.delete(entry)
     db.session.commit()
+    fragment_cache.invalidate(current_user.username)
     
     return '', 200
 
+@bp.route('/diary/export')
+@login_required
+def export_data():
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in FORMATS:
+        abort(400)
+    try:
+        compress = parse_bool(request.args.get('gzip', 'false'))
+    except ValueError:
+        abort(400)
+    if not limiter.hit(f'export:{current_user.id}', *current_app.config['RATELIMIT_EXPORT']):
+        abort(429)
+
+    filename = f'mydiary-{current_user.username}-{date.today().isoformat()}.{fmt}'
+    if compress:
+        filename += '.gz'
+    response = Response(
+        stream_with_context(export_stream(current_user.id, fmt, compress)),
+        mimetype='application/gzip' if compress else FORMATS[fmt],
+    )
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 @bp.route('/settings/theme', methods=['POST'])
 @login_required
 def update_theme():
     theme = request.form.get('theme')
     
     if theme not in ['default', 'bubblegum', 'vaporwave', 'cyberpop', 'soft-girl']:
-        return 'Invalid theme', 400
+        return partials.render('status', 'Invalid theme', 'error'), 400
     
     current_user.theme_preference = theme
     db.session.commit()
     
-    return f'<div class="text-green-400 text-sm">✓ Theme updated to {theme}!</div>'
+    return partials.render('status', f'✓ Theme updated to {theme}!')
+
+@bp.route('/settings/retention', methods=['POST'])
+@login_required
+def update_retention():
+    days = request.form.get('days', '')
+
+    if days not in ('', '0', '30', '90', '180', '365'):
+        return partials.render('status', 'Invalid retention period', 'error'), 400
+
+    current_user.message_retention_days = int(days) if days else None
+    db.session.commit()
+
+    return partials.render('status', '✓ Archive setting saved!')
 
 @bp.route('/settings/profile', methods=['POST'])
 @login_required
@@ -129,9 +248,10 @@ def update_profile():
     bio = request.form.get('bio', '').strip()
     
     if len(bio) > 140:
-        return '<div class="text-red-400 text-sm">Bio must be 140 characters or less</div>', 400
+        return partials.render('status', 'Bio must be 140 characters or less', 'error'), 400
     
     current_user.bio = bio
     db.session.commit()
+    fragment_cache.invalidate(current_user.username)
     
-    return '<div class="text-green-400 text-sm">✓ Profile updated!</div>'
+    return partials.render('status', '✓ Profile updated!')
@@ -0,0 +1,247 @@
+import logging
+import queue
+import threading
+import time
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+class Subscription:
+    """One open stream: the messages waiting to be sent to it, oldest first."""
+
+    def __init__(self, user_id, size):
+        self.user_id = user_id
+        self.queue = queue.Queue(size)
+
+    def put(self, item):
+        """Queue an item; False if the client has fallen too far behind and should reconnect."""
+        try:
+            self.queue.put_nowait(item)
+            return True
+        except queue.Full:
+            return False
+
+    def close(self):
+        # Wakes the stream even when its queue is full
+        while True:
+            try:
+                self.queue.put_nowait(None)
+                return
+            except queue.Full:
+                try:
+                    self.queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+class Broker:
+    """Fans new messages out to the inbox streams open in this process.
+
+    The message table doubles as the cross-process channel: while anyone is
+    subscribed, a dispatcher thread polls it for ids past the last one it
+    saw, every INBOX_STREAM_POLL_INTERVAL or as soon as this process writes
+    a message (``notify``), so messages written by other gunicorn workers or
+    by ``flask ingest-worker`` arrive within one interval. Each message is
+    rendered once, however many tabs it goes to. On Postgres a transaction
+    that commits after a higher id has been seen is missed by the stream and
+    shows up on the next page load.
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self.poll_interval = app.config['INBOX_STREAM_POLL_INTERVAL']
+        self.max_connections = app.config['INBOX_STREAM_MAX_CONNECTIONS']
+        self.max_per_user = app.config['INBOX_STREAM_MAX_PER_USER']
+        self.queue_size = app.config['INBOX_STREAM_QUEUE_SIZE']
+        self.subscribers = {}  # user id -> subscriptions, oldest first
+        self.connections = 0
+        self.last_id = None
+        self.delivered = 0
+        self.lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._dispatcher = None
+
+    def subscribe(self, user_id):
+        """Open a subscription, or return None when this process is at INBOX_STREAM_MAX_CONNECTIONS.
+
+        A user past INBOX_STREAM_MAX_PER_USER loses their oldest stream.
+        """
+        with self.lock:
+            if self.connections >= self.max_connections:
+                return None
+            if self.last_id is None:
+                # Messages up to here are the caller's to backfill; the dispatcher takes the rest
+                self.last_id = _latest_id()
+            subscriptions = self.subscribers.setdefault(user_id, [])
+            if len(subscriptions) >= self.max_per_user:
+                self._remove(subscriptions[0])
+            subscription = Subscription(user_id, self.queue_size)
+            subscriptions.append(subscription)
+            self.connections += 1
+        self._ensure_dispatcher()
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self.lock:
+            self._remove(subscription)
+
+    def _remove(self, subscription):
+        subscriptions = self.subscribers.get(subscription.user_id, [])
+        if subscription in subscriptions:
+            subscriptions.remove(subscription)
+            self.connections -= 1
+            subscription.close()
+        if not subscriptions:
+            self.subscribers.pop(subscription.user_id, None)
+
+    def notify(self):
+        self._wakeup.set()
+
+    def dispatch(self):
+        """Send every message written since the last call to its recipient's streams."""
+        from mydiary.extensions import db, partials
+        from mydiary.models import Message
+        messages = Message.__table__
+        with self.lock:
+            if not self.subscribers:
+                self.last_id = None
+                return 0
+            user_ids, last_id = list(self.subscribers), self.last_id
+        latest = _latest_id()
+        rows = db.session.execute(
+            db.select(messages)
+            .where(messages.c.id > last_id, messages.c.id <= latest, messages.c.recipient_id.in_(user_ids))
+            .order_by(messages.c.id)
+        ).all()
+        db.session.rollback()
+        with self.lock:
+            if self.last_id is not None:
+                self.last_id = max(self.last_id, latest)
+
+        sent = 0
+        for row in rows:
+            html = partials.render('inbox_message', row)
+            with self.lock:
+                subscriptions = list(self.subscribers.get(row.recipient_id, ()))
+            for subscription in subscriptions:
+                if subscription.put((row.id, html)):
+                    sent += 1
+                else:
+                    self.unsubscribe(subscription)
+        self.delivered += sent
+        return sent
+
+    def _ensure_dispatcher(self):
+        if self._dispatcher is not None and self._dispatcher.is_alive():
+            return
+        with self.lock:
+            if self._dispatcher is not None and self._dispatcher.is_alive():
+                return
+            self._dispatcher = threading.Thread(target=self._run, name='mydiary-inbox-events', daemon=True)
+            self._dispatcher.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            with self.app.app_context():
+                try:
+                    self.dispatch()
+                except Exception:
+                    from mydiary.extensions import db
+                    db.session.rollback()
+                    log.exception('Inbox event dispatch failed')
+
+def _latest_id():
+    from mydiary.extensions import db
+    from mydiary.models import Message
+    return db.session.execute(db.select(db.func.max(Message.__table__.c.id))).scalar() or 0
+
+def format_event(data, event=None, event_id=None):
+    """One server-sent event; every line of a multi-line payload gets its own ``data:`` field."""
+    lines = []
+    if event_id is not None:
+        lines.append(f'id: {event_id}')
+    if event is not None:
+        lines.append(f'event: {event}')
+    lines.extend(f'data: {line}' for line in data.splitlines() or [''])
+    return '\n'.join(lines) + '\n\n'
+
+class InboxEvents:
+    """Extension behind ``/inbox/stream``: live delivery of new messages to their recipient's dashboard."""
+
+    def init_app(self, app):
+        app.extensions['inbox_events'] = Broker(app) if app.config['INBOX_STREAM_ENABLED'] else None
+
+    @property
+    def broker(self):
+        return current_app.extensions['inbox_events']
+
+    @property
+    def enabled(self):
+        return self.broker is not None
+
+    def notify(self):
+        """Called after messages are written, so this process delivers them without waiting for the next poll."""
+        if self.broker is not None:
+            self.broker.notify()
+
+    def stream(self, user_id, after):
+        """Generator of events for one client, or None when the process has no room for another stream.
+
+        Messages past `after` (the newest the client has, from the page or the
+        Last-Event-ID of a reconnect) that were written before the
+        subscription are backfilled first, up to INBOX_PAGE_SIZE. A comment
+        goes out every INBOX_STREAM_HEARTBEAT seconds to keep proxies from
+        timing the connection out, and the stream ends after
+        INBOX_STREAM_MAX_AGE so the browser reconnects and the thread is freed.
+        """
+        broker = self.broker
+        subscription = broker.subscribe(user_id)
+        if subscription is None:
+            return None
+        config = current_app.config
+        heartbeat, max_age = config['INBOX_STREAM_HEARTBEAT'], config['INBOX_STREAM_MAX_AGE']
+        backlog = _backfill(user_id, after, config['INBOX_PAGE_SIZE'])
+
+        def events():
+            from mydiary.extensions import partials
+            last_id = after
+            deadline = time.monotonic() + max_age
+            try:
+                yield f'retry: {config["INBOX_STREAM_RETRY_MS"]}\n\n'
+                for row in backlog:
+                    yield format_event(partials.render('inbox_message', row), 'message', row.id)
+                    last_id = row.id
+                while True:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return
+                    try:
+                        item = subscription.queue.get(timeout=min(heartbeat, remaining))
+                    except queue.Empty:
+                        yield ': heartbeat\n\n'
+                        continue
+                    if item is None:
+                        return  # replaced by a newer stream, or too far behind
+                    message_id, html = item
+                    if message_id > last_id:
+                        yield format_event(html, 'message', message_id)
+                        last_id = message_id
+            finally:
+                broker.unsubscribe(subscription)
+
+        return events()
+
+def _backfill(user_id, after, limit):
+    from mydiary.extensions import db
+    from mydiary.models import Message
+    messages = Message.__table__
+    rows = db.session.execute(
+        db.select(messages)
+        .where(messages.c.recipient_id == user_id, messages.c.id > after)
+        .order_by(messages.c.id.desc())
+        .limit(limit)
+    ).all()
+    # The stream outlives the request's session; do not hold a read transaction open
+    db.session.close()
+    return rows[::-1]
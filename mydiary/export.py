@@ -0,0 +1,73 @@
+import csv
+import io
+import json
+import zlib
+from mydiary.extensions import db
+from mydiary.models import DiaryEntry, Message, ArchivedDiaryEntry, ArchivedMessage
+
+FORMATS = {
+    'ndjson': 'application/x-ndjson',
+    'csv': 'text/csv',
+}
+CSV_FIELDS = ['type', 'id', 'created_at', 'content', 'is_public', 'category', 'is_read', 'is_flagged']
+
+# sender_ip is deliberately left out: exporting it would unmask anonymous senders
+ENTRY_FIELDS = ['id', 'created_at', 'content', 'is_public']
+MESSAGE_FIELDS = ['id', 'created_at', 'content', 'category', 'is_read', 'is_flagged']
+
+def export_rows(user_id, batch_size=1000):
+    """Yield a user's diary entries, then their messages, as dicts, archived ones included.
+
+    Rows are streamed from a server-side cursor `batch_size` at a time, so
+    memory stays flat however large the export is.
+    """
+    for kind, model, fields, owner in (
+        ('entry', DiaryEntry, ENTRY_FIELDS, 'user_id'),
+        ('entry', ArchivedDiaryEntry, ENTRY_FIELDS, 'user_id'),
+        ('message', Message, MESSAGE_FIELDS, 'recipient_id'),
+        ('message', ArchivedMessage, MESSAGE_FIELDS, 'recipient_id'),
+    ):
+        # Mapped attributes, so archived rows are read from the archive bind
+        result = db.session.execute(
+            db.select(*(getattr(model, name) for name in fields))
+            .where(getattr(model, owner) == user_id).order_by(model.id)
+            .execution_options(yield_per=batch_size)
+        )
+        for row in result:
+            record = {'type': kind, **row._asdict()}
+            record['created_at'] = record['created_at'].isoformat() if record['created_at'] else None
+            yield record
+
+def serialize(rows, fmt, chunk_size=64 * 1024):
+    """Encode rows as NDJSON or CSV, yielding bytes in chunks of about `chunk_size`."""
+    buffer = io.StringIO()
+    if fmt == 'csv':
+        writer = csv.DictWriter(buffer, fieldnames=CSV_FIELDS, extrasaction='ignore')
+        writer.writeheader()
+        write = writer.writerow
+    else:
+        def write(row):
+            buffer.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')))
+            buffer.write('\n')
+
+    for row in rows:
+        write(row)
+        if buffer.tell() >= chunk_size:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+def gzip_chunks(chunks, level=6):
+    """Gzip a byte stream on the fly."""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 31: gzip header and trailer
+    for chunk in chunks:
+        compressed = compressor.compress(chunk)
+        if compressed:
+            yield compressed
+    yield compressor.flush()
+
+def export_stream(user_id, fmt, compress=False):
+    chunks = serialize(export_rows(user_id), fmt)
+    return gzip_chunks(chunks) if compress else chunks
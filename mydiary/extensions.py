@@ -1,12 +1,34 @@
 from flask_sqlalchemy import SQLAlchemy
-from flask_migrate import Migrate
 from flask_login import LoginManager
 from flask_wtf.csrf import CSRFProtect
+from mydiary.ingest import MessageIngestor
+from mydiary.ratelimit import RateLimiter
+from mydiary.cache import FragmentCache
+from mydiary.partials import Partials
+from mydiary.perf import PerfMonitor
+from mydiary.replicas import RoutingSession, ReplicaRouter
+from mydiary.passwords import PasswordHasher
+from mydiary.jobs import JobQueue
+from mydiary.spam import SpamScorer
+from mydiary.dedupe import Deduplicator
+from mydiary.events import InboxEvents
+from mydiary.images import ShareImages
 
-db = SQLAlchemy()
-migrate = Migrate()
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 login_manager = LoginManager()
 csrf = CSRFProtect()
+ingest = MessageIngestor()
+limiter = RateLimiter()
+fragment_cache = FragmentCache()
+partials = Partials()
+perf = PerfMonitor()
+replicas = ReplicaRouter()
+passwords = PasswordHasher()
+jobs = JobQueue()
+spam = SpamScorer()
+dedupe = Deduplicator()
+inbox_events = InboxEvents()
+share_images = ShareImages()
 
 login_manager.login_view = 'auth.login'
 login_manager.login_message = 'Please log in to access this page.'
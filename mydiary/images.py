@@ -0,0 +1,271 @@
+"""Share images for public profiles: a link-preview card and a QR code, drawn with Pillow.
+
+An image is named after the SHA-256 of everything drawn on it (its spec),
+so a cached file never goes stale: a new bio or theme names a different
+file, and the digest doubles as a strong ETag. Files live under
+IMAGE_CACHE_DIR and the least recently served are deleted once the
+directory outgrows IMAGE_CACHE_MAX_BYTES.
+"""
+import hashlib
+import io
+import json
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError
+from flask import current_app
+
+# Part of every digest; bump it when the drawing code changes so old files are not served
+RENDER_VERSION = 1
+
+CARD_SIZE = (1200, 630)  # what link previews crop to
+
+# Gradient stops per theme, from the theme stylesheets
+THEME_COLORS = {
+    'default': ('#FF006B', '#FF6B35'),
+    'bubblegum': ('#FF69B4', '#FF1493'),
+    'cyberpop': ('#FF00FF', '#00FFFF'),
+    'soft-girl': ('#FFB3BA', '#BAE1FF'),
+    'vaporwave': ('#B24BF3', '#FF71CE'),
+}
+
+class ImageRendererBusy(Exception):
+    """IMAGE_RENDER_MAX_PENDING renders were already waiting, or this one timed out."""
+
+def _font(path, size):
+    from PIL import ImageFont
+    if path:
+        return ImageFont.truetype(path, size)
+    return ImageFont.load_default(size=size)
+
+def _qr_image(url, size):
+    import qrcode
+    from PIL import Image
+    code = qrcode.QRCode(error_correction=qrcode.constants.ERROR_CORRECT_M, border=2)
+    code.add_data(url)
+    code.make(fit=True)
+    return code.make_image().get_image().convert('L').resize((size, size), Image.NEAREST)
+
+def _wrap(draw, text, font, width, max_lines):
+    lines, line = [], ''
+    for word in text.split():
+        candidate = f'{line} {word}'.strip()
+        if draw.textlength(candidate, font=font) <= width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = word
+        if len(lines) == max_lines:
+            break
+    if line and len(lines) < max_lines:
+        lines.append(line)
+    for i, line in enumerate(lines):
+        while draw.textlength(line, font=font) > width and len(line) > 1:
+            line = line[:-2] + '…'
+        lines[i] = line
+    return lines
+
+def render_card(spec):
+    """The 1200x630 link-preview card for a profile, as PNG bytes."""
+    from PIL import Image, ImageDraw
+    start, end = THEME_COLORS.get(spec['theme'], THEME_COLORS['default'])
+    width, height = CARD_SIZE
+    mask = Image.linear_gradient('L').rotate(90).resize(CARD_SIZE)
+    card = Image.composite(Image.new('RGB', CARD_SIZE, start), Image.new('RGB', CARD_SIZE, end), mask)
+    draw = ImageDraw.Draw(card)
+    draw.rounded_rectangle((40, 40, width - 40, height - 40), radius=40, fill='#000000')
+
+    title, body, cta, small = (_font(spec['font'], size) for size in (72, 34, 36, 28))
+    for line in _wrap(draw, '@' + spec['username'], title, 560, 1):
+        draw.text((100, 110), line, font=title, fill='#FFFFFF')
+    bio = spec['bio'] or 'Just living the vibe. Send me anonymous messages!'
+    for i, line in enumerate(_wrap(draw, bio, body, 560, 3)):
+        draw.text((100, 220 + i * 46), line, font=body, fill='#9CA3AF')
+    draw.text((100, height - 190), 'send me anonymous messages', font=cta, fill=start)
+    for line in _wrap(draw, spec['url'].split('://', 1)[-1], small, 560, 1):
+        draw.text((100, height - 130), line, font=small, fill='#FFFFFF')
+
+    qr_size = 340
+    left, top = width - 100 - qr_size, (height - qr_size) // 2
+    draw.rounded_rectangle((left - 20, top - 20, left + qr_size + 20, top + qr_size + 20), radius=24, fill='#FFFFFF')
+    card.paste(_qr_image(spec['url'], qr_size), (left, top))
+
+    out = io.BytesIO()
+    card.save(out, 'PNG')
+    return out.getvalue()
+
+def render_qr(spec):
+    """A square QR code of the profile URL, as PNG bytes."""
+    out = io.BytesIO()
+    _qr_image(spec['url'], spec['size']).save(out, 'PNG')
+    return out.getvalue()
+
+RENDERERS = {'card': render_card, 'qr': render_qr}
+
+def render(spec):
+    return RENDERERS[spec['kind']](spec)
+
+class ShareImages:
+    """Renders share images once per spec and serves them from a disk cache.
+
+    Renders run in IMAGE_RENDER_WORKERS processes (0 renders in the request
+    thread); at most IMAGE_RENDER_MAX_PENDING wait for them, beyond that a
+    request fails at once with ImageRendererBusy. A render that times out
+    keeps its slot until the pool is done with it. Requests for an image
+    that is already being rendered in this process wait for that render
+    instead of starting another. Cache hits only touch the file's mtime,
+    which is what eviction orders by.
+    """
+
+    def init_app(self, app):
+        app.extensions['share_images'] = {
+            'pool': None,
+            'pid': None,
+            'lock': threading.Lock(),
+            'slots': threading.BoundedSemaphore(max(1, app.config['IMAGE_RENDER_MAX_PENDING'])),
+            'rendering': {},  # digest -> Future, for renders in flight in this process
+            'size': None,  # bytes under IMAGE_CACHE_DIR, estimated since the last scan
+            'evicting': threading.Lock(),  # held by the one thread scanning the directory
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['share_images']
+
+    def digest(self, spec):
+        payload = json.dumps({'v': RENDER_VERSION, **spec}, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def path(self, digest):
+        return os.path.join(current_app.config['IMAGE_CACHE_DIR'], digest[:2], digest + '.png')
+
+    def open(self, spec, digest=None):
+        """A binary file object with the PNG for `spec`, rendered first if it is not cached."""
+        digest = digest or self.digest(spec)
+        path = self.path(digest)
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return io.BytesIO(self._render(spec, digest, path))
+        try:
+            os.utime(path)
+        except OSError:
+            pass  # evicted since it was opened; the open file is still whole
+        return f
+
+    def _render(self, spec, digest, path):
+        state = self._state
+        with state['lock']:
+            future = state['rendering'].get(digest)
+            owner = future is None
+            if owner:
+                future = state['rendering'][digest] = Future()
+        if not owner:
+            try:
+                return future.result(timeout=current_app.config['IMAGE_RENDER_TIMEOUT'])
+            except TimeoutError:
+                raise ImageRendererBusy() from None
+
+        try:
+            data = self._run(spec)
+            self._store(path, data)
+            future.set_result(data)
+            return data
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        finally:
+            with state['lock']:
+                state['rendering'].pop(digest, None)
+
+    def _run(self, spec):
+        config = current_app.config
+        if not config['IMAGE_RENDER_WORKERS']:
+            return render(spec)
+
+        state = self._state
+        if not state['slots'].acquire(blocking=False):
+            raise ImageRendererBusy()
+        try:
+            future = self._pool(state, config['IMAGE_RENDER_WORKERS']).submit(render, spec)
+        except BaseException:
+            state['slots'].release()
+            raise
+        # The slot is held until the pool is done with the render, not just until we stop waiting
+        future.add_done_callback(lambda _: state['slots'].release())
+        try:
+            return future.result(timeout=config['IMAGE_RENDER_TIMEOUT'])
+        except TimeoutError:
+            future.cancel()
+            raise ImageRendererBusy() from None
+
+    def _pool(self, state, workers):
+        # Pools do not survive a fork, so each gunicorn worker starts its own
+        if state['pid'] != os.getpid():
+            with state['lock']:
+                if state['pid'] != os.getpid():
+                    state['pool'] = ProcessPoolExecutor(max_workers=workers)
+                    state['pid'] = os.getpid()
+        return state['pool']
+
+    def _store(self, path, data):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Readers in other workers see the whole file or none of it
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        state = self._state
+        limit = current_app.config['IMAGE_CACHE_MAX_BYTES']
+        with state['lock']:
+            known = state['size'] is not None
+            if known:
+                state['size'] += len(data)
+                if state['size'] <= limit:
+                    return
+        # Walking the directory is slow, so it happens outside the lock, one thread at a time;
+        # the others carry on and leave it to that one
+        if not state['evicting'].acquire(blocking=False):
+            return
+        try:
+            size = None if known else self._scan_size()
+            if size is None or size > limit:
+                size = self.evict(int(limit * 0.9))
+            with state['lock']:
+                state['size'] = size
+        finally:
+            state['evicting'].release()
+
+    def _files(self):
+        root = current_app.config['IMAGE_CACHE_DIR']
+        for dirpath, _, filenames in os.walk(root):
+            for name in filenames:
+                if name.endswith('.png'):
+                    path = os.path.join(dirpath, name)
+                    try:
+                        yield path, os.stat(path)
+                    except FileNotFoundError:
+                        pass  # evicted by another worker
+
+    def _scan_size(self):
+        return sum(stat.st_size for _, stat in self._files())
+
+    def evict(self, target):
+        """Delete the least recently served images until at most `target` bytes remain; returns the bytes left.
+
+        Each worker keeps its own running estimate between scans, so the
+        directory can briefly exceed the limit by what the other workers
+        have written since.
+        """
+        files = sorted(self._files(), key=lambda item: item[1].st_mtime)
+        total = sum(stat.st_size for _, stat in files)
+        for path, stat in files:
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                continue
+            total -= stat.st_size
+        return total
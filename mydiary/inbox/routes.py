@@ -1,36 +1,77 @@
-from flask import render_template, request, flash, redirect, url_for, abort
+from flask import render_template, request, flash, redirect, url_for, abort, current_app, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from mydiary.extensions import db
+from mydiary.extensions import db, ingest, limiter, partials, jobs, dedupe, inbox_events
 from mydiary.inbox import bp
 from mydiary.models import User, Message
+from mydiary.replicas import read_only
+from mydiary.stats import get_stats
+from mydiary.moderation import mark_all_read, delete_messages, message_filters
 
 @bp.route('/send/<username>', methods=['POST'])
 def send_message(username):
+    # Checked before any ORM work so floods never reach the database
+    if not (limiter.hit(f'send:ip:{request.remote_addr}', *current_app.config['RATELIMIT_SEND_PER_IP'])
+            and limiter.hit(f'send:to:{username}', *current_app.config['RATELIMIT_SEND_PER_RECIPIENT'])):
+        return partials.render('alert', 'Slow down! Try again in a minute.'), 429
+
     user = User.query.filter_by(username=username).first_or_404()
     content = request.form.get('content')
     category = request.form.get('category', 'text')
     
     if not content:
-        return '<div class="bg-red-100 border border-red-400 text-red-700 px-4 py-3 rounded relative">Message cannot be empty!</div>'
+        return partials.render('alert', 'Message cannot be empty!')
 
-    # Rate limiting could go here (check IP)
-    
-    msg = Message(
+    # Repeats look sent to the sender, but are not stored again
+    duplicate, content_hash = dedupe.check(user.id, content)
+    if duplicate:
+        return partials.render('message_sent')
+
+    accepted = ingest.submit(
         recipient_id=user.id,
         content=content,
         category=category,
-        sender_ip=request.remote_addr
+        sender_ip=request.remote_addr,
+        content_hash=content_hash
     )
-    db.session.add(msg)
-    db.session.commit()
+    if not accepted:
+        return partials.render('alert', 'Too many messages right now, try again in a moment!'), 429
     
-    return f'''
-    <div class="bg-green-100 border border-green-400 text-green-700 px-4 py-3 rounded relative text-center">
-        <strong class="font-bold">Sent! 🚀</strong>
-        <span class="block sm:inline">Your anonymous message has been delivered.</span>
-        <button onclick="location.reload()" class="mt-2 bg-green-500 text-white font-bold py-1 px-3 rounded text-sm">Send Another</button>
-    </div>
-    '''
+    return partials.render('message_sent')
+
+@bp.route('/inbox/stream')
+@login_required
+def inbox_stream():
+    if not inbox_events.enabled:
+        abort(404)
+    # A reconnecting EventSource sends the id of the last message it received
+    after = request.headers.get('Last-Event-ID') or request.args.get('after') or 0
+    try:
+        after = int(after)
+    except ValueError:
+        abort(400)
+    events = inbox_events.stream(current_user.id, after)
+    if events is None:
+        return Response('Too many open streams', 503, {'Retry-After': '30'})
+    return Response(stream_with_context(events), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@bp.route('/inbox/unread-count')
+@login_required
+@read_only
+def unread_count():
+    # A primary-key lookup in user_stats; badges poll this, so unchanged counts get a 304
+    count = get_stats(current_user.id).unread_count
+    htmx = 'HX-Request' in request.headers
+    etag = f"unread-{'html' if htmx else 'json'}-{current_user.id}-{count}"
+    if request.if_none_match.contains(etag):
+        response = current_app.make_response(('', 304))
+    elif htmx:
+        response = current_app.make_response(partials.render('unread_badge', count))
+    else:
+        response = jsonify(unread=count)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @bp.route('/message/<int:message_id>/flag', methods=['POST'])
 @login_required
@@ -44,7 +85,7 @@ def flag_message(message_id):
     db.session.commit()
     
     status_text = '🚩 Flagged' if message.is_flagged else '✓ Unflagged'
-    return f'<div class="text-yellow-400 text-sm">{status_text}</div>'
+    return partials.render('status', status_text, 'warning')
 
 @bp.route('/message/<int:message_id>/read', methods=['POST'])
 @login_required
@@ -57,7 +98,7 @@ def mark_read(message_id):
     message.is_read = True
     db.session.commit()
     
-    return '', 200
+    return '', 200, {'HX-Trigger': 'inbox-changed'}
 
 @bp.route('/message/<int:message_id>', methods=['DELETE'])
 @login_required
@@ -70,4 +111,58 @@ def delete_message(message_id):
     db.session.delete(message)
     db.session.commit()
     
-    return '', 200
+    return '', 200, {'HX-Trigger': 'inbox-changed'}
+
+# Bulk moderation. Each runs as set-based statements scoped to the current
+# user in SQL, and reports how many rows it touched. With
+# INBOX_BULK_IN_BACKGROUND the rows past the per-request limit are left to a
+# background job, whose id is returned as `job`.
+
+def _bulk_limits():
+    return current_app.config['INBOX_BULK_BATCH_SIZE'], current_app.config['INBOX_BULK_MAX_ROWS']
+
+def _bulk_response(more, task, payload, **counts):
+    if more and current_app.config['INBOX_BULK_IN_BACKGROUND']:
+        return jsonify(more=False, job=jobs.enqueue(task, payload), **counts)
+    return jsonify(more=more, **counts)
+
+@bp.route('/messages/read-all', methods=['POST'])
+@login_required
+def bulk_mark_read():
+    updated, more = mark_all_read(current_user.id, *_bulk_limits())
+    return _bulk_response(more, 'mark-all-read', {'user_id': current_user.id}, updated=updated)
+
+@bp.route('/messages/delete', methods=['POST'])
+@login_required
+def bulk_delete_selected():
+    payload = request.get_json(silent=True)
+    if payload is not None and not isinstance(payload, dict):
+        return jsonify(error='Expected a JSON object with an ids list'), 400
+    ids = request.form.getlist('ids') or (payload or {}).get('ids', [])
+    if not isinstance(ids, list):
+        return jsonify(error='ids must be a list'), 400
+    try:
+        ids = [int(i) for i in ids]
+    except (TypeError, ValueError):
+        return jsonify(error='ids must be integers'), 400
+    batch_size, max_rows = _bulk_limits()
+    if len(ids) > max_rows:
+        return jsonify(error=f'At most {max_rows} ids per request'), 400
+    if not ids:
+        return jsonify(deleted=0, more=False)
+    deleted, more = delete_messages(current_user.id, [Message.id.in_(ids)], batch_size, max_rows)
+    return jsonify(deleted=deleted, more=more)
+
+@bp.route('/messages/delete-matching', methods=['POST'])
+@login_required
+def bulk_delete_matching():
+    try:
+        criteria = message_filters(request.values)
+    except ValueError as exc:
+        return jsonify(error=str(exc)), 400
+    if not criteria:
+        return jsonify(error='Give at least one of category, sender_ip, since, until, flagged'), 400
+    deleted, more = delete_messages(current_user.id, criteria, *_bulk_limits())
+    filters = {name: request.values[name] for name in ('category', 'sender_ip', 'since', 'until', 'flagged')
+               if name in request.values}
+    return _bulk_response(more, 'delete-matching', {'user_id': current_user.id, 'filters': filters}, deleted=deleted)
@@ -0,0 +1,268 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+class Spool:
+    """Append-only NDJSON segments on disk, safe to share between processes.
+
+    Each process appends to its own ``incoming-<pid>`` file. Rotating renames it
+    to ``ready-*``, and drainers claim ready files by renaming them to
+    ``claimed-*``; a rename only succeeds once, so no cross-process lock is needed.
+    Segment names end in the pid of the process that rotated them, or
+    ``<pid>-recovered`` for segments requeued from a process that went away.
+    """
+
+    def __init__(self, directory, fsync=False):
+        self.directory = directory
+        self.fsync = fsync
+        self._lock = threading.Lock()
+        self._rows = 0
+        self._opened_at = None
+        os.makedirs(directory, exist_ok=True)
+
+    @property
+    def incoming_path(self):
+        return os.path.join(self.directory, f'incoming-{os.getpid()}.ndjson')
+
+    def append(self, row):
+        line = json.dumps(row, separators=(',', ':')) + '\n'
+        with self._lock:
+            with open(self.incoming_path, 'a', encoding='utf-8') as f:
+                f.write(line)
+                if self.fsync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            self._rows += 1
+            if self._opened_at is None:
+                self._opened_at = time.monotonic()
+            return self._rows
+
+    def incoming_age(self):
+        with self._lock:
+            return 0 if self._opened_at is None else time.monotonic() - self._opened_at
+
+    def rotate(self):
+        with self._lock:
+            if not self._rows:
+                return
+            self._rename(self.incoming_path, 'ready')
+            self._rows = 0
+            self._opened_at = None
+
+    def recover(self, stale_after):
+        """Requeue segments left behind by processes that died mid-write or mid-drain."""
+        cutoff = time.time() - stale_after
+        for entry in os.scandir(self.directory):
+            if entry.name.startswith(('incoming-', 'claimed-')) and entry.path != self.incoming_path:
+                stat = self._stat(entry)
+                if stat is not None and stat.st_mtime < cutoff:
+                    self._rename(entry.path, 'ready', '-recovered')
+
+    def claim(self, pid=None):
+        """Claim ready segments, oldest first; only those rotated or recovered by `pid` if given."""
+        suffixes = (f'-{pid}.ndjson', f'-{pid}-recovered.ndjson') if pid is not None else '.ndjson'
+        for name in sorted(os.listdir(self.directory)):
+            if not name.startswith('ready-') or not name.endswith(suffixes):
+                continue
+            claimed = os.path.join(self.directory, 'claimed-' + name[len('ready-'):])
+            try:
+                os.replace(os.path.join(self.directory, name), claimed)
+            except FileNotFoundError:
+                continue  # another drainer got there first
+            yield claimed
+
+    def read(self, path):
+        with open(path, encoding='utf-8') as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def pending_bytes(self):
+        stats = (self._stat(e) for e in os.scandir(self.directory) if e.name.endswith('.ndjson'))
+        return sum(stat.st_size for stat in stats if stat is not None)
+
+    def discard(self, path):
+        os.remove(path)
+
+    def quarantine(self, path):
+        os.replace(path, path[:-len('.ndjson')] + '.failed')
+
+    def _stat(self, entry):
+        try:
+            return entry.stat()
+        except FileNotFoundError:
+            return None  # renamed or drained since the directory was listed
+
+    @staticmethod
+    def recovered(path):
+        return path.endswith('-recovered.ndjson')
+
+    def _rename(self, path, state, tag=''):
+        target = os.path.join(self.directory, f'{state}-{time.time_ns()}-{os.getpid()}{tag}.ndjson')
+        try:
+            os.replace(path, target)
+        except FileNotFoundError:
+            pass
+
+def write_messages(rows, batch_size):
+    """Insert message rows with one multi-row INSERT per batch, spam-scored first.
+
+    All the batches commit together, so a segment that fails part way can
+    be retried without writing its first batches twice.
+    """
+    from mydiary.extensions import db, spam, inbox_events
+    from mydiary.models import Message
+    from mydiary.stats import record_messages
+    from mydiary.leaderboard import record_messages as record_trending
+    scoring = current_app.config['SPAM_SCORING'] == 'ingest'
+    for start in range(0, len(rows), batch_size):
+        batch = [_message_values(row) for row in rows[start:start + batch_size]]
+        if scoring:
+            spam.score_batch(batch)
+        db.session.execute(db.insert(Message), batch)
+        record_messages(db.session.connection(), batch)
+        record_trending(db.session.connection(), batch)
+    db.session.commit()
+    inbox_events.notify()
+
+def _message_values(row):
+    values = dict(row)
+    values['created_at'] = datetime.fromisoformat(values['created_at'])
+    return values
+
+class SyncBackend:
+    """Write each message in its own transaction, inside the request."""
+
+    def __init__(self, app):
+        self.batch_size = app.config['INGEST_BATCH_SIZE']
+
+    def submit(self, row):
+        write_messages([row], self.batch_size)
+        return True
+
+    def drain(self):
+        return 0
+
+class SpoolBackend:
+    """Durable write-behind: requests append to the spool, a drainer batches the inserts.
+
+    With ``start_writer`` a daemon thread in this process drains the spool
+    (the ``thread`` mode); otherwise ``flask ingest-worker`` does it from a
+    separate process (the ``worker`` mode).
+    """
+
+    def __init__(self, app, start_writer):
+        self.app = app
+        self.spool = Spool(app.config['INGEST_SPOOL_DIR'], fsync=app.config['INGEST_FSYNC'])
+        self.batch_size = app.config['INGEST_BATCH_SIZE']
+        self.flush_interval = app.config['INGEST_FLUSH_INTERVAL']
+        self.queue_max = app.config['INGEST_QUEUE_MAX']
+        self.spool_max_bytes = app.config['INGEST_SPOOL_MAX_BYTES']
+        self.start_writer = start_writer
+        self._pending = 0
+        self._pending_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._writer = None
+
+    def submit(self, row):
+        if self.start_writer:
+            with self._pending_lock:
+                if self._pending >= self.queue_max:
+                    return False
+                self._pending += 1
+            self._ensure_writer()
+        elif self.spool.pending_bytes() >= self.spool_max_bytes:
+            return False
+
+        buffered = self.spool.append(row)
+        if buffered >= self.batch_size:
+            self._wakeup.set()
+        if not self.start_writer:
+            if buffered >= self.batch_size or self.spool.incoming_age() >= self.flush_interval:
+                self.spool.rotate()
+            elif buffered == 1:
+                # The worker only sees rotated segments; hand over a quiet one on time
+                timer = threading.Timer(self.flush_interval, self.spool.rotate)
+                timer.daemon = True
+                timer.start()
+        return True
+
+    def drain(self):
+        """Write every claimable segment to the database, returning the number of rows."""
+        self.spool.rotate()
+        self.spool.recover(stale_after=max(60, self.flush_interval * 10))
+        # In thread mode each process drains what it queued, so that its own count goes down;
+        # another process's segments only reach it once recovered
+        written = taken = 0
+        for path in self.spool.claim(os.getpid() if self.start_writer else None):
+            rows = self.spool.read(path)
+            if not self.spool.recovered(path):
+                taken += len(rows)
+            try:
+                write_messages(rows, self.batch_size)
+            except Exception:
+                from mydiary.extensions import db
+                db.session.rollback()
+                log.exception('Failed to ingest spool segment %s', path)
+                self.spool.quarantine(path)
+                continue
+            self.spool.discard(path)
+            written += len(rows)
+        if self.start_writer:
+            # Quarantined rows leave the queue too, or every failure would shrink INGEST_QUEUE_MAX
+            with self._pending_lock:
+                self._pending -= taken
+        return written
+
+    def _ensure_writer(self):
+        if self._writer is not None and self._writer.is_alive():
+            return
+        with self._pending_lock:
+            if self._writer is not None and self._writer.is_alive():
+                return
+            self._writer = threading.Thread(target=self._run, name='mydiary-ingest', daemon=True)
+            self._writer.start()
+            atexit.register(self._drain_in_context)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain_in_context()
+
+    def _drain_in_context(self):
+        with self.app.app_context():
+            try:
+                self.drain()
+            except Exception:
+                log.exception('Ingest writer failed')
+
+class MessageIngestor:
+    """Extension that routes accepted messages to the configured ingestion backend."""
+
+    def init_app(self, app):
+        mode = app.config['INGEST_MODE']
+        if mode == 'sync':
+            backend = SyncBackend(app)
+        elif mode in ('thread', 'worker'):
+            backend = SpoolBackend(app, start_writer=(mode == 'thread'))
+        else:
+            raise ValueError(f'Unknown INGEST_MODE {mode!r}')
+        app.extensions['ingest'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['ingest']
+
+    def submit(self, **row):
+        """Queue a message for writing. Returns False when the queue is full."""
+        row.setdefault('created_at', datetime.utcnow().isoformat())
+        return self.backend.submit(row)
+
+    def drain(self):
+        return self.backend.drain()
@@ -0,0 +1,274 @@
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from datetime import datetime, timedelta
+from flask import current_app
+
+log = logging.getLogger(__name__)
+
+class Task:
+    def __init__(self, name, func, retries, concurrency, timeout):
+        self.name = name
+        self.func = func
+        self.retries = retries
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+class Cron:
+    """A five-field cron expression: minute, hour, day of month, month, day of week.
+
+    Fields take ``*``, numbers, ``a-b`` ranges, ``*/n`` or ``a-b/n`` steps and
+    comma-separated lists of those. Day of week counts from 0 = Sunday.
+    """
+
+    RANGES = [(0, 59), (0, 23), (1, 31), (1, 12), (0, 7)]
+
+    def __init__(self, expression):
+        fields = expression.split()
+        if len(fields) != 5:
+            raise ValueError(f'Cron expression needs 5 fields: {expression!r}')
+        self.expression = expression
+        self.minute, self.hour, self.day, self.month, weekday = (
+            self._parse(field, low, high) for field, (low, high) in zip(fields, self.RANGES))
+        self.weekday = {n % 7 for n in weekday}  # 7 is Sunday too
+
+    @staticmethod
+    def _parse(field, low, high):
+        values = set()
+        for part in field.split(','):
+            span, _, step = part.partition('/')
+            if span == '*':
+                start, end = low, high
+            elif '-' in span:
+                start, end = (int(n) for n in span.split('-'))
+            else:
+                start = end = int(span)
+            if not low <= start <= end <= high:
+                raise ValueError(f'Cron field {field!r} is out of range')
+            values.update(range(start, end + 1, int(step or 1)))
+        return values
+
+    def matches(self, when):
+        return (when.minute in self.minute and when.hour in self.hour and when.day in self.day
+                and when.month in self.month and (when.weekday() + 1) % 7 in self.weekday)
+
+def _empty_stats():
+    return {'queued': 0, 'running': 0, 'done': 0, 'failed': 0,
+            'recent': 0, 'avg_ms': None, 'max_ms': None, 'lag': None}
+
+class JobQueue:
+    """Background jobs stored in the ``job`` table and run by `flask worker`.
+
+    Tasks register with ``@jobs.task()``; ``enqueue`` adds a row that any
+    worker process may claim. Failed jobs are retried with exponential
+    backoff, tasks can cap how many of them run at once across all workers,
+    and JOB_SCHEDULES enqueues tasks on cron expressions. A schedule slot is
+    enqueued once no matter how many workers are running.
+    """
+
+    def __init__(self):
+        self.tasks = {}
+
+    def init_app(self, app):
+        app.extensions['jobs'] = {
+            'schedules': [(Cron(expression), name) for name, expression in app.config['JOB_SCHEDULES'].items()],
+        }
+
+    def task(self, name=None, retries=3, concurrency=None, timeout=None):
+        """Register a function as a task. Its payload is passed as keyword arguments.
+
+        `retries` is how many times a failure is retried, `concurrency` caps
+        how many run at once, and `timeout` (seconds, default JOB_TIMEOUT)
+        is how long a job may run before its worker is assumed dead.
+        """
+        def register(func):
+            task_name = name or func.__name__.replace('_', '-')
+            self.tasks[task_name] = Task(task_name, func, retries, concurrency, timeout)
+            return func
+        return register
+
+    def enqueue(self, task, payload=None, delay=0, unique_key=None):
+        """Add a job and return its id, or None if `unique_key` was already queued."""
+        from sqlalchemy.exc import IntegrityError
+        from mydiary.extensions import db
+        from mydiary.models import Job
+        if task not in self.tasks:
+            raise KeyError(f'Unknown task {task!r}')
+        job = Job(task=task, payload=json.dumps(payload or {}), max_attempts=self.tasks[task].retries + 1,
+                  run_at=datetime.utcnow() + timedelta(seconds=delay), unique_key=unique_key)
+        db.session.add(job)
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return None
+        return job.id
+
+    def stats(self, window=timedelta(hours=1)):
+        """Per-task counts by status, recent durations and queue lag, for /admin/jobs."""
+        from mydiary.extensions import db
+        from mydiary.models import Job
+        now = datetime.utcnow()
+        tasks = {name: _empty_stats() for name in self.tasks}
+        for task, status, count in db.session.query(Job.task, Job.status, db.func.count()).group_by(Job.task, Job.status):
+            tasks.setdefault(task, _empty_stats())[status] = count
+        recent = (db.session.query(Job.task, db.func.count(), db.func.avg(Job.duration_ms), db.func.max(Job.duration_ms))
+                  .filter(Job.status == 'done', Job.finished_at >= now - window)
+                  .group_by(Job.task))
+        for task, count, avg_ms, max_ms in recent:
+            tasks[task].update(recent=count, avg_ms=avg_ms, max_ms=max_ms)
+        oldest = (db.session.query(Job.task, db.func.min(Job.run_at))
+                  .filter(Job.status == 'queued', Job.run_at <= now)
+                  .group_by(Job.task))
+        for task, run_at in oldest:
+            tasks[task]['lag'] = (now - run_at).total_seconds()
+        return tasks
+
+    # Worker side
+
+    def run_worker(self, threads=1, once=False):
+        """Run jobs from `threads` threads until SIGTERM/SIGINT, or until the queue is empty with `once`.
+
+        The calling thread enqueues scheduled tasks and requeues jobs whose
+        worker died.
+        """
+        app = current_app._get_current_object()
+        stop = threading.Event()
+        if not once and threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGTERM, signal.SIGINT):
+                signal.signal(signum, lambda *_: stop.set())
+        identity = f'{socket.gethostname()}:{os.getpid()}'
+        runners = [threading.Thread(target=self._run, args=(app, f'{identity}:{i}', stop, once),
+                                    name=f'mydiary-worker-{i}', daemon=True)
+                   for i in range(max(1, threads))]
+        self.recover()
+        if not once:
+            self.schedule(datetime.utcnow())
+        for runner in runners:
+            runner.start()
+        last_tick = datetime.utcnow()
+        while any(runner.is_alive() for runner in runners):
+            stop.wait(app.config['JOB_POLL_INTERVAL'])
+            if once or stop.is_set():
+                continue
+            now = datetime.utcnow()
+            self.recover()
+            # Catch up on every minute since the last tick, so a slow tick skips nothing
+            minute = last_tick.replace(second=0, microsecond=0) + timedelta(minutes=1)
+            while minute <= now:
+                self.schedule(minute)
+                minute += timedelta(minutes=1)
+            last_tick = now
+        for runner in runners:
+            runner.join()
+
+    def schedule(self, when):
+        """Enqueue the scheduled tasks due in the minute of `when`."""
+        when = when.replace(second=0, microsecond=0)
+        for cron, name in current_app.extensions['jobs']['schedules']:
+            if cron.matches(when):
+                self.enqueue(name, unique_key=f'{name}@{when.isoformat(timespec="minutes")}')
+
+    def recover(self):
+        """Retry (or fail) jobs that have been running longer than their task's timeout.
+
+        That is how a job whose worker was killed gets picked up again.
+        """
+        from mydiary.extensions import db
+        from mydiary.models import Job
+        now = datetime.utcnow()
+        default_timeout = current_app.config['JOB_TIMEOUT']
+        for job in Job.query.filter(Job.status == 'running').all():
+            task = self.tasks.get(job.task)
+            timeout = task.timeout if task and task.timeout else default_timeout
+            if job.started_at and job.started_at < now - timedelta(seconds=timeout):
+                log.warning('Job %s (%s) on %s timed out', job.id, job.task, job.locked_by)
+                self._finish_failed(job, f'Timed out on {job.locked_by}', now)
+        db.session.commit()
+
+    def claim(self, worker):
+        """Mark the next due job as running on `worker` and return it, or None if there is nothing to do."""
+        from mydiary.extensions import db
+        from mydiary.models import Job
+        jobs = Job.__table__
+        now = datetime.utcnow()
+        candidates = db.session.execute(
+            db.select(jobs.c.id, jobs.c.task)
+            .where(jobs.c.status == 'queued', jobs.c.run_at <= now)
+            .order_by(jobs.c.run_at, jobs.c.id)
+            .limit(20)
+        ).all()
+        for job_id, name in candidates:
+            task = self.tasks.get(name)
+            criteria = [jobs.c.id == job_id, jobs.c.status == 'queued']
+            if task is not None and task.concurrency:
+                # Checked in the same statement as the claim. SQLite runs one writer at
+                # a time, so that is enough there; on Postgres two statements can see
+                # the same snapshot, so claims of a task queue on a transaction-scoped
+                # advisory lock first and each count sees the claims committed before it.
+                if db.engine.dialect.name == 'postgresql':
+                    db.session.execute(db.text('SELECT pg_advisory_xact_lock(hashtext(:key))'),
+                                       {'key': f'mydiary-job:{name}'})
+                running = (db.select(db.func.count()).select_from(jobs)
+                           .where(jobs.c.task == name, jobs.c.status == 'running')
+                           .scalar_subquery())
+                criteria.append(running < task.concurrency)
+            result = db.session.execute(
+                jobs.update().where(*criteria)
+                .values(status='running', locked_by=worker, started_at=now, attempts=jobs.c.attempts + 1)
+            )
+            db.session.commit()
+            if result.rowcount == 1:
+                return db.session.get(Job, job_id)
+        return None
+
+    def run(self, job):
+        """Run a claimed job and record how it went."""
+        from mydiary.extensions import db
+        task = self.tasks.get(job.task)
+        started = time.perf_counter()
+        try:
+            if task is None:
+                raise KeyError(f'Unknown task {job.task!r}')
+            task.func(**json.loads(job.payload))
+        except Exception:
+            db.session.rollback()
+            log.exception('Job %s (%s) failed on attempt %s', job.id, job.task, job.attempts)
+            self._finish_failed(job, traceback.format_exc(), datetime.utcnow())
+        else:
+            job.status = 'done'
+            job.finished_at = datetime.utcnow()
+            job.last_error = None
+        job.duration_ms = int((time.perf_counter() - started) * 1000)
+        db.session.commit()
+
+    def _finish_failed(self, job, error, now):
+        job.last_error = error[-4000:]
+        if job.attempts < job.max_attempts:
+            config = current_app.config
+            delay = min(config['JOB_RETRY_BACKOFF'] * 2 ** (job.attempts - 1), config['JOB_RETRY_MAX_DELAY'])
+            job.status = 'queued'
+            job.run_at = now + timedelta(seconds=delay)
+        else:
+            job.status = 'failed'
+            job.finished_at = now
+
+    def _run(self, app, worker, stop, once):
+        while not stop.is_set():
+            with app.app_context():
+                try:
+                    job = self.claim(worker)
+                    if job is not None:
+                        self.run(job)
+                except Exception:
+                    log.exception('Worker %s failed', worker)
+                    job = None
+            if job is None:
+                if once:
+                    return
+                stop.wait(app.config['JOB_POLL_INTERVAL'])
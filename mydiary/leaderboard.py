@@ -0,0 +1,161 @@
+"""Trending users for /discover: messages received, decayed exponentially over time.
+
+A message received at `t` is worth exp(-(now - t) / period) on a board, so
+it counts fully at first and about a third as much one `period` later.
+Scores are stored multiplied by exp((now - epoch) / period), that is, as
+the sum of exp((t - epoch) / period) over the user's messages. Every score
+on a board carries the same factor, so the stored order is the current
+order: a new message only adds its own weight to one row (and flagging it
+takes that weight off again), and the top of a board is a range scan of
+ix_leaderboard_entry_board_score. The
+refresh-leaderboard job moves the epoch forward before the weights grow
+too large, and prunes entries that have decayed to nothing.
+"""
+import math
+from collections import defaultdict
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import event, inspect
+from sqlalchemy.dialects import postgresql, sqlite
+from mydiary.extensions import db
+from mydiary.models import User, Message, Leaderboard, LeaderboardEntry
+
+boards_table = Leaderboard.__table__
+entries_table = LeaderboardEntry.__table__
+
+def _weight(created_at, epoch, period):
+    return math.exp((created_at - epoch).total_seconds() / period)
+
+def _decay(epoch, period, now=None):
+    """What stored scores are multiplied by to get their value at `now`."""
+    return math.exp(-((now or datetime.utcnow()) - epoch).total_seconds() / period)
+
+def _add(connection, board, weights):
+    # One upsert per board, so concurrent first messages to a user cannot both insert
+    insert = (postgresql.insert if connection.dialect.name == 'postgresql' else sqlite.insert)(entries_table)
+    connection.execute(
+        insert.on_conflict_do_update(
+            index_elements=[entries_table.c.board, entries_table.c.user_id],
+            set_={'score': entries_table.c.score + insert.excluded.score},
+        ),
+        [{'board': board, 'user_id': user_id, 'score': weight} for user_id, weight in weights.items()],
+    )
+
+def _apply(connection, received, sign):
+    periods = current_app.config['LEADERBOARD_BOARDS']
+    for name, epoch in connection.execute(db.select(boards_table.c.name, boards_table.c.epoch)):
+        if name not in periods:
+            continue
+        weights = defaultdict(float)
+        for user_id, created_at in received:
+            weights[user_id] += sign * _weight(created_at, epoch, periods[name])
+        _add(connection, name, weights)
+
+def record_messages(connection, rows):
+    """Add newly written messages to every board, in the writing transaction.
+
+    Flagged messages do not count. Boards that do not exist yet are filled
+    in by the next refresh instead.
+    """
+    received = [(row['recipient_id'], row['created_at']) for row in rows if not row.get('is_flagged')]
+    if received:
+        _apply(connection, received, 1)
+
+def remove_messages(connection, rows):
+    """Take counted messages off every board again, in the transaction that flags them."""
+    received = [(row['recipient_id'], row['created_at']) for row in rows]
+    if received:
+        _apply(connection, received, -1)
+
+def top(board, limit):
+    """The `limit` highest-scoring users on `board` as (username, bio, score), best first.
+
+    Costs one primary-key lookup and `limit` index entries, however many
+    messages and users there are.
+    """
+    leaderboard = db.session.get(Leaderboard, board)
+    if leaderboard is None:
+        return []
+    decay = _decay(leaderboard.epoch, current_app.config['LEADERBOARD_BOARDS'][board])
+    rows = (db.session.query(User.username, User.bio, LeaderboardEntry.score)
+            .join(User, User.id == LeaderboardEntry.user_id)
+            .filter(LeaderboardEntry.board == board)
+            .order_by(LeaderboardEntry.score.desc())
+            .limit(limit))
+    return [(username, bio, score * decay) for username, bio, score in rows]
+
+def refresh():
+    """Maintenance for every configured board; returns {board: entries pruned}.
+
+    A board seen for the first time is built from the messages table. On
+    the others the epoch is moved up to now once it is
+    LEADERBOARD_REBASE_PERIODS periods old, and entries worth less than
+    LEADERBOARD_MIN_SCORE are deleted.
+    """
+    config = current_app.config
+    now = datetime.utcnow()
+    pruned = {}
+    for name, period in config['LEADERBOARD_BOARDS'].items():
+        leaderboard = db.session.get(Leaderboard, name)
+        if leaderboard is None:
+            rebuild(name)
+            pruned[name] = 0
+            continue
+        if (now - leaderboard.epoch).total_seconds() > period * config['LEADERBOARD_REBASE_PERIODS']:
+            _rebase(name, leaderboard.epoch, now, period)
+            leaderboard.epoch = now
+        # score * decay < minimum, as a range on the index
+        cutoff = config['LEADERBOARD_MIN_SCORE'] / _decay(leaderboard.epoch, period, now)
+        pruned[name] = db.session.execute(
+            entries_table.delete().where(entries_table.c.board == name, entries_table.c.score < cutoff)
+        ).rowcount
+        leaderboard.refreshed_at = now
+        db.session.commit()
+    return pruned
+
+def _rebase(name, old_epoch, new_epoch, period):
+    factor = math.exp(-(new_epoch - old_epoch).total_seconds() / period)
+    db.session.execute(
+        entries_table.update().where(entries_table.c.board == name).values(score=entries_table.c.score * factor)
+    )
+
+def rebuild(name):
+    """Recompute one board from the messages still worth more than LEADERBOARD_MIN_SCORE."""
+    config = current_app.config
+    period = config['LEADERBOARD_BOARDS'][name]
+    now = datetime.utcnow()
+    since = now - timedelta(seconds=period * math.log(1 / config['LEADERBOARD_MIN_SCORE']))
+    messages = Message.__table__.c
+    scores = defaultdict(float)
+    for user_id, created_at in db.session.execute(
+        db.select(messages.recipient_id, messages.created_at)
+        .where(messages.created_at >= since, messages.is_flagged.is_not(True))
+        .execution_options(yield_per=10000)
+    ):
+        scores[user_id] += _weight(created_at, now, period)
+
+    db.session.execute(entries_table.delete().where(entries_table.c.board == name))
+    db.session.execute(boards_table.delete().where(boards_table.c.name == name))
+    db.session.execute(boards_table.insert().values(name=name, epoch=now, refreshed_at=now))
+    if scores:
+        db.session.execute(entries_table.insert(), [
+            {'board': name, 'user_id': user_id, 'score': score} for user_id, score in scores.items()
+        ])
+    db.session.commit()
+    return len(scores)
+
+@event.listens_for(Message, 'after_insert')
+def _message_created(mapper, connection, target):
+    record_messages(connection, [{'recipient_id': target.recipient_id, 'created_at': target.created_at,
+                                  'is_flagged': target.is_flagged}])
+
+@event.listens_for(Message, 'after_update')
+def _message_updated(mapper, connection, target):
+    history = inspect(target).attrs['is_flagged'].history
+    if not history.has_changes() or not history.deleted or bool(history.added[0]) == bool(history.deleted[0]):
+        return
+    rows = [{'recipient_id': target.recipient_id, 'created_at': target.created_at}]
+    if target.is_flagged:
+        remove_messages(connection, rows)
+    else:
+        record_messages(connection, rows)
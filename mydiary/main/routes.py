@@ -1,18 +1,60 @@
-from flask import render_template
+from flask import render_template, request, jsonify, url_for, abort, current_app
 from mydiary.main import bp
+from mydiary.leaderboard import top
+from mydiary.search import search_users, search_entries
+from mydiary.replicas import read_only
 
 @bp.route('/')
+@read_only
 def index():
     return render_template('home.html')
 
 @bp.route('/about')
+@read_only
 def about():
     return render_template('about.html')
 
 @bp.route('/safety')
+@read_only
 def safety():
     return render_template('safety.html')
 
 @bp.route('/blog')
+@read_only
 def blog():
     return render_template('blog.html')
+
+@bp.route('/discover')
+@read_only
+def discover():
+    boards = current_app.config['LEADERBOARD_BOARDS']
+    board = request.args.get('board', next(iter(boards)))
+    if board not in boards:
+        abort(404)
+    trending = top(board, current_app.config['LEADERBOARD_SIZE'])
+    return render_template('discover.html', board=board, boards=boards, trending=trending)
+
+@bp.route('/search')
+@read_only
+def search():
+    query = request.args.get('q', '').strip()[:100]
+    if not query:
+        return jsonify({'users': [], 'entries': []})
+
+    users = search_users(query)
+    # Diary text is only worth searching once the user has typed a real word
+    entries = search_entries(query) if len(query) >= 3 else []
+
+    return jsonify({
+        'users': [{
+            'username': username,
+            'bio': bio,
+            'url': url_for('diary.public_profile', username=username)
+        } for username, bio in users],
+        'entries': [{
+            'id': entry_id,
+            'username': username,
+            'content': content,
+            'url': url_for('diary.public_profile', username=username)
+        } for entry_id, username, content in entries]
+    })
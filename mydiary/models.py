@@ -1,7 +1,6 @@
 from datetime import datetime
 from flask_login import UserMixin
-from werkzeug.security import generate_password_hash, check_password_hash
-from mydiary.extensions import db, login_manager
+from mydiary.extensions import db, login_manager, passwords
 
 @login_manager.user_loader
 def load_user(user_id):
@@ -14,22 +13,30 @@ class User(UserMixin, db.Model):
     password_hash = db.Column(db.String(256))
     bio = db.Column(db.String(140))
     theme_preference = db.Column(db.String(20), default='default')
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    message_retention_days = db.Column(db.Integer)  # NULL: RETENTION_MESSAGE_DAYS, 0: never archive
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
     
     # Relationships
     entries = db.relationship('DiaryEntry', backref='author', lazy='dynamic')
     messages_received = db.relationship('Message', backref='recipient', lazy='dynamic')
 
     def set_password(self, password):
-        self.password_hash = generate_password_hash(password)
+        self.password_hash = passwords.hash(password)
 
     def check_password(self, password):
-        return check_password_hash(self.password_hash, password)
+        return passwords.verify(self.password_hash, password)
+
+    def password_needs_rehash(self):
+        return passwords.needs_rehash(self.password_hash)
 
     def __repr__(self):
         return f'<User {self.username}>'
 
 class DiaryEntry(db.Model):
+    __table_args__ = (
+        db.Index('ix_diary_entry_user_created', 'user_id', 'created_at', 'id'),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     content = db.Column(db.Text, nullable=False)
@@ -40,6 +47,21 @@ class DiaryEntry(db.Model):
         return f'<DiaryEntry {self.id}>'
 
 class Message(db.Model):
+    __table_args__ = (
+        db.Index('ix_message_recipient_created', 'recipient_id', 'created_at', 'id'),
+        db.Index('ix_message_sender_ip_created', 'sender_ip', 'created_at'),
+        db.Index('ix_message_recipient_hash', 'recipient_id', 'content_hash', 'created_at'),
+        # The admin flagged queue, newest first
+        db.Index('ix_message_flagged_created', 'created_at', 'id',
+                 sqlite_where=db.text('is_flagged = 1'), postgresql_where=db.text('is_flagged = true')),
+        # Unread counts and mark-all-read touch only the unread rows
+        db.Index('ix_message_unread', 'recipient_id',
+                 sqlite_where=db.text('is_read = 0'), postgresql_where=db.text('is_read = false')),
+        # Only the rows the score-messages job still has to look at
+        db.Index('ix_message_unscored', 'id',
+                 sqlite_where=db.text('spam_score IS NULL'), postgresql_where=db.text('spam_score IS NULL')),
+    )
+
     id = db.Column(db.Integer, primary_key=True)
     recipient_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     sender_ip = db.Column(db.String(45))  # IPv6 support
@@ -47,7 +69,110 @@ class Message(db.Model):
     category = db.Column(db.String(50), default='text') # confession, roast, etc.
     is_read = db.Column(db.Boolean, default=False)
     is_flagged = db.Column(db.Boolean, default=False)
+    spam_score = db.Column(db.Float)  # 0-1 from mydiary.spam; NULL until scored
+    content_hash = db.Column(db.String(16))  # mydiary.dedupe.fingerprint of the content
+    duplicate_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')  # repeats collapsed into this row
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     def __repr__(self):
         return f'<Message {self.id}>'
+
+# Cold tier for mydiary.retention: rows keep their ids and columns, plus when
+# they were moved. Lives on the 'archive' bind (ARCHIVE_DATABASE_URL).
+
+class ArchivedMessage(db.Model):
+    __bind_key__ = 'archive'
+    __table_args__ = (
+        db.Index('ix_archived_message_recipient_created', 'recipient_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    recipient_id = db.Column(db.Integer, nullable=False)
+    sender_ip = db.Column(db.String(45))
+    content = db.Column(db.Text, nullable=False)
+    category = db.Column(db.String(50))
+    is_read = db.Column(db.Boolean)
+    is_flagged = db.Column(db.Boolean)
+    spam_score = db.Column(db.Float)
+    content_hash = db.Column(db.String(16))
+    duplicate_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedMessage {self.id}>'
+
+class ArchivedDiaryEntry(db.Model):
+    __bind_key__ = 'archive'
+    __table_args__ = (
+        db.Index('ix_archived_diary_entry_user_created', 'user_id', 'created_at', 'id'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    user_id = db.Column(db.Integer, nullable=False)
+    content = db.Column(db.Text, nullable=False)
+    is_public = db.Column(db.Boolean)
+    created_at = db.Column(db.DateTime)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<ArchivedDiaryEntry {self.id}>'
+
+class UserStats(db.Model):
+    """Denormalized per-user counters, kept current by the hooks in mydiary.stats."""
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    message_count = db.Column(db.Integer, nullable=False, default=0)
+    unread_count = db.Column(db.Integer, nullable=False, default=0)
+    flagged_count = db.Column(db.Integer, nullable=False, default=0)
+    entry_count = db.Column(db.Integer, nullable=False, default=0)
+    public_entry_count = db.Column(db.Integer, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<UserStats {self.user_id}>'
+
+class Leaderboard(db.Model):
+    """A trending board; its entries' scores are relative to `epoch` (see mydiary.leaderboard)."""
+    name = db.Column(db.String(16), primary_key=True)
+    epoch = db.Column(db.DateTime, nullable=False)
+    refreshed_at = db.Column(db.DateTime)
+
+    def __repr__(self):
+        return f'<Leaderboard {self.name}>'
+
+class LeaderboardEntry(db.Model):
+    """A user's decayed message count on one board, kept current by the hooks in mydiary.leaderboard."""
+    __table_args__ = (
+        db.Index('ix_leaderboard_entry_board_score', 'board', 'score'),
+    )
+
+    board = db.Column(db.String(16), db.ForeignKey('leaderboard.name'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    score = db.Column(db.Float, nullable=False, default=0)
+
+    def __repr__(self):
+        return f'<LeaderboardEntry {self.board} {self.user_id}>'
+
+class Job(db.Model):
+    """A unit of background work, claimed and run by `flask worker` (see mydiary.jobs)."""
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+        db.Index('ix_job_task_status', 'task', 'status'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    task = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.Text, nullable=False, default='{}')  # JSON keyword arguments
+    status = db.Column(db.String(16), nullable=False, default='queued')  # queued, running, done, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=1)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    unique_key = db.Column(db.String(128), unique=True)  # one row per scheduled run
+    locked_by = db.Column(db.String(128))
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    duration_ms = db.Column(db.Integer)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<Job {self.id} {self.task}>'
@@ -0,0 +1,120 @@
+from collections import Counter
+from datetime import datetime
+from mydiary.extensions import db
+from mydiary.models import Message
+from mydiary.stats import apply_deltas
+
+messages = Message.__table__
+
+BOOLEANS = {'true': True, '1': True, 'false': False, '0': False}
+
+def parse_bool(value):
+    """A true/false or 1/0 request arg as a bool; raises ValueError on anything else."""
+    try:
+        return BOOLEANS[value.lower()]
+    except (AttributeError, KeyError):
+        raise ValueError(f'Expected true/false or 1/0, got {value!r}') from None
+
+def mark_all_read(user_id, batch_size, max_rows):
+    """Mark a user's unread messages read, `batch_size` rows per transaction.
+
+    Returns (updated, more): `more` is True when `max_rows` was reached
+    before running out of unread messages.
+    """
+    updated = 0
+    while updated < max_rows:
+        limit = min(batch_size, max_rows - updated)
+        # `= false` rather than `IS false`, which SQLite will not match to ix_message_unread
+        ids = (db.select(messages.c.id)
+               .where(messages.c.recipient_id == user_id, messages.c.is_read == False)
+               .limit(limit)
+               .scalar_subquery())
+        result = db.session.execute(
+            messages.update()
+            .where(messages.c.id.in_(ids), messages.c.recipient_id == user_id)
+            .values(is_read=True)
+        )
+        apply_deltas(db.session.connection(), user_id, unread_count=-result.rowcount)
+        db.session.commit()
+        updated += result.rowcount
+        if result.rowcount < limit:
+            return updated, False
+    return updated, True
+
+def delete_messages(user_id, criteria, batch_size, max_rows):
+    """Delete a user's messages matching `criteria` (SQL expressions), in batches.
+
+    Ownership is part of every statement, so ids or filters that point at
+    someone else's messages simply match nothing. Returns (deleted, more).
+    """
+    deleted = 0
+    while deleted < max_rows:
+        limit = min(batch_size, max_rows - deleted)
+        ids = (db.select(messages.c.id)
+               .where(messages.c.recipient_id == user_id, *criteria)
+               .limit(limit)
+               .scalar_subquery())
+        rows = db.session.execute(
+            messages.delete()
+            .where(messages.c.id.in_(ids), messages.c.recipient_id == user_id)
+            .returning(messages.c.is_read, messages.c.is_flagged)
+        ).all()
+        apply_deltas(db.session.connection(), user_id,
+                     message_count=-len(rows),
+                     unread_count=-sum(1 for row in rows if not row.is_read),
+                     flagged_count=-sum(1 for row in rows if row.is_flagged))
+        db.session.commit()
+        deleted += len(rows)
+        if len(rows) < limit:
+            return deleted, False
+    return deleted, True
+
+def purge_read_messages(before, batch_size):
+    """Delete every user's read messages created before `before`, in batches.
+
+    Flagged messages are kept for moderation, as retention keeps them.
+    Walks the table in id order, so each batch starts where the last one
+    stopped. Returns the number of messages deleted.
+    """
+    deleted = last_id = 0
+    while True:
+        ids = (db.select(messages.c.id)
+               .where(messages.c.id > last_id, messages.c.is_read.is_(True), messages.c.is_flagged.is_not(True),
+                      messages.c.created_at < before)
+               .order_by(messages.c.id)
+               .limit(batch_size)
+               .scalar_subquery())
+        rows = db.session.execute(
+            messages.delete()
+            .where(messages.c.id.in_(ids))
+            .returning(messages.c.id, messages.c.recipient_id)
+        ).all()
+        for user_id, count in Counter(row.recipient_id for row in rows).items():
+            apply_deltas(db.session.connection(), user_id, message_count=-count)
+        db.session.commit()
+        deleted += len(rows)
+        if len(rows) < batch_size:
+            return deleted
+        last_id = max(row.id for row in rows)
+
+def message_filters(args):
+    """SQL criteria for delete-by-filter from request args; raises ValueError on bad input."""
+    criteria = []
+    if args.get('category'):
+        criteria.append(messages.c.category == args['category'])
+    if args.get('sender_ip'):
+        criteria.append(messages.c.sender_ip == args['sender_ip'])
+    try:
+        if args.get('since'):
+            criteria.append(messages.c.created_at >= datetime.fromisoformat(args['since']))
+        if args.get('until'):
+            criteria.append(messages.c.created_at < datetime.fromisoformat(args['until']))
+    except ValueError:
+        raise ValueError('since/until must be ISO dates') from None
+    if args.get('flagged') is not None:
+        try:
+            flagged = parse_bool(args['flagged'])
+        except ValueError:
+            raise ValueError('flagged must be true/false or 1/0') from None
+        criteria.append(messages.c.is_flagged.is_(flagged))
+    return criteria
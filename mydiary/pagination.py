@@ -0,0 +1,28 @@
+from datetime import datetime
+from mydiary.extensions import db
+
+def encode_cursor(item):
+    return f'{item.created_at.isoformat()}_{item.id}'
+
+def decode_cursor(cursor):
+    """Turn a cursor string back into a (created_at, id) tuple, or None if invalid."""
+    try:
+        created_at, item_id = cursor.rsplit('_', 1)
+        return datetime.fromisoformat(created_at), int(item_id)
+    except (AttributeError, ValueError):
+        return None
+
+def keyset_page(query, model, cursor=None, per_page=20):
+    """Return (items, next_cursor) for a newest-first page of `query`.
+
+    Rows are ordered by (created_at, id) descending so the composite indexes on
+    the model can serve every page with a range scan, however deep the cursor.
+    """
+    if cursor:
+        query = query.filter(
+            db.tuple_(model.created_at, model.id) < db.tuple_(*cursor)
+        )
+
+    items = query.order_by(model.created_at.desc(), model.id.desc()).limit(per_page + 1).all()
+    next_cursor = encode_cursor(items[per_page - 1]) if len(items) > per_page else None
+    return items[:per_page], next_cursor
@@ -0,0 +1,34 @@
+import os
+from flask import current_app
+from jinja2 import FileSystemBytecodeCache
+
+class Partials:
+    """Renders HTMX fragments by calling macros from ``macros/cards.html`` directly.
+
+    The macro module is built once per template version and reused, so a
+    fragment costs one macro call instead of a template lookup and a fresh
+    render context. Compiled templates are also kept in a bytecode cache on
+    disk, which spares every new worker the parse and compile step.
+    """
+
+    template_name = 'macros/cards.html'
+
+    def init_app(self, app):
+        cache_dir = app.config['TEMPLATE_BYTECODE_CACHE_DIR']
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+            app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+        app.extensions['partials'] = {}
+
+    def macros(self):
+        # get_template is a cache hit unless the file changed (with auto-reload on)
+        template = current_app.jinja_env.get_template(self.template_name)
+        modules = current_app.extensions['partials']
+        module = modules.get(template)
+        if module is None:
+            modules.clear()
+            module = modules[template] = template.module
+        return module
+
+    def render(self, macro, *args, **kwargs):
+        return str(getattr(self.macros(), macro)(*args, **kwargs))
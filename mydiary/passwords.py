@@ -0,0 +1,83 @@
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from flask import current_app
+from werkzeug.security import DEFAULT_PBKDF2_ITERATIONS, generate_password_hash, check_password_hash
+
+class PasswordHasherBusy(Exception):
+    """PASSWORD_HASH_MAX_PENDING verifications were already waiting, or this one timed out."""
+
+def _full_method(method):
+    """`method` with werkzeug's defaults filled in, as it appears at the start of a hash."""
+    name, *args = method.split(':')
+    if name == 'scrypt':
+        defaults = ['32768', '8', '1']
+    elif name == 'pbkdf2':
+        defaults = ['sha256', str(DEFAULT_PBKDF2_ITERATIONS)]
+    else:
+        return method
+    return ':'.join([name, *args, *defaults[len(args):]])
+
+class PasswordHasher:
+    """Hashes with the configured PASSWORD_HASH_METHOD and verifies in a process pool.
+
+    Verification is deliberately slow, so it runs in PASSWORD_HASH_WORKERS
+    processes instead of the request thread; at most PASSWORD_HASH_MAX_PENDING
+    checks are queued or running there, and beyond that a login fails at
+    once with PasswordHasherBusy instead of piling up. A check that times
+    out keeps its slot until the pool is done with it.
+    PASSWORD_HASH_WORKERS = 0 verifies inline. Hashes made with other
+    parameters still verify, and ``needs_rehash`` tells the caller to
+    upgrade them.
+    """
+
+    def init_app(self, app):
+        app.extensions['passwords'] = {
+            'pool': None,
+            'pid': None,
+            'lock': threading.Lock(),
+            'slots': threading.BoundedSemaphore(max(1, app.config['PASSWORD_HASH_MAX_PENDING'])),
+            'method': _full_method(app.config['PASSWORD_HASH_METHOD']),
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['passwords']
+
+    def hash(self, password):
+        return generate_password_hash(password, method=current_app.config['PASSWORD_HASH_METHOD'])
+
+    def needs_rehash(self, pwhash):
+        return pwhash.split('$', 1)[0] != self._state['method']
+
+    def verify(self, pwhash, password):
+        if not pwhash:
+            return False
+        config = current_app.config
+        if not config['PASSWORD_HASH_WORKERS']:
+            return check_password_hash(pwhash, password)
+
+        state = self._state
+        if not state['slots'].acquire(blocking=False):
+            raise PasswordHasherBusy()
+        try:
+            future = self._pool(state, config['PASSWORD_HASH_WORKERS']).submit(check_password_hash, pwhash, password)
+        except BaseException:
+            state['slots'].release()
+            raise
+        # The slot is held until the pool is done with the check, not just until we stop waiting
+        future.add_done_callback(lambda _: state['slots'].release())
+        try:
+            return future.result(timeout=config['PASSWORD_HASH_TIMEOUT'])
+        except TimeoutError:
+            future.cancel()
+            raise PasswordHasherBusy() from None
+
+    def _pool(self, state, workers):
+        # Pools do not survive a fork, so each gunicorn worker starts its own
+        if state['pid'] != os.getpid():
+            with state['lock']:
+                if state['pid'] != os.getpid():
+                    state['pool'] = ProcessPoolExecutor(max_workers=workers)
+                    state['pid'] = os.getpid()
+        return state['pool']
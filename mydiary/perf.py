@@ -0,0 +1,204 @@
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from flask import current_app, g, has_request_context, request, before_render_template, template_rendered
+from sqlalchemy import event
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency histogram buckets, in milliseconds
+BUCKETS_MS = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, float('inf')]
+
+class EndpointStats:
+    __slots__ = ('count', 'buckets', 'queries', 'max_queries', 'db_ms', 'render_ms', 'total_ms')
+
+    def __init__(self):
+        self.count = 0
+        self.buckets = [0] * len(BUCKETS_MS)
+        self.queries = 0
+        self.max_queries = 0
+        self.db_ms = 0.0
+        self.render_ms = 0.0
+        self.total_ms = 0.0
+
+    def add(self, total_ms, queries, db_ms, render_ms):
+        self.count += 1
+        self.buckets[bisect.bisect_left(BUCKETS_MS, total_ms)] += 1
+        self.queries += queries
+        self.max_queries = max(self.max_queries, queries)
+        self.db_ms += db_ms
+        self.render_ms += render_ms
+        self.total_ms += total_ms
+
+    def merge(self, other):
+        self.count += other.count
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.queries += other.queries
+        self.max_queries = max(self.max_queries, other.max_queries)
+        self.db_ms += other.db_ms
+        self.render_ms += other.render_ms
+        self.total_ms += other.total_ms
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the `pct`th percentile request."""
+        target = self.count * pct / 100
+        seen = 0
+        for bound, n in zip(BUCKETS_MS, self.buckets):
+            seen += n
+            if n and seen >= target:
+                return bound
+        return 0
+
+class PerfStats:
+    """Rolling per-endpoint histograms: one slot per `slot_seconds`, the last `slots` kept."""
+
+    def __init__(self, slot_seconds, slots, slow_queries):
+        self.slot_seconds = slot_seconds
+        self.slots = deque(maxlen=slots)  # (slot number, {endpoint: EndpointStats})
+        self.slow_queries = deque(maxlen=slow_queries)
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, total_ms, queries, db_ms, render_ms):
+        slot = int(time.time() // self.slot_seconds)
+        with self._lock:
+            if not self.slots or self.slots[-1][0] != slot:
+                self.slots.append((slot, {}))
+            endpoints = self.slots[-1][1]
+            stats = endpoints.get(endpoint)
+            if stats is None:
+                stats = endpoints[endpoint] = EndpointStats()
+            stats.add(total_ms, queries, db_ms, render_ms)
+
+    def record_slow_query(self, endpoint, statement, duration_ms):
+        with self._lock:
+            self.slow_queries.append((time.time(), endpoint, duration_ms, statement))
+
+    def snapshot(self):
+        """Merged stats for the whole window, busiest endpoint first."""
+        oldest = int(time.time() // self.slot_seconds) - self.slots.maxlen + 1
+        merged = {}
+        with self._lock:
+            for slot, endpoints in self.slots:
+                if slot < oldest:
+                    continue
+                for endpoint, stats in endpoints.items():
+                    merged.setdefault(endpoint, EndpointStats()).merge(stats)
+            slow = sorted(self.slow_queries, key=lambda q: q[2], reverse=True)
+        return sorted(merged.items(), key=lambda item: item[1].count, reverse=True), slow
+
+class PerfMonitor:
+    """Opt-in request instrumentation (PERF_INSTRUMENTATION).
+
+    Counts queries and database time per request from the cursor events,
+    times template rendering from Flask's render signals, and reports both in
+    a ``Server-Timing`` header and the rolling histograms behind /admin/perf.
+    When disabled nothing is registered, so there is no per-request cost.
+    Figures are per process.
+    """
+
+    def init_app(self, app):
+        if not app.config['PERF_INSTRUMENTATION']:
+            return
+        app.extensions['perf'] = PerfStats(
+            app.config['PERF_SLOT_SECONDS'], app.config['PERF_SLOTS'], app.config['PERF_SLOW_QUERY_LOG']
+        )
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        before_render_template.connect(self._render_started, app)
+        template_rendered.connect(self._render_finished, app)
+        with app.app_context():
+            from mydiary.extensions import db
+            for engine in db.engines.values():
+                event.listen(engine, 'before_cursor_execute', self._query_started)
+                event.listen(engine, 'after_cursor_execute', self._query_finished)
+
+    @property
+    def enabled(self):
+        return 'perf' in current_app.extensions
+
+    @property
+    def stats(self):
+        return current_app.extensions['perf']
+
+    def _start(self):
+        g.perf = {'start': time.perf_counter(), 'queries': 0, 'db': 0.0, 'render': 0.0, 'render_start': []}
+
+    def _finish(self, response):
+        perf = g.pop('perf', None)
+        if perf is None:
+            return response
+        total_ms = (time.perf_counter() - perf['start']) * 1000
+        db_ms, render_ms = perf['db'] * 1000, perf['render'] * 1000
+        endpoint = request.endpoint or '<unmatched>'
+        self.stats.record(endpoint, total_ms, perf['queries'], db_ms, render_ms)
+        if perf['queries'] > current_app.config['PERF_QUERY_WARN']:
+            log.warning('%s issued %d queries', endpoint, perf['queries'])
+        response.headers.add(
+            'Server-Timing',
+            f'db;dur={db_ms:.1f};desc="{perf["queries"]} queries", render;dur={render_ms:.1f}, app;dur={total_ms:.1f}'
+        )
+        return response
+
+    def _render_started(self, sender, **extra):
+        perf = g.get('perf')
+        if perf is not None:
+            perf['render_start'].append(time.perf_counter())
+
+    def _render_finished(self, sender, **extra):
+        perf = g.get('perf')
+        if perf is not None and perf['render_start']:
+            elapsed = time.perf_counter() - perf['render_start'].pop()
+            if not perf['render_start']:  # only the outermost render counts
+                perf['render'] += elapsed
+
+    # The start time rides on the execution context, so a statement that raises
+    # (and never reaches after_cursor_execute) leaves nothing behind
+    def _query_started(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._perf_start = time.perf_counter()
+
+    def _query_finished(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, '_perf_start', None)
+        if start is None:
+            return
+        elapsed = time.perf_counter() - start
+        if not has_request_context():
+            return
+        perf = g.get('perf')
+        if perf is None:
+            return
+        perf['queries'] += 1
+        perf['db'] += elapsed
+        if elapsed * 1000 >= current_app.config['PERF_SLOW_QUERY_MS']:
+            self.stats.record_slow_query(request.endpoint, statement, elapsed * 1000)
+
+class QueryCount:
+    def __init__(self):
+        self.count = 0
+        self.statements = []
+
+@contextmanager
+def count_queries(engine=None):
+    """Count the statements executed on `engine` (default: the app's engine) inside the block.
+
+        with count_queries() as queries:
+            client.get('/dashboard')
+        assert queries.count <= 5, queries.statements
+    """
+    if engine is None:
+        from mydiary.extensions import db
+        engine = db.engine
+    counter = QueryCount()
+
+    def on_execute(conn, cursor, statement, parameters, context, executemany):
+        counter.count += 1
+        counter.statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', on_execute)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', on_execute)
@@ -0,0 +1,117 @@
+import os
+import sqlite3
+import threading
+import time
+from flask import current_app
+
+class MemoryBackend:
+    """Per-process counters held in a dict, with expired windows swept out periodically."""
+
+    def __init__(self, sweep_every=1000):
+        self._counters = {}
+        self._lock = threading.Lock()
+        self._sweep_every = sweep_every
+        self._hits = 0
+
+    def incr(self, key, window, expires_at):
+        with self._lock:
+            self._hits += 1
+            if self._hits % self._sweep_every == 0:
+                self._sweep(time.time())
+            entry = self._counters.get((key, window))
+            count = entry[0] + 1 if entry else 1
+            self._counters[(key, window)] = (count, expires_at)
+            return count
+
+    def get(self, key, window):
+        entry = self._counters.get((key, window))
+        return entry[0] if entry else 0
+
+    def _sweep(self, now):
+        expired = [k for k, (_, expires_at) in self._counters.items() if expires_at < now]
+        for k in expired:
+            del self._counters[k]
+
+class SQLiteBackend:
+    """Counters in a small SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path, sweep_every=1000):
+        self.path = path
+        self._local = threading.local()
+        self._sweep_every = sweep_every
+        self._hits = 0
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._connect().execute('''CREATE TABLE IF NOT EXISTS rate_limit (
+            key TEXT NOT NULL,
+            window INTEGER NOT NULL,
+            count INTEGER NOT NULL,
+            expires_at REAL NOT NULL,
+            PRIMARY KEY (key, window)
+        ) WITHOUT ROWID''')
+
+    def _connect(self):
+        # Connections must not cross a fork, so they are keyed by pid as well as thread.
+        if getattr(self._local, 'pid', None) != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')  # counters are disposable
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return self._local.conn
+
+    def incr(self, key, window, expires_at):
+        conn = self._connect()
+        self._hits += 1
+        if self._hits % self._sweep_every == 0:
+            conn.execute('DELETE FROM rate_limit WHERE expires_at < ?', (time.time(),))
+        return conn.execute(
+            '''INSERT INTO rate_limit (key, window, count, expires_at) VALUES (?, ?, 1, ?)
+               ON CONFLICT (key, window) DO UPDATE SET count = count + 1
+               RETURNING count''',
+            (key, window, expires_at),
+        ).fetchone()[0]
+
+    def get(self, key, window):
+        row = self._connect().execute(
+            'SELECT count FROM rate_limit WHERE key = ? AND window = ?', (key, window)
+        ).fetchone()
+        return row[0] if row else 0
+
+class RateLimiter:
+    """Sliding-window rate limiter.
+
+    Approximates a true sliding window from two fixed windows: the previous
+    window's count is weighted by how much of it still overlaps the last
+    `period` seconds. That keeps storage at two counters per key.
+    """
+
+    def init_app(self, app):
+        if app.config['RATELIMIT_BACKEND'] == 'sqlite':
+            backend = SQLiteBackend(app.config['RATELIMIT_STORAGE_PATH'])
+        else:
+            backend = MemoryBackend()
+        app.extensions['ratelimit'] = backend
+
+    @property
+    def backend(self):
+        return current_app.extensions['ratelimit']
+
+    def hit(self, key, limit, period):
+        """Record one hit for `key`. Returns False once it is over `limit` per `period` seconds."""
+        if not current_app.config['RATELIMIT_ENABLED']:
+            return True
+        now = time.time()
+        window = int(now // period)
+        current = self.backend.incr(key, window, expires_at=(window + 2) * period)
+        return self._weighted(key, window, current, now, period) <= limit
+
+    def count(self, key, period):
+        """Current weighted hit count for `key`, without recording a hit."""
+        now = time.time()
+        window = int(now // period)
+        return self._weighted(key, window, self.backend.get(key, window), now, period)
+
+    def _weighted(self, key, window, current, now, period):
+        previous = self.backend.get(key, window - 1)
+        overlap = 1 - (now % period) / period
+        return current + previous * overlap
@@ -0,0 +1,106 @@
+import functools
+import itertools
+import logging
+import threading
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import text
+from sqlalchemy.sql import Executable
+
+log = logging.getLogger(__name__)
+
+def replica_keys(config):
+    return [f'replica_{i}' for i in range(len(config.get('SQLALCHEMY_REPLICAS') or []))]
+
+class RoutingSession(Session):
+    """Session that sends reads in ``@read_only`` views to the replica picked for the request.
+
+    Flushes, INSERT/UPDATE/DELETE statements and ``session.connection()``
+    without a statement (callers take one to run DML on) always go to the
+    primary, and once a request has done either, the rest of it reads from
+    the primary too.
+    """
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is not None or not has_request_context():
+            return engine
+        replica = g.get('_db_replica')
+        if replica is None or engine is not self._db.engines[None]:
+            return engine
+        if self._flushing or clause is None or _is_write(clause):
+            g._db_replica = None
+            return engine
+        return self._db.engines[replica]
+
+def _is_write(clause):
+    return isinstance(clause, Executable) and getattr(clause, 'is_dml', False)
+
+class ReplicaRouter:
+    """Round-robin over the healthy replicas in SQLALCHEMY_REPLICAS.
+
+    Each replica is pinged with ``SELECT 1`` at most once per
+    REPLICA_HEALTH_INTERVAL; one that fails is skipped until a later ping
+    succeeds. After a successful POST/PUT/DELETE the visitor reads from the
+    primary for REPLICA_STICKY_SECONDS so they see their own writes.
+    """
+
+    def init_app(self, app):
+        keys = replica_keys(app.config)
+        app.extensions['replicas'] = {
+            'keys': keys,
+            'cycle': itertools.cycle(keys),
+            'health': {},
+            'lock': threading.Lock(),
+        }
+        if keys:
+            app.after_request(self._mark_sticky)
+
+    @property
+    def _state(self):
+        return current_app.extensions['replicas']
+
+    def pick(self):
+        """Bind key of the replica to read from, or None for the primary."""
+        state = self._state
+        if not state['keys'] or session.get('_db_primary_until', 0) > time.time():
+            return None
+        for _ in range(len(state['keys'])):
+            with state['lock']:
+                key = next(state['cycle'])
+            if self.healthy(key):
+                return key
+        return None
+
+    def healthy(self, key):
+        state = self._state
+        healthy, checked_at = state['health'].get(key, (True, 0))
+        now = time.monotonic()
+        if now - checked_at < current_app.config['REPLICA_HEALTH_INTERVAL']:
+            return healthy
+        from mydiary.extensions import db
+        try:
+            with db.engines[key].connect() as connection:
+                connection.execute(text('SELECT 1'))
+            healthy = True
+        except Exception:
+            if healthy:
+                log.warning('Read replica %s is unreachable; reading from the primary', key)
+            healthy = False
+        state['health'][key] = (healthy, now)
+        return healthy
+
+    def _mark_sticky(self, response):
+        if request.method not in ('GET', 'HEAD', 'OPTIONS') and response.status_code < 400:
+            session['_db_primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+        return response
+
+def read_only(view):
+    """Route the view's reads to a replica when one is configured and healthy."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        from mydiary.extensions import replicas
+        g._db_replica = replicas.pick()
+        return view(*args, **kwargs)
+    return wrapper
@@ -0,0 +1,141 @@
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from flask import current_app
+from mydiary.extensions import db
+from mydiary.models import User, Message, DiaryEntry, ArchivedMessage, ArchivedDiaryEntry
+from mydiary.pagination import keyset_page
+from mydiary.stats import apply_deltas
+
+messages = Message.__table__
+entries = DiaryEntry.__table__
+users = User.__table__
+
+def archive_old_data(vacuum=False):
+    """Move every row past its retention period to the archive database.
+
+    Returns a report: rows moved per tier, bytes of text moved, and the
+    size of the main database before and after (see ``storage``).
+    """
+    config = current_app.config
+    batch_size, pause = config['RETENTION_BATCH_SIZE'], config['RETENTION_PAUSE']
+    report = {'messages': 0, 'entries': 0, 'content_bytes': 0, 'before': storage()}
+
+    for cutoff, owners in message_policies():
+        moved, content_bytes = _move(
+            messages, ArchivedMessage.__table__, messages.c.recipient_id,
+            [owners, messages.c.is_read.is_(True), messages.c.is_flagged.is_(False), messages.c.created_at < cutoff],
+            'message_count',
+            batch_size, pause,
+        )
+        report['messages'] += moved
+        report['content_bytes'] += content_bytes
+
+    if config['RETENTION_ENTRY_DAYS']:
+        # Public entries stay: they are on the owner's profile and in search
+        cutoff = datetime.utcnow() - timedelta(days=config['RETENTION_ENTRY_DAYS'])
+        moved, content_bytes = _move(
+            entries, ArchivedDiaryEntry.__table__, entries.c.user_id,
+            [entries.c.is_public.is_not(True), entries.c.created_at < cutoff],
+            'entry_count',
+            batch_size, pause,
+        )
+        report['entries'] += moved
+        report['content_bytes'] += content_bytes
+
+    if vacuum:
+        vacuum_main()
+    report['after'] = storage()
+    return report
+
+def message_policies():
+    """(cutoff, owner criterion) pairs: the global policy for users without their own, then one per custom period."""
+    now = datetime.utcnow()
+    policies = []
+    default_days = current_app.config['RETENTION_MESSAGE_DAYS']
+    if default_days:
+        policies.append((now - timedelta(days=default_days), messages.c.recipient_id.in_(
+            db.select(users.c.id).where(users.c.message_retention_days.is_(None)))))
+    custom = db.session.execute(
+        db.select(users.c.message_retention_days).where(users.c.message_retention_days > 0).distinct()
+    ).scalars().all()
+    for days in custom:
+        policies.append((now - timedelta(days=days), messages.c.recipient_id.in_(
+            db.select(users.c.id).where(users.c.message_retention_days == days))))
+    return policies
+
+def _move(hot, cold, owner, criteria, counter, batch_size, pause):
+    """Copy rows matching `criteria` into `cold` and delete them from `hot`, `batch_size` at a time.
+
+    Each batch is a short archive transaction followed by a short delete, so
+    neither database is locked for long, and the owners' `counter` in
+    UserStats goes down by what was moved. A row that stopped matching in
+    between (say, it was flagged) is taken back out of the archive. Returns
+    (rows moved, bytes of content moved).
+    """
+    columns = [column for column in hot.c if column.name in cold.c]
+    moved = content_bytes = last_id = 0
+    while True:
+        rows = db.session.execute(
+            db.select(*columns).where(hot.c.id > last_id, *criteria).order_by(hot.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            return moved, content_bytes
+        ids = [row.id for row in rows]
+        last_id = ids[-1]
+
+        # Deleting first makes a rerun after a crash between the two steps harmless
+        db.session.execute(cold.delete().where(cold.c.id.in_(ids)))
+        db.session.execute(cold.insert(), [row._asdict() for row in rows])
+        db.session.commit()
+
+        deleted = db.session.execute(
+            hot.delete().where(hot.c.id.in_(ids), *criteria).returning(hot.c.id, owner)
+        ).all()
+        for user_id, owned in Counter(row[1] for row in deleted).items():
+            apply_deltas(db.session.connection(), user_id, **{counter: -owned})
+        db.session.commit()
+
+        kept = set(ids) - {row.id for row in deleted}
+        if kept:
+            db.session.execute(cold.delete().where(cold.c.id.in_(kept)))
+            db.session.commit()
+        moved += len(deleted)
+        content_bytes += sum(len(row.content.encode()) for row in rows if row.id not in kept)
+        if len(rows) < batch_size:
+            return moved, content_bytes
+        time.sleep(pause)
+
+def storage(bind_key=None):
+    """Size of a database in bytes, and on SQLite how much of it is free pages awaiting VACUUM."""
+    engine = db.engines[bind_key]
+    with engine.connect() as connection:
+        if engine.dialect.name == 'sqlite':
+            page_size = connection.exec_driver_sql('PRAGMA page_size').scalar()
+            pages = connection.exec_driver_sql('PRAGMA page_count').scalar()
+            free = connection.exec_driver_sql('PRAGMA freelist_count').scalar()
+            return {'bytes': pages * page_size, 'free_bytes': free * page_size}
+        if engine.dialect.name == 'postgresql':
+            size = connection.exec_driver_sql(
+                "SELECT pg_total_relation_size('message') + pg_total_relation_size('diary_entry')"
+            ).scalar()
+            return {'bytes': size, 'free_bytes': None}
+    return {'bytes': None, 'free_bytes': None}
+
+def vacuum_main():
+    """Hand the space freed by archiving back: VACUUM on SQLite, VACUUM ANALYZE of the hot tables on Postgres.
+
+    SQLite's VACUUM rewrites the whole file under an exclusive lock, so it is
+    only run on request (``flask archive --vacuum``), not by the nightly job.
+    """
+    engine = db.engines[None]
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+        if engine.dialect.name == 'sqlite':
+            connection.exec_driver_sql('VACUUM')
+        elif engine.dialect.name == 'postgresql':
+            connection.exec_driver_sql('VACUUM ANALYZE message, diary_entry')
+
+def archived_messages_page(user_id, cursor=None, per_page=20):
+    """Newest-first page of a user's archived messages; the slow path behind the inbox."""
+    query = ArchivedMessage.query.filter_by(recipient_id=user_id)
+    return keyset_page(query, ArchivedMessage, cursor, per_page)
@@ -0,0 +1,187 @@
+import re
+from sqlalchemy import event, inspect, text
+from mydiary.extensions import db
+from mydiary.models import User, DiaryEntry
+
+# SQLite gets FTS5 tables keyed by the source row id; Postgres gets trigram
+# indexes on the source columns instead.
+SQLITE_SCHEMA = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS user_search USING fts5(username, bio, prefix='2 3')",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS entry_search USING fts5(content, user_id UNINDEXED, prefix='2 3')",
+]
+POSTGRES_SCHEMA = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS ix_user_username_trgm ON "user" USING gin (username gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_user_bio_trgm ON "user" USING gin (bio gin_trgm_ops)',
+    'CREATE INDEX IF NOT EXISTS ix_diary_entry_content_trgm ON diary_entry USING gin (content gin_trgm_ops) WHERE is_public',
+]
+
+def _is_sqlite(connection):
+    return connection.dialect.name == 'sqlite'
+
+def create_schema(connection):
+    statements = SQLITE_SCHEMA if _is_sqlite(connection) else POSTGRES_SCHEMA
+    for statement in statements:
+        connection.execute(text(statement))
+
+@event.listens_for(db.metadata, 'after_create')
+def _create_search_tables(target, connection, **kw):
+    if connection.dialect.name in ('sqlite', 'postgresql'):
+        create_schema(connection)
+
+def match_expression(query):
+    """Turn free text into an FTS5 prefix query: every word must match the start of a token."""
+    terms = re.findall(r'\w+', query.lower())
+    return ' '.join(f'"{term}"*' for term in terms)
+
+def search_users(query, limit=10):
+    """Return (username, bio) rows for the best matches, best first.
+
+    Usernames starting with the query come first, straight off the username
+    index; the FTS index fills the rest. Ranking a one- or two-letter prefix
+    would mean scoring a large share of the table, so short terms are
+    returned in index order instead.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return _trigram_users(query, limit)
+    match = match_expression(query)
+    if not match:
+        return []
+
+    prefix = query.strip()
+    ids = [row[0] for row in db.session.query(User.id).filter(
+        User.username >= prefix, User.username < prefix + '\U0010ffff'
+    ).order_by(User.username).limit(limit)]
+
+    if len(ids) < limit:
+        ranked = all(len(term) >= 3 for term in re.findall(r'\w+', query))
+        order = 'ORDER BY bm25(user_search, 10.0, 1.0) ' if ranked else ''
+        ids += [row[0] for row in db.session.execute(
+            text(f'SELECT rowid FROM user_search WHERE user_search MATCH :match {order}LIMIT :limit'),
+            {'match': match, 'limit': limit + len(ids)},
+        ) if row[0] not in ids][:limit - len(ids)]
+    return _in_order(User, ids, User.username, User.bio)
+
+def search_entries(query, limit=10):
+    """Return (id, username, content) rows for matching public diary entries."""
+    if db.engine.dialect.name != 'sqlite':
+        return _trigram_entries(query, limit)
+    match = match_expression(query)
+    if not match:
+        return []
+    ids = [row[0] for row in db.session.execute(
+        text('SELECT rowid FROM entry_search WHERE entry_search MATCH :match '
+             'ORDER BY bm25(entry_search) LIMIT :limit'),
+        {'match': match, 'limit': limit},
+    )]
+    return _in_order(DiaryEntry, ids, DiaryEntry.id, User.username, DiaryEntry.content, join=User)
+
+def rebuild():
+    """Repopulate the search index from the source tables."""
+    connection = db.session.connection()
+    if not _is_sqlite(connection):
+        create_schema(connection)
+        db.session.commit()
+        return
+    create_schema(connection)
+    connection.execute(text('DELETE FROM user_search'))
+    connection.execute(text('DELETE FROM entry_search'))
+    connection.execute(text('INSERT INTO user_search (rowid, username, bio) SELECT id, username, bio FROM user'))
+    connection.execute(text(
+        'INSERT INTO entry_search (rowid, content, user_id) '
+        'SELECT id, content, user_id FROM diary_entry WHERE is_public'
+    ))
+    connection.execute(text("INSERT INTO user_search (user_search) VALUES ('optimize')"))
+    connection.execute(text("INSERT INTO entry_search (entry_search) VALUES ('optimize')"))
+    db.session.commit()
+
+def backfill():
+    """Rebuild the index if it is empty while the source tables are not; returns True if it did.
+
+    Databases from before search existed get the FTS tables created empty,
+    and the model hooks only index rows written after that.
+    """
+    if db.engine.dialect.name != 'sqlite':
+        return False
+    users_missing = _has_rows('SELECT 1 FROM user') and not _has_rows('SELECT 1 FROM user_search')
+    entries_missing = (_has_rows('SELECT 1 FROM diary_entry WHERE is_public')
+                       and not _has_rows('SELECT 1 FROM entry_search'))
+    if not (users_missing or entries_missing):
+        return False
+    rebuild()
+    return True
+
+def _has_rows(query):
+    return db.session.execute(text(f'SELECT EXISTS ({query})')).scalar()
+
+def _in_order(model, ids, *columns, join=None):
+    if not ids:
+        return []
+    query = db.session.query(model.id, *columns)
+    if join is not None:
+        query = query.join(join)
+    rows = {row[0]: row[1:] for row in query.filter(model.id.in_(ids))}
+    return [rows[i] for i in ids if i in rows]
+
+def _trigram_users(query, limit):
+    query = query.strip()
+    if not query:
+        return []
+    return db.session.query(User.username, User.bio).filter(
+        db.or_(User.username.istartswith(query, autoescape=True), User.bio.icontains(query, autoescape=True))
+    ).order_by(db.func.similarity(User.username, query).desc()).limit(limit).all()
+
+def _trigram_entries(query, limit):
+    query = query.strip()
+    if not query:
+        return []
+    return db.session.query(DiaryEntry.id, User.username, DiaryEntry.content).join(User).filter(
+        DiaryEntry.is_public.is_(True), DiaryEntry.content.icontains(query, autoescape=True)
+    ).order_by(DiaryEntry.created_at.desc()).limit(limit).all()
+
+# Index maintenance. Runs inside the flush, so the index commits with the row.
+
+def _changed(target, *attrs):
+    state = inspect(target)
+    return any(state.attrs[attr].history.has_changes() for attr in attrs)
+
+def _index_user(connection, user):
+    connection.execute(text('INSERT INTO user_search (rowid, username, bio) VALUES (:id, :username, :bio)'),
+                       {'id': user.id, 'username': user.username, 'bio': user.bio})
+
+def _index_entry(connection, entry):
+    if entry.is_public:
+        connection.execute(text('INSERT INTO entry_search (rowid, content, user_id) VALUES (:id, :content, :user_id)'),
+                           {'id': entry.id, 'content': entry.content, 'user_id': entry.user_id})
+
+@event.listens_for(User, 'after_insert')
+def _user_created(mapper, connection, target):
+    if _is_sqlite(connection):
+        _index_user(connection, target)
+
+@event.listens_for(User, 'after_update')
+def _user_updated(mapper, connection, target):
+    if _is_sqlite(connection) and _changed(target, 'username', 'bio'):
+        connection.execute(text('DELETE FROM user_search WHERE rowid = :id'), {'id': target.id})
+        _index_user(connection, target)
+
+@event.listens_for(User, 'after_delete')
+def _user_deleted(mapper, connection, target):
+    if _is_sqlite(connection):
+        connection.execute(text('DELETE FROM user_search WHERE rowid = :id'), {'id': target.id})
+
+@event.listens_for(DiaryEntry, 'after_insert')
+def _entry_created(mapper, connection, target):
+    if _is_sqlite(connection):
+        _index_entry(connection, target)
+
+@event.listens_for(DiaryEntry, 'after_update')
+def _entry_updated(mapper, connection, target):
+    if _is_sqlite(connection) and _changed(target, 'content', 'is_public'):
+        connection.execute(text('DELETE FROM entry_search WHERE rowid = :id'), {'id': target.id})
+        _index_entry(connection, target)
+
+@event.listens_for(DiaryEntry, 'after_delete')
+def _entry_deleted(mapper, connection, target):
+    if _is_sqlite(connection):
+        connection.execute(text('DELETE FROM entry_search WHERE rowid = :id'), {'id': target.id})
@@ -0,0 +1,251 @@
+import math
+import re
+import threading
+import zlib
+from bisect import bisect_left, bisect_right
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+from flask import current_app
+
+# Used when SPAM_BLOCKLIST_FILE is not set. Phrases only: words such as
+# 'spam' or 'scam' turn up in ordinary messages about spam.
+DEFAULT_BLOCKLIST = (
+    'free money', 'click here', 'crypto giveaway', 'double your bitcoin',
+    'cash app', 'dm me for', 'check my profile', 'onlyfans', 'kill yourself', 'kys',
+)
+LINK_RE = re.compile(r'https?://|www\.|\b[\w-]+\.(?:com|net|org|io|ru|xyz|top|link)\b', re.IGNORECASE)
+# Shorter texts ('hi', 'love you', emoji) repeat innocently and share too few shingles to compare
+MIN_DUPLICATE_CHARS = 10
+
+class AhoCorasick:
+    """Finds every blocklisted phrase in a text in one pass, however long the list is.
+
+    Phrases only match on word boundaries, so 'kys' does not match 'skys'.
+    """
+
+    def __init__(self, phrases):
+        self.goto = [{}]
+        self.fail = [0]
+        self.out = [()]
+        for phrase in phrases:
+            phrase = phrase.strip().lower()
+            if not phrase:
+                continue
+            node = 0
+            for char in phrase:
+                if char not in self.goto[node]:
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.out.append(())
+                    self.goto[node][char] = len(self.goto) - 1
+                node = self.goto[node][char]
+            self.out[node] += (phrase,)
+
+        # Breadth-first, so every node's fail link is final before its children need it
+        queue = deque(self.goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for char, child in self.goto[node].items():
+                fallback = self.fail[node]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(char, 0)
+                self.out[child] += self.out[self.fail[child]]
+                queue.append(child)
+
+    def find(self, text):
+        text = text.lower()
+        goto, fail, out = self.goto, self.fail, self.out
+        found = []
+        node = 0
+        for i, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+            for phrase in out[node]:
+                start = i - len(phrase) + 1
+                if (start == 0 or not text[start - 1].isalnum()) and (i + 1 == len(text) or not text[i + 1].isalnum()):
+                    found.append(phrase)
+        return found
+
+class NearDuplicates:
+    """MinHash signatures of the last `size` messages, banded for LSH lookups.
+
+    ``add`` returns how many of the remembered messages from the same
+    `scope` (the sender's IP) share at least `threshold` of their
+    5-character shingles with the new one (estimated), then remembers it.
+    """
+
+    def __init__(self, size, bands=4, rows=4, threshold=0.8):
+        self.bands = bands
+        self.rows = rows
+        self.threshold = threshold
+        # XOR masks stand in for independent hash permutations
+        self.masks = [zlib.crc32(str(i).encode()) for i in range(bands * rows)]
+        self.recent = deque(maxlen=size)
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def signature(self, text):
+        text = ' '.join(re.findall(r'\w+', text.lower()))
+        shingles = {zlib.crc32(text[i:i + 5].encode()) for i in range(max(1, len(text) - 4))}
+        return tuple(min(map(mask.__xor__, shingles)) for mask in self.masks)
+
+    def add(self, text, scope):
+        signature = self.signature(text)
+        keys = [(scope, band, signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+        with self.lock:
+            # Identical messages share a signature, so buckets count them
+            candidates = {}
+            for key in keys:
+                candidates.update(self.buckets.get(key, {}))
+            matches = sum(count for other, count in candidates.items()
+                          if sum(a == b for a, b in zip(signature, other)) >= self.threshold * len(signature))
+
+            if len(self.recent) == self.recent.maxlen:
+                old_signature, old_keys = self.recent[0]
+                for key in old_keys:
+                    bucket = self.buckets[key]
+                    bucket[old_signature] -= 1
+                    if not bucket[old_signature]:
+                        del bucket[old_signature]
+                    if not bucket:
+                        del self.buckets[key]
+            self.recent.append((signature, keys))
+            for key in keys:
+                self.buckets.setdefault(key, Counter())[signature] += 1
+        return matches
+
+class SpamScorer:
+    """Scores messages with a logistic model over a few cheap features.
+
+    The features are blocklist hits (Aho-Corasick over SPAM_BLOCKLIST_FILE),
+    links, how many messages the sender's IP sent in SPAM_VELOCITY_WINDOW,
+    near-duplicates among the same IP's messages in the last
+    SPAM_DUPLICATE_WINDOW (MinHash) and the share of capital letters. Messages scoring SPAM_FLAG_THRESHOLD or
+    more are flagged. SPAM_SCORING = 'ingest' scores in the ingest write path;
+    'async' leaves it to the ``score-messages`` job.
+    """
+
+    def init_app(self, app):
+        mode = app.config['SPAM_SCORING']
+        if mode not in ('ingest', 'async', 'off'):
+            raise ValueError(f'Unknown SPAM_SCORING {mode!r}')
+        app.extensions['spam'] = {
+            'matcher': AhoCorasick(_load_blocklist(app.config['SPAM_BLOCKLIST_FILE'])),
+            'duplicates': NearDuplicates(app.config['SPAM_DUPLICATE_WINDOW']),
+        }
+
+    @property
+    def _state(self):
+        return current_app.extensions['spam']
+
+    def features(self, content, sender_ip=None):
+        """The features of one message that do not need the database."""
+        state = self._state
+        letters = [char for char in content if char.isalpha()]
+        duplicates = 0
+        if sender_ip and len(re.findall(r'\w', content)) >= MIN_DUPLICATE_CHARS:
+            duplicates = state['duplicates'].add(content, sender_ip)
+        return {
+            'blocklist': len(state['matcher'].find(content)),
+            'links': min(len(LINK_RE.findall(content)), 5),
+            'near_duplicates': math.log1p(duplicates),
+            'caps': sum(char.isupper() for char in letters) / len(letters) if len(letters) >= 10 else 0.0,
+        }
+
+    def score_batch(self, rows, stored=False):
+        """Set ``spam_score`` on each row dict, and ``is_flagged`` on the ones over the threshold.
+
+        Rows need ``content``, ``sender_ip`` and ``created_at``. With `stored`
+        the rows are already in the message table, so the IP counts include them.
+        """
+        config = current_app.config
+        model = config['SPAM_MODEL']
+        velocity = self._ip_velocity(rows, stored)
+        for row, recent in zip(rows, velocity):
+            features = self.features(row['content'], row.get('sender_ip'))
+            features['ip_velocity'] = math.log1p(recent)
+            z = model['bias'] + sum(model['weights'].get(name, 0) * value for name, value in features.items())
+            row['spam_score'] = round(1 / (1 + math.exp(-z)), 4)
+            if row['spam_score'] >= config['SPAM_FLAG_THRESHOLD']:
+                row['is_flagged'] = True
+        return rows
+
+    def _ip_velocity(self, rows, stored):
+        """For each row, the messages its sender's IP sent in the window up to and including it.
+
+        Rows from before the last window (a backfill of older messages) get
+        0: whatever burst they were part of is over.
+        """
+        from mydiary.extensions import db
+        from mydiary.models import Message
+        messages = Message.__table__
+        window = timedelta(seconds=current_app.config['SPAM_VELOCITY_WINDOW'])
+        cutoff = datetime.utcnow() - window
+        recent = [row for row in rows if row.get('sender_ip') and row['created_at'] >= cutoff]
+        if not recent:
+            return [0] * len(rows)
+
+        sent = defaultdict(list)
+        for ip, created_at in db.session.execute(
+            db.select(messages.c.sender_ip, messages.c.created_at)
+            .where(messages.c.sender_ip.in_({row['sender_ip'] for row in recent}),
+                   messages.c.created_at >= min(row['created_at'] for row in recent) - window,
+                   messages.c.created_at <= max(row['created_at'] for row in recent))
+        ):
+            sent[ip].append(created_at)
+        if not stored:
+            for row in recent:
+                sent[row['sender_ip']].append(row['created_at'])
+        for times in sent.values():
+            times.sort()
+
+        velocity = []
+        for row in rows:
+            if not row.get('sender_ip') or row['created_at'] < cutoff:
+                velocity.append(0)
+                continue
+            times = sent[row['sender_ip']]
+            velocity.append(bisect_right(times, row['created_at']) - bisect_left(times, row['created_at'] - window))
+        return velocity
+
+def _load_blocklist(path):
+    if not path:
+        return DEFAULT_BLOCKLIST
+    with open(path, encoding='utf-8') as f:
+        return [line for line in (line.strip() for line in f) if line and not line.startswith('#')]
+
+def score_pending(batch_size):
+    """Score stored messages that have no score yet, oldest first. Returns how many were scored."""
+    from mydiary.extensions import db, spam
+    from mydiary.models import Message
+    from mydiary.leaderboard import remove_messages as remove_trending
+    from mydiary.stats import apply_deltas
+    messages = Message.__table__
+    update = (messages.update()
+              .where(messages.c.id == db.bindparam('message_id'))
+              .values(spam_score=db.bindparam('score'), is_flagged=db.bindparam('flagged')))
+    scored = 0
+    while True:
+        rows = [dict(row._mapping) for row in db.session.execute(
+            db.select(messages.c.id, messages.c.recipient_id, messages.c.content, messages.c.sender_ip,
+                      messages.c.created_at, messages.c.is_flagged)
+            .where(messages.c.spam_score.is_(None))
+            .order_by(messages.c.id)
+            .limit(batch_size)
+        )]
+        if not rows:
+            return scored
+        was_flagged = {row['id']: row['is_flagged'] for row in rows}
+        spam.score_batch(rows, stored=True)
+        db.session.execute(update, [
+            {'message_id': row['id'], 'score': row['spam_score'], 'flagged': bool(row['is_flagged'])}
+            for row in rows
+        ])
+        flagged = [row for row in rows if row['is_flagged'] and not was_flagged[row['id']]]
+        for user_id, count in Counter(row['recipient_id'] for row in flagged).items():
+            apply_deltas(db.session.connection(), user_id, flagged_count=count)
+        remove_trending(db.session.connection(), flagged)
+        db.session.commit()
+        scored += len(rows)
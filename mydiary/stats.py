@@ -0,0 +1,191 @@
+from collections import Counter, defaultdict
+from sqlalchemy import event, inspect
+from mydiary.extensions import db
+from mydiary.models import User, Message, DiaryEntry, UserStats
+
+stats_table = UserStats.__table__
+
+def get_stats(user_id):
+    """Return the UserStats row for a user, computing it if it is missing."""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        refresh_user(user_id)
+        db.session.commit()
+        # The new row may not have reached a replica yet
+        stats = db.session.get(UserStats, user_id, bind_arguments=_primary())
+    return stats
+
+def site_totals():
+    # user_stats rows can lag behind users that have not been touched yet, so count users directly
+    user_count, message_count, flagged_count = db.session.query(
+        db.select(db.func.count(User.id)).scalar_subquery(),
+        db.func.coalesce(db.func.sum(UserStats.message_count), 0),
+        db.func.coalesce(db.func.sum(UserStats.flagged_count), 0),
+    ).one()
+    return {'user_count': user_count, 'message_count': message_count, 'flagged_count': flagged_count}
+
+def apply_deltas(connection, user_id, **deltas):
+    """Add `deltas` to a user's counters in the current transaction."""
+    deltas = {name: delta for name, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    result = connection.execute(
+        stats_table.update()
+        .where(stats_table.c.user_id == user_id)
+        .values({name: stats_table.c[name] + delta for name, delta in deltas.items()})
+    )
+    if result.rowcount == 0:
+        # No row yet: compute one from scratch, which already includes this change
+        connection.execute(stats_table.insert().values(_compute(connection, user_id)))
+
+def refresh_user(user_id):
+    """Recompute one user's counters; used after set-based UPDATE/DELETE statements.
+
+    Always runs on the primary, also when called from a ``@read_only`` view.
+    """
+    connection = db.session.connection(bind_arguments=_primary())
+    connection.execute(stats_table.delete().where(stats_table.c.user_id == user_id))
+    connection.execute(stats_table.insert().values(_compute(connection, user_id)))
+
+def rebuild():
+    """Recompute every user's counters with one grouped query per table."""
+    messages = db.session.query(
+        Message.recipient_id,
+        db.func.count(Message.id),
+        db.func.sum(db.case((Message.is_read.is_(False), 1), else_=0)),
+        db.func.sum(db.case((Message.is_flagged.is_(True), 1), else_=0)),
+    ).group_by(Message.recipient_id)
+    entries = db.session.query(
+        DiaryEntry.user_id,
+        db.func.count(DiaryEntry.id),
+        db.func.sum(db.case((DiaryEntry.is_public.is_(True), 1), else_=0)),
+    ).group_by(DiaryEntry.user_id)
+
+    rows = {user_id: _empty(user_id) for (user_id,) in db.session.query(User.id)}
+    for user_id, total, unread, flagged in messages:
+        if user_id in rows:
+            rows[user_id].update(message_count=total, unread_count=unread or 0, flagged_count=flagged or 0)
+    for user_id, total, public in entries:
+        if user_id in rows:
+            rows[user_id].update(entry_count=total, public_entry_count=public or 0)
+
+    db.session.execute(stats_table.delete())
+    if rows:
+        db.session.execute(stats_table.insert(), list(rows.values()))
+    db.session.commit()
+    return len(rows)
+
+def backfill():
+    """Rebuild the counters if some users have no user_stats row yet; returns the users rebuilt.
+
+    Databases from before the table existed start with it empty, and its
+    totals stay wrong until every user has a row.
+    """
+    users = db.session.query(db.func.count(User.id)).scalar()
+    if db.session.query(db.func.count(UserStats.user_id)).scalar() >= users:
+        return 0
+    return rebuild()
+
+def reconcile_unread(batch_size=1000):
+    """Reset unread counters that drifted from the message table, `batch_size` users per statement.
+
+    Each UPDATE recounts through the partial ix_message_unread index and only
+    writes the counters that differ, all in one statement, so a message
+    arriving meanwhile cannot be counted twice. Returns the number corrected.
+    """
+    messages = Message.__table__.c
+    actual = (db.select(db.func.count())
+              .where(messages.recipient_id == stats_table.c.user_id, messages.is_read == False)
+              .scalar_subquery())
+    corrected = last_id = 0
+    while True:
+        user_ids = db.session.execute(
+            db.select(stats_table.c.user_id).where(stats_table.c.user_id > last_id)
+            .order_by(stats_table.c.user_id).limit(batch_size)
+        ).scalars().all()
+        if not user_ids:
+            return corrected
+        last_id = user_ids[-1]
+        corrected += db.session.execute(
+            stats_table.update()
+            .where(stats_table.c.user_id.in_(user_ids), stats_table.c.unread_count != actual)
+            .values(unread_count=actual)
+        ).rowcount
+        db.session.commit()
+
+def record_messages(connection, rows):
+    """Counter updates for messages written in bulk, which bypass the mapper events."""
+    per_user = defaultdict(Counter)
+    for row in rows:
+        counts = per_user[row['recipient_id']]
+        counts['message_count'] += 1
+        counts['unread_count'] += not row.get('is_read', False)
+        counts['flagged_count'] += bool(row.get('is_flagged', False))
+    for user_id, counts in per_user.items():
+        apply_deltas(connection, user_id, **counts)
+
+def _primary():
+    return {'bind': db.engines[None]}
+
+def _empty(user_id):
+    return dict(user_id=user_id, message_count=0, unread_count=0, flagged_count=0,
+                entry_count=0, public_entry_count=0)
+
+def _compute(connection, user_id):
+    messages = Message.__table__.c
+    entries = DiaryEntry.__table__.c
+    message_count, unread_count, flagged_count = connection.execute(
+        db.select(
+            db.func.count(messages.id),
+            db.func.coalesce(db.func.sum(db.case((messages.is_read.is_(False), 1), else_=0)), 0),
+            db.func.coalesce(db.func.sum(db.case((messages.is_flagged.is_(True), 1), else_=0)), 0),
+        ).where(messages.recipient_id == user_id)
+    ).one()
+    entry_count, public_entry_count = connection.execute(
+        db.select(
+            db.func.count(entries.id),
+            db.func.coalesce(db.func.sum(db.case((entries.is_public.is_(True), 1), else_=0)), 0),
+        ).where(entries.user_id == user_id)
+    ).one()
+    return dict(user_id=user_id, message_count=message_count, unread_count=unread_count,
+                flagged_count=flagged_count, entry_count=entry_count,
+                public_entry_count=public_entry_count)
+
+def _flipped(target, attr):
+    """+1/-1 when a boolean column changed in this flush, else 0."""
+    history = inspect(target).attrs[attr].history
+    if not history.has_changes() or not history.deleted:
+        return 0
+    return int(bool(history.added[0])) - int(bool(history.deleted[0]))
+
+@event.listens_for(User, 'after_insert')
+def _user_created(mapper, connection, target):
+    connection.execute(stats_table.insert().values(_empty(target.id)))
+
+@event.listens_for(Message, 'after_insert')
+def _message_created(mapper, connection, target):
+    apply_deltas(connection, target.recipient_id, message_count=1,
+                 unread_count=int(not target.is_read), flagged_count=int(bool(target.is_flagged)))
+
+@event.listens_for(Message, 'after_update')
+def _message_updated(mapper, connection, target):
+    apply_deltas(connection, target.recipient_id,
+                 unread_count=-_flipped(target, 'is_read'),
+                 flagged_count=_flipped(target, 'is_flagged'))
+
+@event.listens_for(Message, 'after_delete')
+def _message_deleted(mapper, connection, target):
+    apply_deltas(connection, target.recipient_id, message_count=-1,
+                 unread_count=-int(not target.is_read), flagged_count=-int(bool(target.is_flagged)))
+
+@event.listens_for(DiaryEntry, 'after_insert')
+def _entry_created(mapper, connection, target):
+    apply_deltas(connection, target.user_id, entry_count=1, public_entry_count=int(bool(target.is_public)))
+
+@event.listens_for(DiaryEntry, 'after_update')
+def _entry_updated(mapper, connection, target):
+    apply_deltas(connection, target.user_id, public_entry_count=_flipped(target, 'is_public'))
+
+@event.listens_for(DiaryEntry, 'after_delete')
+def _entry_deleted(mapper, connection, target):
+    apply_deltas(connection, target.user_id, entry_count=-1, public_entry_count=-int(bool(target.is_public)))
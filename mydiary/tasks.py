@@ -0,0 +1,70 @@
+"""Built-in background tasks, run by `flask worker` (see mydiary.jobs)."""
+from datetime import datetime, timedelta
+from flask import current_app
+from mydiary import leaderboard, moderation, retention, search, stats
+from mydiary.extensions import db, jobs
+from mydiary.models import Job
+from mydiary.spam import score_pending
+
+@jobs.task(concurrency=1)
+def rebuild_stats():
+    stats.rebuild()
+
+@jobs.task(concurrency=1)
+def reconcile_unread():
+    corrected = stats.reconcile_unread(current_app.config['INBOX_BULK_BATCH_SIZE'])
+    if corrected:
+        current_app.logger.warning('Corrected %s drifted unread counters', corrected)
+
+@jobs.task(concurrency=1)
+def refresh_leaderboard():
+    leaderboard.refresh()
+
+@jobs.task(concurrency=1)
+def rebuild_leaderboard():
+    for name in current_app.config['LEADERBOARD_BOARDS']:
+        leaderboard.rebuild(name)
+
+@jobs.task(concurrency=1)
+def rebuild_search():
+    search.rebuild()
+
+@jobs.task(concurrency=1, timeout=3600)
+def purge_read_messages(days=None):
+    days = days or current_app.config['PURGE_READ_MESSAGES_AFTER_DAYS']
+    deleted = moderation.purge_read_messages(datetime.utcnow() - timedelta(days=days),
+                                             current_app.config['INBOX_BULK_BATCH_SIZE'])
+    current_app.logger.info('Purged %s read messages older than %s days', deleted, days)
+
+@jobs.task(concurrency=1)
+def score_messages():
+    # One at a time: the near-duplicate memory lives in the worker process
+    if current_app.config['SPAM_SCORING'] != 'off':
+        score_pending(current_app.config['INGEST_BATCH_SIZE'])
+
+@jobs.task(concurrency=1, timeout=3600)
+def archive_old_data():
+    report = retention.archive_old_data()
+    current_app.logger.info('Archived %s messages and %s entries (%s bytes of text)',
+                            report['messages'], report['entries'], report['content_bytes'])
+
+# Continuations of the inbox bulk endpoints past INBOX_BULK_MAX_ROWS
+
+@jobs.task()
+def mark_all_read(user_id):
+    while moderation.mark_all_read(user_id, current_app.config['INBOX_BULK_BATCH_SIZE'],
+                                   current_app.config['INBOX_BULK_MAX_ROWS'])[1]:
+        pass
+
+@jobs.task()
+def delete_matching(user_id, filters):
+    criteria = moderation.message_filters(filters)
+    while moderation.delete_messages(user_id, criteria, current_app.config['INBOX_BULK_BATCH_SIZE'],
+                                     current_app.config['INBOX_BULK_MAX_ROWS'])[1]:
+        pass
+
+@jobs.task(retries=0, concurrency=1)
+def prune_jobs():
+    cutoff = datetime.utcnow() - timedelta(days=current_app.config['JOB_KEEP_FINISHED_DAYS'])
+    Job.query.filter(Job.status.in_(['done', 'failed']), Job.finished_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()